@@ -5,27 +5,11 @@ YouTube風動画を全自動生成するアプリケーション
 
 import streamlit as st
 import os
-import tempfile
-import shutil
 
-# フォント検出（moviepyがなくても動作するように）
-# video_generator.pyからFONT_PATHを取得する代わりに、直接フォントパスを確認
-POSSIBLE_FONT_PATHS = [
-    "C:/Windows/Fonts/msgothic.ttc",  # MS ゴシック
-    "C:/Windows/Fonts/msmincho.ttc",   # MS 明朝
-    "C:/Windows/Fonts/meiryo.ttc",     # メイリオ
-    "C:/Windows/Fonts/yugothic.ttf",   # 游ゴシック
-]
+# 初期化は軽いruntimeモジュールで行う（OpenAIクライアントや動画生成用のライブラリは、実際に使う時だけ読み込む）
+from runtime import load_env, validate_api_key, get_font_path
 
-FONT_PATH = None
-for path in POSSIBLE_FONT_PATHS:
-    if os.path.exists(path):
-        FONT_PATH = path
-        break
-
-# 動画生成機能は実際に使う時だけインポート
-# from utils import generate_script, generate_audio, generate_image
-# from video_generator import create_video
+load_env()
 
 # ページ設定
 st.set_page_config(
@@ -40,10 +24,7 @@ st.markdown("---")
 
 # 起動時の環境変数チェック
 def check_environment():
-    """起動時に環境変数とAPIキーをチェック"""
-    from utils import client, client_error, validate_api_key
-    import os
-    
+    """起動時に環境変数とAPIキーをチェック（APIキーの形式だけを確認し、クライアントは生成開始時に作る）"""
     errors = []
     warnings = []
     
@@ -55,8 +36,6 @@ def check_environment():
         is_valid, error_msg = validate_api_key(api_key)
         if not is_valid:
             errors.append(f"❌ APIキーの設定に問題があります: {error_msg}")
-        elif client is None:
-            errors.append(f"❌ OpenAIクライアントの初期化に失敗しました: {client_error}")
         else:
             # APIキーが正しく設定されていることを確認
             masked_key = api_key[:10] + "..." + api_key[-4:] if len(api_key) > 14 else "***"
@@ -67,6 +46,9 @@ def check_environment():
 # 環境チェックを実行
 env_errors, env_warnings = check_environment()
 
+# フォントを検出（.env.localのTUBEAUTO_FONT_PATHが読み込まれた後に行う。結果はプロセス内でキャッシュされる）
+FONT_PATH = get_font_path()
+
 # サイドバーに設定を配置
 with st.sidebar:
     st.header("⚙️ 設定")
@@ -88,6 +70,12 @@ with st.sidebar:
     else:
         st.warning("⚠️ 日本語フォントが見つかりません。字幕が正しく表示されない可能性があります。")
     
+    # サーバーの混雑状況（すべてのユーザーの生成で共有）
+    from job_runner import get_runner
+    server_stats = get_runner().stats()
+    st.caption(f"🖥️ 生成中 {server_stats['running']}/{server_stats['max_jobs']}件、"
+               f"実行待ち {server_stats['queued']}件（レンダリング {server_stats['render_workers']}並列）")
+    
     # 環境情報の表示（展開可能）
     with st.expander("🔍 環境情報（デバッグ用）"):
         import sys
@@ -101,39 +89,40 @@ Pythonバージョン:
 {os.getcwd()}
 """)
         
-        # ライブラリのチェック
-        libraries_status = []
-        try:
-            import cv2
-            libraries_status.append(("✅", "opencv-python-headless", cv2.__version__))
-        except ImportError:
-            libraries_status.append(("❌", "opencv-python-headless", "未インストール"))
+        # ライブラリのチェック（インポートせずに、インストールされているバージョンだけを調べる）
+        import importlib.metadata
+        import importlib.util
         
-        try:
-            import pydub
-            # pydubには__version__属性がない場合があるため、安全に取得
-            try:
-                version = pydub.__version__
-            except AttributeError:
-                # importlib.metadataを使用してバージョンを取得
+        def library_status(import_name, *dist_names):
+            if importlib.util.find_spec(import_name) is None:
+                return ("❌", dist_names[0], "未インストール")
+            for dist_name in dist_names:
                 try:
-                    import importlib.metadata
-                    version = importlib.metadata.version('pydub')
-                except:
-                    version = "インストール済み"
-            libraries_status.append(("✅", "pydub", version))
-        except ImportError:
-            libraries_status.append(("❌", "pydub", "未インストール"))
+                    return ("✅", dist_name, importlib.metadata.version(dist_name))
+                except importlib.metadata.PackageNotFoundError:
+                    continue
+            return ("✅", dist_names[0], "インストール済み")
         
-        try:
-            import numpy
-            libraries_status.append(("✅", "numpy", numpy.__version__))
-        except ImportError:
-            libraries_status.append(("❌", "numpy", "未インストール"))
+        libraries_status = [
+            library_status("cv2", "opencv-python-headless", "opencv-python"),
+            library_status("pydub", "pydub"),
+            library_status("numpy", "numpy"),
+        ]
         
         st.markdown("**ライブラリの状態:**")
         for status, lib_name, version in libraries_status:
             st.text(f"{status} {lib_name}: {version}")
+        
+        # 起動時間の診断（python runtime.py importtime と同じ）
+        if st.button("⏱️ インポート時間を計測"):
+            from runtime import DIAGNOSTIC_MODULES, importtime_report
+            for module in DIAGNOSTIC_MODULES:
+                report = importtime_report(module, top=3)
+                if report["error"]:
+                    st.text(f"❌ {module}: {report['error']}")
+                    continue
+                heaviest = "、".join(f"{name} {ms:.0f}ms" for name, ms in report["heaviest"])
+                st.text(f"{module}: {report['total_ms']:.0f} ms（{heaviest}）")
 
 # メインコンテンツ
 st.markdown("### 📝 動画のテーマを入力してください")
@@ -145,8 +134,47 @@ theme = st.text_input(
     label_visibility="collapsed"
 )
 
+# 生成方法のオプション
+pipelined = st.checkbox(
+    "台本・素材の生成と動画の合成を並行して行う（パイプライン生成、ffmpegが必要）",
+    value=True,
+    help="台本は完成したセクションから順に受け取り、すぐに画像と音声の生成を始めます。"
+         "画像と音声がそろったセクションから順にレンダリングし、API待ちとレンダリングを重ねます。"
+)
+refresh = st.checkbox(
+    "キャッシュを使わずに再生成する",
+    value=False,
+    help="同じテーマ・ナレーション・プロンプトの台本、音声、画像は通常キャッシュから再利用します。"
+)
+restart = st.checkbox(
+    "途中まで生成したジョブを使わずに最初からやり直す",
+    value=False,
+    help="同じテーマのジョブが途中で止まっている場合、通常は生成済みの台本と素材を使って続きから再開します。"
+)
+
 # 動画生成ボタン
-if st.button("🚀 動画生成開始", type="primary", use_container_width=True):
+start = st.button("🚀 動画生成開始", type="primary", use_container_width=True)
+
+# 途中で止まったジョブの再開（ジョブの記録は軽いjobモジュールで読む。実行中のものは除く）
+from job import JOBS_DIR, job_dir_for, list_jobs
+from job_runner import ACTIVE_STATES, get_runner
+active_job_dirs = get_runner().active_job_dirs()
+unfinished_jobs = [job for job in list_jobs(JOBS_DIR, unfinished=True) if job["job_dir"] not in active_job_dirs]
+if unfinished_jobs:
+    with st.expander(f"⏯️ 途中で止まったジョブ（{len(unfinished_jobs)}件）"):
+        selected_job = st.selectbox(
+            "再開するジョブ",
+            unfinished_jobs,
+            format_func=lambda job: f"{job['theme']}（{job['sections']}セクション、"
+                                    + "、".join(f"{k}: {v}" for k, v in job["stages"].items()) + "）",
+        )
+        if selected_job["error"]:
+            st.caption(f"前回のエラー: {selected_job['error']}")
+        if st.button("▶️ 続きから再開", use_container_width=True):
+            theme = selected_job["theme"]
+            start = True
+
+if start:
     if not theme:
         st.error("❌ テーマを入力してください。")
     else:
@@ -205,135 +233,153 @@ if st.button("🚀 動画生成開始", type="primary", use_container_width=True
             st.info("💡 または: `pip install -r requirements.txt`")
             st.stop()
         
-        # すべてのライブラリが揃っている場合のみインポート
-        try:
-            from utils import generate_script, generate_audio, generate_image
-            from video_generator import create_video
-        except ImportError as e:
-            st.error(f"❌ モジュールのインポートに失敗しました: {str(e)}")
-            st.code(f"Python実行パス: {python_path}\nPythonバージョン: {python_version}")
-            st.info("💡 Streamlitアプリを再起動してください: `python -m streamlit run app.py`")
-            st.stop()
-        
         # APIキーの確認（既にサイドバーでチェック済みだが、念のため）
         if env_errors:
             st.error("❌ 環境設定に問題があります。サイドバーを確認してください。")
             st.stop()
         
-        from utils import client
+        from runtime import get_client
+        client, client_error = get_client()
         if client is None:
-            st.error("❌ OpenAI APIキーが正しく設定されていません。`.env.local`ファイルを確認してください。")
+            st.error(f"❌ OpenAIクライアントの初期化に失敗しました: {client_error}")
             st.stop()
+        
+        # サーバー側で実行する（同じテーマは同じジョブになり、前回失敗した場合は続きから再開する。
+        # 同じテーマが実行中の場合は、その実行の進捗を表示する）
+        run_id = get_runner().submit(
+            theme, job_dir_for(theme, JOBS_DIR), pipelined=pipelined, refresh=refresh, restart=restart
+        )
+        st.session_state["run_id"] = run_id
+        # ページを再読み込みしても同じ実行を表示できるよう、URLにも保存する
+        st.query_params["job"] = run_id
+
+
+# 生成の進捗と結果の表示
+PROGRESS_LABELS = {"script": "台本", "image": "画像", "audio": "音声", "render": "動画セグメント"}
+
+
+def format_eta(seconds: float | None) -> str:
+    """残り時間の見込みを表示用の文字列にする"""
+    if seconds is None:
+        return "不明"
+    if seconds < 60:
+        return "1分以内"
+    return f"約{seconds / 60:.0f}分"
+
+
+def show_progress(status: dict) -> None:
+    """実行中のジョブの進捗を表示する"""
+    if status["status"] == "queued":
+        st.info(f"⏳ 「{status['theme']}」の実行待ちです（{status['queue_position']}番目、"
+                f"完了まで{format_eta(status['eta_seconds'])}）。"
+                "他のユーザーの生成が終わりしだい開始します。")
+    else:
+        st.info(f"🎬 「{status['theme']}」を生成中です（{status['elapsed']:.0f}秒経過、"
+                f"残り{format_eta(status['eta_seconds'])}）。"
+                "このページを閉じたり再読み込みしたりしても、生成は続きます。")
+    st.progress(status["progress"])
+    for kind, index in reversed(status["events"][-5:]):
+        st.caption(f"✅ セクション{index + 1}の{PROGRESS_LABELS[kind]}生成完了")
+    
+    if status["cancel_requested"]:
+        st.warning("⏹️ キャンセルしています...")
+    elif st.button("⏹️ キャンセル", key=f"cancel_{status['run_id']}"):
+        get_runner().cancel(status["run_id"])
+        st.rerun()
+
+
+def show_result(status: dict) -> None:
+    """終了したジョブの結果（動画、エラー）を表示する"""
+    if status["status"] == "cancelled":
+        st.warning("⏹️ 生成をキャンセルしました。生成済みの台本と素材は保存されているので、続きから再開できます。")
+        return
+    
+    if status["status"] == "failed":
+        st.error(f"❌ エラーが発生しました: {status['error']}")
+        # エラーの種類に応じて適切なヒントを表示
+        error_str = status["error"] or ""
+        if "ffmpeg" in error_str.lower() or "WinError 2" in error_str:
+            st.info("💡 ヒント: ffmpegが見つからない場合は、音声なしの動画が生成されます。\n"
+                   "音声付き動画が必要な場合は、ffmpegをインストールしてください: https://ffmpeg.org/download.html")
+        elif "ファイルが見つかりません" in error_str or "file not found" in error_str.lower():
+            st.info("💡 ヒント: 画像や音声ファイルのパスを確認してください。\n"
+                   f"ジョブのディレクトリを確認してください: {status['job_dir']}")
         else:
-            # 一時ディレクトリを作成
-            temp_dir = tempfile.mkdtemp()
+            st.info("💡 生成済みの台本と素材は保存されています。もう一度「動画生成開始」を押すか、"
+                    "「途中で止まったジョブ」から続きを再開できます。")
+        return
+    
+    st.success(f"✅ 動画生成完了！（{status['elapsed']:.0f}秒）")
+    
+    # 生成された動画を表示
+    st.markdown("---")
+    st.markdown("### 🎉 生成された動画")
+    
+    final_video_path = status["video_path"]
+    if final_video_path and os.path.exists(final_video_path):
+        # 動画配信サーバーを設定している場合は、ディスクから配信する（バイト列を読み込まないので、
+        # 動画が大きくてもメモリを使わない）。ブラウザは別のポートから動画を取得するため、
+        # TUBEAUTO_MEDIA_PORT に固定のポートを設定し、ブラウザから届くようにしておく必要がある
+        # （リモートやHTTPSのページでは TUBEAUTO_MEDIA_URL にブラウザから見たURLも設定する）。
+        # 設定していない場合は、同じオリジンで届く st.video() と st.download_button() で表示する
+        from media_server import get_media_server
+        try:
+            media_server = get_media_server()
+        except OSError as e:
+            st.warning(f"⚠️ 動画配信サーバーを起動できませんでした: {e}")
+            media_server = None
+        
+        if media_server is not None:
+            st.video(media_server.url_for(final_video_path))
+            st.link_button(
+                "📥 動画をダウンロード",
+                media_server.url_for(final_video_path, download=True, filename="generated_video.mp4"),
+                use_container_width=True
+            )
+        else:
+            # バイト列ではなくパスを渡す（再実行のたびに動画をセッションのメモリに読み込まない）
+            st.video(final_video_path)
+            
+            def read_video() -> bytes:
+                """ダウンロードボタンが押されたときだけ動画を読み込む"""
+                with open(final_video_path, "rb") as video_file:
+                    return video_file.read()
             
-            try:
-                # 進捗状況を表示するためのステータス
-                status = st.status("🎬 動画生成を開始します...", expanded=True)
-                
-                with status:
-                    st.write("📝 ステップ 1/5: 台本を生成中...")
-                    progress_bar = st.progress(0)
-                    
-                    try:
-                        # 台本を生成
-                        script_data = generate_script(theme)
-                        st.success(f"✅ 台本生成完了（{len(script_data)}セクション）")
-                        progress_bar.progress(20)
-                    except Exception as e:
-                        st.error(f"❌ 台本生成エラー: {str(e)}")
-                        raise
-                    
-                    # 各セクションの画像と音声を生成
-                    for i, section in enumerate(script_data):
-                        section_num = i + 1
-                        total_sections = len(script_data)
-                        
-                        st.write(f"🎨 ステップ {section_num * 2}/5: セクション{section_num}の画像を生成中...")
-                        try:
-                            image_path = os.path.join(temp_dir, f"image_{i}.png")
-                            generated_image_path = generate_image(
-                                section["visual_prompt"],
-                                os.path.join(temp_dir, f"image_{i}")
-                            )
-                            # ファイルを移動
-                            if generated_image_path != image_path:
-                                shutil.move(generated_image_path, image_path)
-                            section["image_path"] = image_path
-                            st.success(f"✅ セクション{section_num}の画像生成完了")
-                        except Exception as e:
-                            st.error(f"❌ 画像生成エラー（セクション{section_num}）: {str(e)}")
-                            raise
-                        
-                        progress_bar.progress(20 + (section_num * 30 // total_sections))
-                        
-                        st.write(f"🔊 ステップ {section_num * 2 + 1}/5: セクション{section_num}の音声を生成中...")
-                        try:
-                            audio_path = os.path.join(temp_dir, f"audio_{i}.mp3")
-                            generated_audio_path = generate_audio(
-                                section["text"],
-                                os.path.join(temp_dir, f"audio_{i}")
-                            )
-                            # ファイルを移動
-                            if generated_audio_path != audio_path:
-                                shutil.move(generated_audio_path, audio_path)
-                            section["audio_path"] = audio_path
-                            st.success(f"✅ セクション{section_num}の音声生成完了")
-                        except Exception as e:
-                            st.error(f"❌ 音声生成エラー（セクション{section_num}）: {str(e)}")
-                            raise
-                        
-                        progress_bar.progress(20 + ((section_num * 2) * 30 // total_sections))
-                    
-                    st.write("🎬 ステップ 5/5: 動画を合成中...")
-                    try:
-                        output_path = os.path.join(temp_dir, "output.mp4")
-                        # 絶対パスに変換
-                        output_path = os.path.abspath(output_path)
-                        final_video_path = create_video(script_data, output_path)
-                        st.success("✅ 動画生成完了！")
-                        progress_bar.progress(100)
-                    except Exception as e:
-                        st.error(f"❌ 動画生成エラー: {str(e)}")
-                        raise
-                
-                # 生成された動画を表示
-                st.markdown("---")
-                st.markdown("### 🎉 生成された動画")
-                
-                if os.path.exists(final_video_path):
-                    video_file = open(final_video_path, "rb")
-                    video_bytes = video_file.read()
-                    st.video(video_bytes)
-                    
-                    # ダウンロードボタン
-                    st.download_button(
-                        label="📥 動画をダウンロード",
-                        data=video_bytes,
-                        file_name="generated_video.mp4",
-                        mime="video/mp4",
-                        use_container_width=True
-                    )
-                else:
-                    st.error("❌ 動画ファイルが見つかりません。")
-                    
-            except Exception as e:
-                st.error(f"❌ エラーが発生しました: {str(e)}")
-                # エラーの種類に応じて適切なヒントを表示
-                error_str = str(e)
-                if "ffmpeg" in error_str.lower() or "WinError 2" in error_str:
-                    st.info("💡 ヒント: ffmpegが見つからない場合は、音声なしの動画が生成されます。\n"
-                           "音声付き動画が必要な場合は、ffmpegをインストールしてください: https://ffmpeg.org/download.html")
-                elif "ファイルが見つかりません" in error_str or "file not found" in error_str.lower():
-                    st.info("💡 ヒント: 画像や音声ファイルのパスを確認してください。\n"
-                           "一時ディレクトリのパスが正しく設定されているか確認してください。")
-                else:
-                    st.info("💡 ヒント: エラーの詳細を確認してください。必要に応じて、アプリを再起動してください。")
-            finally:
-                # 一時ファイルをクリーンアップ（オプション: デバッグ時はコメントアウト）
-                # shutil.rmtree(temp_dir, ignore_errors=True)
-                pass
+            # ダウンロードボタン
+            st.download_button(
+                label="📥 動画をダウンロード",
+                data=read_video,
+                file_name="generated_video.mp4",
+                mime="video/mp4",
+                use_container_width=True
+            )
+    else:
+        st.error("❌ 動画ファイルが見つかりません。")
+
+
+@st.fragment(run_every=1.0)
+def job_progress_panel(run_id: str) -> None:
+    """実行中のジョブの進捗を1秒ごとに更新する（この部分だけを再実行し、生成はやり直さない）"""
+    status = get_runner().status(run_id)
+    if status is None or status["status"] not in ACTIVE_STATES:
+        # 終了したらページ全体を再実行して結果を表示する
+        st.rerun()
+    show_progress(status)
+
+
+current_run_id = st.session_state.get("run_id") or st.query_params.get("job")
+if current_run_id:
+    current_status = get_runner().status(current_run_id)
+    st.markdown("---")
+    if current_status is None:
+        # サーバーが再起動された場合など
+        st.warning("⚠️ 生成の記録が見つかりません。「途中で止まったジョブ」から続きを再開できます。")
+        st.session_state.pop("run_id", None)
+        st.query_params.pop("job", None)
+    elif current_status["status"] in ACTIVE_STATES:
+        job_progress_panel(current_run_id)
+    else:
+        show_result(current_status)
 
 # フッター
 st.markdown("---")
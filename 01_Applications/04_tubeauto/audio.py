@@ -0,0 +1,329 @@
+"""
+音声処理モジュール
+音声ファイルをデコードせずにヘッダーから長さを読み取り、
+ナレーションをffmpegのconcat demuxerでそのまま結合できるようにする
+"""
+
+import os
+import wave
+
+# MP3のビットレート表（kbps）。キーは (MPEG1かどうか, レイヤー)
+_MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# MP3のサンプリングレート表。キーはヘッダーのバージョンビット
+_MP3_SAMPLE_RATES = {
+    0b11: [44100, 48000, 32000],  # MPEG1
+    0b10: [22050, 24000, 16000],  # MPEG2
+    0b00: [11025, 12000, 8000],   # MPEG2.5
+}
+
+
+def _parse_mp3_header(data: bytes, pos: int) -> tuple[int, int, int, int] | None:
+    """
+    MP3のフレームヘッダーを解析する
+
+    Args:
+        data: ファイルの内容
+        pos: ヘッダーの位置
+
+    Returns:
+        (フレーム長, フレームあたりのサンプル数, サンプリングレート, サイド情報の長さ)のタプル。
+        ヘッダーとして正しくない場合はNone
+    """
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+
+    version_bits = (data[pos + 1] >> 3) & 0x03
+    layer_bits = (data[pos + 1] >> 1) & 0x03
+    bitrate_index = (data[pos + 2] >> 4) & 0x0F
+    sample_rate_index = (data[pos + 2] >> 2) & 0x03
+    padding = (data[pos + 2] >> 1) & 0x01
+    mono = ((data[pos + 3] >> 6) & 0x03) == 0b11
+
+    if version_bits == 0b01 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version_bits == 0b11
+    layer = 4 - layer_bits
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2:
+        samples = 1152
+        frame_length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 1152 if mpeg1 else 576
+        frame_length = (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+
+    if mpeg1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    return frame_length, samples, sample_rate, side_info
+
+
+def _skip_id3v2(data: bytes) -> int:
+    """先頭のID3v2タグを飛ばした位置を返す"""
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        has_footer = data[5] & 0x10
+        return 10 + size + (10 if has_footer else 0)
+    return 0
+
+
+def _lame_gapless_samples(data: bytes, xing: int, flags: int) -> int:
+    """
+    Xing/Infoヘッダーに続くLAMEタグから、エンコーダーの遅延とパディングのサンプル数を読む
+
+    Args:
+        data: ファイルの内容
+        xing: Xing/Infoヘッダーの位置
+        flags: Xing/Infoヘッダーのフラグ
+
+    Returns:
+        先頭の遅延と末尾のパディングの合計サンプル数（LAMEタグがない場合は0）
+    """
+    # フラグに応じて、フレーム数・バイト数・TOC・品質の各フィールドを飛ばす
+    lame = xing + 8
+    for flag, size in ((0x01, 4), (0x02, 4), (0x04, 100), (0x08, 4)):
+        if flags & flag:
+            lame += size
+    if data[lame:lame + 4] not in (b"LAME", b"Lavc", b"Lavf") or lame + 24 > len(data):
+        return 0
+    value = int.from_bytes(data[lame + 21:lame + 24], "big")
+    return (value >> 12) + (value & 0xFFF)
+
+
+def mp3_duration(path: str) -> float:
+    """
+    MP3の長さを、デコードせずにフレームヘッダーから計算する
+
+    先頭フレームにXing/Info/VBRIヘッダーがあればその総フレーム数を使い
+    （LAMEタグがあればエンコーダーの遅延とパディングを除く）、なければすべてのフレームヘッダーを数える。
+
+    Args:
+        path: MP3ファイルのパス
+
+    Returns:
+        音声の長さ（秒）
+
+    Raises:
+        ValueError: MP3として解析できなかった場合
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    pos = _skip_id3v2(data)
+    total_samples = 0
+    sample_rate = None
+    first = True
+
+    while pos + 4 <= len(data):
+        header = _parse_mp3_header(data, pos)
+        if header is None:
+            if data[pos:pos + 3] == b"TAG":
+                # 末尾のID3v1タグ
+                break
+            # 同期が外れた場合は次のヘッダーを探す
+            pos += 1
+            continue
+
+        frame_length, samples, rate, side_info = header
+        if sample_rate is None:
+            sample_rate = rate
+
+        if first:
+            first = False
+            # VBRヘッダー（Xing/Info または VBRI）があれば総フレーム数を読む
+            xing = pos + 4 + side_info
+            if data[xing:xing + 4] in (b"Xing", b"Info"):
+                flags = int.from_bytes(data[xing + 4:xing + 8], "big")
+                if flags & 0x01:
+                    frames = int.from_bytes(data[xing + 8:xing + 12], "big")
+                    return (frames * samples - _lame_gapless_samples(data, xing, flags)) / sample_rate
+                # フレーム数がない場合は、このフレームを除いて数える
+                pos += frame_length
+                continue
+            vbri = pos + 4 + 32
+            if data[vbri:vbri + 4] == b"VBRI":
+                frames = int.from_bytes(data[vbri + 14:vbri + 18], "big")
+                return frames * samples / sample_rate
+
+        total_samples += samples
+        pos += max(frame_length, 1)
+
+    if sample_rate is None:
+        raise ValueError(f"MP3として解析できませんでした: {path}")
+    return total_samples / sample_rate
+
+
+def wav_duration(path: str) -> float:
+    """
+    WAVの長さをヘッダーから取得する
+
+    Args:
+        path: WAVファイルのパス
+
+    Returns:
+        音声の長さ（秒）
+    """
+    with wave.open(path, "rb") as w:
+        return w.getnframes() / w.getframerate()
+
+
+def ogg_opus_duration(path: str) -> float:
+    """
+    Ogg Opusの長さを、デコードせずに最後のページのグラニュール位置から計算する
+
+    Args:
+        path: Ogg Opusファイルのパス
+
+    Returns:
+        音声の長さ（秒）
+
+    Raises:
+        ValueError: Ogg Opusとして解析できなかった場合
+    """
+    with open(path, "rb") as f:
+        head = f.read(4096)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 65536))
+        tail = f.read()
+
+    # 先頭のOpusHeadから、デコーダーが捨てるサンプル数（pre-skip）を読む
+    opus_head = head.find(b"OpusHead")
+    if head[:4] != b"OggS" or opus_head < 0 or opus_head + 12 > len(head):
+        raise ValueError(f"Ogg Opusとして解析できませんでした: {path}")
+    pre_skip = int.from_bytes(head[opus_head + 10:opus_head + 12], "little")
+
+    # 最後のページのグラニュール位置（48kHzでのサンプル数）
+    last_page = tail.rfind(b"OggS")
+    if last_page < 0 or last_page + 14 > len(tail):
+        raise ValueError(f"Ogg Opusとして解析できませんでした: {path}")
+    granule = int.from_bytes(tail[last_page + 6:last_page + 14], "little", signed=True)
+    return max(0, granule - pre_skip) / 48000
+
+
+def get_audio_duration(audio_path: str) -> float:
+    """
+    音声ファイルの長さを取得する
+
+    MP3・WAV・Ogg Opusはヘッダーだけを読み、デコードしない。
+    それ以外の形式や解析できなかった場合は、pydubでデコードして長さを測る。
+
+    Args:
+        audio_path: 音声ファイルのパス
+
+    Returns:
+        音声の長さ（秒）
+    """
+    ext = os.path.splitext(audio_path)[1].lower()
+    try:
+        if ext == ".mp3":
+            return mp3_duration(audio_path)
+        if ext == ".wav":
+            return wav_duration(audio_path)
+        if ext in (".opus", ".ogg"):
+            return ogg_opus_duration(audio_path)
+    except (ValueError, EOFError, wave.Error):
+        pass
+
+    from pydub import AudioSegment
+    return len(AudioSegment.from_file(audio_path)) / 1000.0  # ミリ秒を秒に変換
+
+
+def write_concat_list(audio_paths: list, list_path: str, durations: list = None) -> str:
+    """
+    ffmpegのconcat demuxer用のリストファイルを書き出す
+
+    ナレーションはこのリストのままffmpegに渡し、Python側ではデコードも結合もしない。
+    concat demuxerは同じ形式（コーデック・サンプリングレート・チャンネル数）のファイルを前提とする。
+
+    Args:
+        audio_paths: 結合するファイルのパス（この順番で結合する）
+        list_path: 書き出すリストファイルのパス
+        durations: ファイルごとの長さ（秒）。指定した場合は長い部分を切り詰め、
+            次のファイルがちょうどこの長さの位置から始まるようにする（短い部分の無音の補完は呼び出し元で行う）
+
+    Returns:
+        リストファイルのパス
+    """
+    with open(list_path, "w", encoding="utf-8") as f:
+        for i, path in enumerate(audio_paths):
+            # シングルクォートはconcat demuxerの書式に合わせてエスケープする
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+            if durations is not None:
+                f.write(f"outpoint {durations[i]:.6f}\nduration {durations[i]:.6f}\n")
+    return list_path
+
+
+class AudioStreamWriter:
+    """
+    ストリーミングで受け取った音声を、届いた順にファイルへ書き込む
+
+    一時ファイル（.part）に書いてから置き換えるため、途中で失敗しても壊れたファイルは残らない。
+    pcm_sample_rateを指定した場合は、受け取った16bitのPCMをWAVとして書き出す
+    （ヘッダーのサンプル数は閉じるときに正確な値になる）。
+    """
+
+    def __init__(self, path: str, pcm_sample_rate: int = None, channels: int = 1):
+        """
+        Args:
+            path: 保存先のパス
+            pcm_sample_rate: PCMのサンプリングレート（Noneの場合は受け取ったバイト列をそのまま書く）
+            channels: PCMのチャンネル数
+        """
+        self.path = path
+        self.temp_path = f"{path}.part"
+        self.pcm_sample_rate = pcm_sample_rate
+        self._pending = b""
+        if pcm_sample_rate:
+            self._file = wave.open(self.temp_path, "wb")
+            self._file.setnchannels(channels)
+            self._file.setsampwidth(2)
+            self._file.setframerate(pcm_sample_rate)
+            self._frame_size = 2 * channels
+        else:
+            self._file = open(self.temp_path, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        """受け取ったバイト列を書き込む"""
+        if self.pcm_sample_rate:
+            # サンプルの途中で区切られた場合は、残りを次のチャンクと合わせて書く
+            data = self._pending + chunk
+            cut = len(data) - len(data) % self._frame_size
+            self._file.writeframesraw(data[:cut])
+            self._pending = data[cut:]
+        else:
+            self._file.write(chunk)
+
+    def close(self) -> str:
+        """
+        書き込みを完了して、保存先に置き換える
+
+        Returns:
+            保存したファイルのパス
+        """
+        self._file.close()
+        os.replace(self.temp_path, self.path)
+        return self.path
+
+    def abort(self) -> None:
+        """書き込みを中止して、一時ファイルを削除する"""
+        try:
+            self._file.close()
+        finally:
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
@@ -0,0 +1,273 @@
+"""
+バッチ生成（コマンドライン）
+テーマのファイル（JSONL・CSV・テキスト）を読み、複数の動画をまとめて生成する
+
+使い方:
+    python batch.py themes.jsonl --output-dir output
+    python batch.py themes.csv --output-dir output --jobs 4 --render-workers 4 --image-concurrency 3
+
+テーマのファイルの形式:
+    JSONL: 1行に1つ {"theme": "日本の四季", "id": "seasons"}（idは省略可）
+    CSV:   ヘッダーに theme 列（id 列は省略可）
+    それ以外: 1行に1つのテーマ
+
+ジョブごとに <output-dir>/<id>/ に動画（video.mp4）と結果（result.json）を書き出す。
+完了済みのジョブ（result.json の status が "done" で、動画が存在するもの）は飛ばし、
+途中で失敗したジョブは記録（manifest.json）から続きを実行する。
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import asyncio
+import argparse
+import platform
+from datetime import datetime, timezone
+
+from job import VIDEO_FILE, job_id_for
+
+# ジョブの結果ファイルの名前
+RESULT_FILE = "result.json"
+
+# ジョブのIDに使える文字（--output-dir の下の1つのディレクトリ名になるもの）
+JOB_ID_PATTERN = re.compile(r"\w[\w.-]*")
+
+
+def load_themes(path: str) -> list:
+    """
+    テーマのファイルを読み込む
+
+    Args:
+        path: テーマのファイル（.jsonl、.csv、それ以外は1行に1テーマ）
+
+    Returns:
+        {"id": ..., "theme": ...} のリスト（idがない場合や、ディレクトリ名に使えない場合はテーマのハッシュから作る）
+
+    Raises:
+        Exception: テーマが1つもない場合
+    """
+    ext = os.path.splitext(path)[1].lower()
+    jobs = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if ext == ".jsonl":
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    raise Exception(f"{path}:{line_no} をJSONとして読み込めませんでした: {str(e)}")
+                jobs.append(item if isinstance(item, dict) else {"theme": str(item)})
+        elif ext == ".csv":
+            jobs.extend(dict(row) for row in csv.DictReader(f))
+        else:
+            jobs.extend({"theme": line.strip()} for line in f if line.strip())
+
+    result = []
+    seen = set()
+    for job in jobs:
+        theme = (job.get("theme") or "").strip()
+        if not theme:
+            continue
+        job_id = str(job.get("id") or "").strip()
+        if job_id and not JOB_ID_PATTERN.fullmatch(job_id):
+            # パスの区切りや .. を含むIDは、--output-dir の外に書き込まないよう使わない
+            print(f"警告: ジョブのIDに使えない文字が含まれています。テーマから作ったIDを使います: {job_id}")
+            job_id = ""
+        job_id = job_id or job_id_for(theme)
+        if job_id in seen:
+            # 同じテーマ（同じid）は1回だけ生成する
+            continue
+        seen.add(job_id)
+        result.append({"id": job_id, "theme": theme})
+
+    if not result:
+        raise Exception(f"テーマが見つかりませんでした: {path}")
+    return result
+
+
+def read_result(job_dir: str) -> dict | None:
+    """ジョブの結果ファイルを読み込む（ない場合や壊れている場合はNone）"""
+    try:
+        with open(os.path.join(job_dir, RESULT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_result(job_dir: str, result: dict) -> None:
+    """ジョブの結果ファイルを書き出す（一時ファイルから置き換える）"""
+    path = os.path.join(job_dir, RESULT_FILE)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def is_completed(job_dir: str) -> bool:
+    """ジョブが完了済みかどうか"""
+    result = read_result(job_dir)
+    return bool(result and result.get("status") == "done"
+                and os.path.exists(os.path.join(job_dir, result.get("video", VIDEO_FILE))))
+
+
+async def run_job(job: dict, args, executor, job_slots: asyncio.Semaphore, workspace=None) -> dict:
+    """
+    1つのジョブ（テーマ -> 台本 -> 画像・音声 -> 動画）を実行する
+
+    Args:
+        job: {"id": ..., "theme": ...}
+        args: コマンドライン引数
+        executor: レンダリング用の共有プロセスプール
+        job_slots: 同時に実行するジョブ数の制限
+        workspace: workspace.Workspace（ジョブ1つあたりの容量の上限を守らせる）
+
+    Returns:
+        ジョブの結果
+    """
+    from job import arun_job
+
+    job_dir = os.path.join(args.output_dir, job["id"])
+    async with job_slots:
+        os.makedirs(job_dir, exist_ok=True)
+        rendered = set()
+        result = {"id": job["id"], "theme": job["theme"], "status": "running",
+                  "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+        write_result(job_dir, result)
+        start = time.perf_counter()
+
+        def on_progress(kind: str, index: int, path: str) -> None:
+            if kind == "render":
+                rendered.add(index)
+            if args.verbose:
+                print(f"[{job['id']}] セクション{index + 1}: {kind}")
+
+        try:
+            # 前回失敗したジョブは、manifest.json の記録から完了した工程と素材を再利用して続きから実行する
+            await arun_job(
+                job["theme"], job_dir, refresh=args.refresh, restart=args.force, on_progress=on_progress,
+                image_concurrency=args.image_concurrency, audio_concurrency=args.audio_concurrency,
+                resolution=args.resolution, fps=args.fps,
+                frame_threads=args.frame_threads, cache_dir=args.cache_dir, executor=executor,
+                workspace=workspace,
+            )
+            result.update(status="done", video=VIDEO_FILE,
+                          video_bytes=os.path.getsize(os.path.join(job_dir, VIDEO_FILE)))
+            print(f"✅ [{job['id']}] {job['theme']}（{time.perf_counter() - start:.1f}秒）")
+        except Exception as e:
+            result.update(status="failed", error=str(e))
+            print(f"❌ [{job['id']}] {job['theme']}: {str(e)}")
+        result.update(seconds=round(time.perf_counter() - start, 2), sections=len(rendered),
+                      finished_at=datetime.now(timezone.utc).isoformat(timespec="seconds"))
+        write_result(job_dir, result)
+        return result
+
+
+async def run_batch(jobs: list, args) -> list:
+    """
+    ジョブをまとめて実行する（レンダリングのプロセスプールとAPIのレート制限はジョブ間で共有する）
+
+    Returns:
+        ジョブの結果のリスト
+    """
+    from pipeline import create_render_executor
+    from workspace import Workspace
+
+    # 出力先の動画は削除しない（保存期間と全体の上限は使わず、前回の異常終了で残った一時ファイルだけを削除する）
+    workspace = Workspace(args.output_dir)
+    workspace.clean_orphans()
+    executor = create_render_executor(args.render_workers)
+    job_slots = asyncio.Semaphore(max(1, args.jobs))
+    try:
+        return await asyncio.gather(*(run_job(job, args, executor, job_slots, workspace) for job in jobs))
+    finally:
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+
+def cpu_seconds() -> float:
+    """このプロセスと子プロセス（レンダリングのワーカー、ffmpeg）が使ったCPU時間（秒）"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def parse_resolution(value: str) -> tuple:
+    """'1920x1080' 形式の解像度を (幅, 高さ) に変換する"""
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"解像度は 幅x高さ の形式で指定してください: {value}")
+    return width, height
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="テーマのファイルから動画をまとめて生成する")
+    parser.add_argument("themes", help="テーマのファイル（.jsonl、.csv、または1行に1テーマのテキスト）")
+    parser.add_argument("--output-dir", default="output", help="出力先のディレクトリ")
+    parser.add_argument("--jobs", type=int, default=2, help="同時に実行するジョブ数")
+    parser.add_argument("--render-workers", type=int, default=None, help="レンダリングのプロセス数（デフォルト: CPUコア数）")
+    parser.add_argument("--frame-threads", type=int, default=1, help="各セクションのフレーム合成のスレッド数")
+    parser.add_argument("--image-concurrency", type=int, default=3, help="ジョブごとの画像生成の同時リクエスト数")
+    parser.add_argument("--audio-concurrency", type=int, default=4, help="ジョブごとの音声生成の同時リクエスト数")
+    parser.add_argument("--resolution", type=parse_resolution, default=None, help="解像度（例: 1280x720）")
+    parser.add_argument("--fps", type=int, default=24, help="フレームレート")
+    parser.add_argument("--cache-dir", default=None, help="セクションのセグメントのキャッシュ")
+    parser.add_argument("--refresh", action="store_true", help="APIキャッシュを使わずに生成し直す")
+    parser.add_argument("--force", action="store_true", help="完了済みのジョブも最初から生成し直す")
+    parser.add_argument("-v", "--verbose", action="store_true", help="セクションごとの進捗を表示する")
+    args = parser.parse_args(argv)
+
+    jobs = load_themes(args.themes)
+    os.makedirs(args.output_dir, exist_ok=True)
+    pending = [job for job in jobs
+               if args.force or not is_completed(os.path.join(args.output_dir, job["id"]))]
+    skipped = len(jobs) - len(pending)
+    print(f"ジョブ: {len(jobs)}件（完了済みのため飛ばす: {skipped}件、実行: {len(pending)}件）")
+    if not pending:
+        return 0
+
+    from rate_limiter import scheduler
+    from utils import run_async
+
+    requests_before = scheduler.stats["requests"]
+    retries_before = scheduler.stats["retries"]
+    cpu_before = cpu_seconds()
+    start = time.perf_counter()
+    results = run_async(run_batch(pending, args))
+    elapsed = time.perf_counter() - start
+    cpu_used = cpu_seconds() - cpu_before
+
+    done = sum(1 for r in results if r["status"] == "done")
+    failed = len(results) - done
+    api_calls = scheduler.stats["requests"] - requests_before
+    summary = {
+        "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "jobs": len(jobs),
+        "skipped": skipped,
+        "done": done,
+        "failed": failed,
+        "seconds": round(elapsed, 2),
+        "videos_per_hour": round(done / elapsed * 3600, 2) if elapsed else 0.0,
+        "api_calls": api_calls,
+        "api_calls_per_second": round(api_calls / elapsed, 3) if elapsed else 0.0,
+        "api_retries": scheduler.stats["retries"] - retries_before,
+        "cpu_utilization": round(cpu_used / (elapsed * (os.cpu_count() or 1)), 3) if elapsed else 0.0,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "results": [{"id": r["id"], "status": r["status"], "seconds": r.get("seconds")} for r in results],
+    }
+    with open(os.path.join(args.output_dir, "batch_summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    print(f"\n完了: {done}件 / 失敗: {failed}件 / {elapsed:.1f}秒")
+    print(f"  動画/時間: {summary['videos_per_hour']}")
+    print(f"  API呼び出し/秒: {summary['api_calls_per_second']}（再試行 {summary['api_retries']}回）")
+    print(f"  CPU使用率: {summary['cpu_utilization'] * 100:.0f}%（{os.cpu_count()}コア）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
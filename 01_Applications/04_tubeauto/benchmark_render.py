@@ -0,0 +1,300 @@
+"""
+動画レンダリングのベンチマーク
+合成した画像と音声（APIを使わない）で create_video() を実行し、
+fps、工程ごとの時間、ピークメモリ、出力サイズを計測する
+
+使い方:
+    python benchmark_render.py
+    python benchmark_render.py --durations 10 60 --sections 3 --resolutions 1280x720 1920x1080 --modes serial parallel
+    python benchmark_render.py --json results.json
+
+各ケースは別プロセスで実行するため、ピークメモリはケースごとに独立して計測される。
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+
+# 計測する工程（表示順）
+STAGES = ["decode", "zoom", "fade", "subtitle", "encode", "mux"]
+
+# レンダリングのモードと create_video() の引数
+# "warm" がTrueのモードは、同じキャッシュで一度レンダリングしてから（計測しない）2回目を計測する
+MODES = {
+    "serial": {},
+    "parallel": {"parallel": True},
+    "cached-cold": {"cache_dir": "cache"},
+    "cached": {"cache_dir": "cache", "warm": True},
+    "opencv": {"encoder": "opencv"},
+}
+
+SAMPLE_RATE = 24000
+
+
+def make_image(path: str, width: int, height: int, seed: int) -> str:
+    """
+    ベンチマーク用の画像を合成する（グラデーションと図形、ノイズ）
+
+    Args:
+        path: 保存先のパス
+        width: 画像の幅
+        height: 画像の高さ
+        seed: 乱数のシード（セクションごとに絵柄を変える）
+
+    Returns:
+        保存した画像のパス
+    """
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[..., 0] = (x / width * 255).astype(np.uint8)
+    img[..., 1] = (y / height * 255).astype(np.uint8)
+    img[..., 2] = seed * 60 % 256
+    for _ in range(12):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, int(rng.integers(20, min(width, height) // 4)), color, -1)
+    # 実際の画像に近い圧縮率になるよう、細かいノイズを加える
+    img = cv2.add(img, rng.integers(0, 24, img.shape, dtype=np.uint8))
+    cv2.imwrite(path, img)
+    return path
+
+
+def make_narration(path: str, duration: float, seed: int) -> str:
+    """
+    ベンチマーク用のナレーション音声（WAV）を合成する
+
+    Args:
+        path: 保存先のパス
+        duration: 長さ（秒）
+        seed: 乱数のシード
+
+    Returns:
+        保存した音声のパス
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = 0.3 * np.sin(2 * np.pi * (180 + seed * 40) * t) + 0.05 * rng.standard_normal(t.size)
+    samples = (np.clip(signal, -1, 1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(samples.tobytes())
+    return path
+
+
+def make_script(fixture_dir: str, duration: float, sections: int, image_size: tuple) -> list:
+    """
+    ベンチマーク用の台本データと素材を作る
+
+    Args:
+        fixture_dir: 素材を保存するディレクトリ
+        duration: 動画全体の長さ（秒）
+        sections: セクション数
+        image_size: 画像のサイズ (幅, 高さ)
+
+    Returns:
+        create_video() に渡す台本データ
+    """
+    script = []
+    for i in range(sections):
+        script.append({
+            "text": f"ベンチマーク用のナレーション {i + 1}",
+            "visual_prompt": "",
+            "subtitle": f"ベンチマーク用の字幕です。セクション {i + 1} / {sections}",
+            "image_path": make_image(os.path.join(fixture_dir, f"image_{i}.png"), *image_size, seed=i),
+            "audio_path": make_narration(os.path.join(fixture_dir, f"audio_{i}.wav"), duration / sections, seed=i),
+        })
+    return script
+
+
+def _peak_rss_mb() -> float:
+    """このプロセスのピークメモリ使用量（MB）を返す"""
+    try:
+        import resource
+    except ImportError:
+        # Windowsではresourceモジュールがないため、psutilがあれば使う
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return getattr(info, "peak_wset", info.rss) / 1024 ** 2
+        except ImportError:
+            return float("nan")
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # macOSではバイト単位、Linuxではキロバイト単位
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024
+    return max(self_kb, child_kb) / scale
+
+
+def run_case(case: dict) -> dict:
+    """
+    1つのケースを実行して計測する（run_case_subprocess() から別プロセスで呼ばれる）
+
+    Args:
+        case: ケースの設定（duration, sections, resolution, mode, fps, work_dir）
+
+    Returns:
+        計測結果
+    """
+    import video_generator
+
+    width, height = case["resolution"]
+    work_dir = case["work_dir"]
+    script = make_script(work_dir, case["duration"], case["sections"], (width, height))
+
+    kwargs = dict(MODES[case["mode"]])
+    warm = kwargs.pop("warm", False)
+    if "cache_dir" in kwargs:
+        kwargs["cache_dir"] = os.path.join(work_dir, kwargs["cache_dir"])
+
+    output_file = os.path.join(work_dir, "output.mp4")
+    if warm:
+        # キャッシュを温める（このレンダリングは計測しない）
+        video_generator.create_video(script, output_file, resolution=(width, height), fps=case["fps"], **kwargs)
+
+    timer = video_generator.StageTimer()
+    start = time.perf_counter()
+    video_generator.create_video(
+        script, output_file, resolution=(width, height), fps=case["fps"], timings=timer, **kwargs
+    )
+    elapsed = time.perf_counter() - start
+
+    frames = round(case["duration"] * case["fps"])
+    return {
+        **{k: v for k, v in case.items() if k != "work_dir"},
+        "frames": frames,
+        "seconds": round(elapsed, 3),
+        "fps_rendered": round(frames / elapsed, 2),
+        "realtime_factor": round(case["duration"] / elapsed, 2),
+        "stages": {stage: round(seconds, 3) for stage, seconds in timer.as_dict().items()},
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "output_bytes": os.path.getsize(output_file),
+    }
+
+
+def run_case_subprocess(case: dict) -> dict:
+    """
+    ケースを別プロセスで実行する
+
+    Raises:
+        Exception: ケースの実行に失敗した場合
+    """
+    work_dir = tempfile.mkdtemp(prefix="tubeauto_bench_")
+    try:
+        payload = json.dumps({**case, "work_dir": work_dir})
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-case", payload],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if result.returncode != 0:
+            raise Exception(f"ケースの実行に失敗しました: {case}\n{result.stderr.strip()}")
+        # 最後の行が結果のJSON（それより前は create_video() の出力）
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def environment_info() -> dict:
+    """結果を比較するための環境情報を集める"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    import cv2
+    from video_generator import is_ffmpeg_available
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "ffmpeg": is_ffmpeg_available(),
+    }
+
+
+def print_table(results: list) -> None:
+    """結果を表形式で表示する"""
+    header = ["mode", "resolution", "dur", "sect", "time", "fps", "x realtime"] + STAGES + ["peak MB", "size MB"]
+    rows = []
+    for r in results:
+        rows.append([
+            r["mode"], "x".join(map(str, r["resolution"])), f'{r["duration"]:g}', str(r["sections"]), f'{r["seconds"]:.2f}',
+            f'{r["fps_rendered"]:.1f}', f'{r["realtime_factor"]:.2f}',
+            *[f'{r["stages"].get(stage, 0.0):.2f}' for stage in STAGES],
+            f'{r["peak_rss_mb"]:.0f}', f'{r["output_bytes"] / 1024 ** 2:.2f}',
+        ])
+    widths = [max(len(h), *(len(row[i]) for row in rows)) for i, h in enumerate(header)]
+    print("  ".join(h.rjust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print("  ".join(c.rjust(w) for c, w in zip(row, widths)))
+
+
+def parse_resolution(value: str) -> tuple:
+    """'1920x1080' 形式の解像度を (幅, 高さ) に変換する"""
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"解像度は 幅x高さ の形式で指定してください: {value}")
+    return width, height
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="動画レンダリングのベンチマーク")
+    parser.add_argument("--durations", type=float, nargs="+", default=[10.0], help="動画の長さ（秒）")
+    parser.add_argument("--sections", type=int, nargs="+", default=[3], help="セクション数")
+    parser.add_argument("--resolutions", type=parse_resolution, nargs="+", default=[(1920, 1080)],
+                        help="解像度（例: 1280x720）")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=["serial"], help="レンダリングのモード")
+    parser.add_argument("--fps", type=int, default=24, help="フレームレート")
+    parser.add_argument("--repeat", type=int, default=1, help="各ケースの繰り返し回数")
+    parser.add_argument("--json", dest="json_path", help="結果をJSONで保存するパス")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case)), ensure_ascii=False))
+        return 0
+
+    results = []
+    for mode in args.modes:
+        for resolution in args.resolutions:
+            for duration in args.durations:
+                for sections in args.sections:
+                    case = {"mode": mode, "resolution": list(resolution), "duration": duration,
+                            "sections": sections, "fps": args.fps}
+                    for _ in range(args.repeat):
+                        print(f"実行中: {mode} {resolution[0]}x{resolution[1]} {duration:g}秒 {sections}セクション",
+                              file=sys.stderr)
+                        results.append(run_case_subprocess(case))
+
+    print_table(results)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment_info(), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.json_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
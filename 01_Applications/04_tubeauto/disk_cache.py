@@ -0,0 +1,367 @@
+"""
+ディスクキャッシュモジュール
+内容のハッシュをキーにしてファイルをディスクに保存し、容量の上限を超えたら
+最も長く使われていないもの（LRU）から削除する。有効期限（TTL）を過ぎたものも削除する
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import shutil
+
+# キャッシュ容量のデフォルト上限（5GB）
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+
+
+def hash_file(path: str) -> str:
+    """
+    ファイルの内容のSHA-256ハッシュを計算する（大きなファイルも少しずつ読む）
+
+    Args:
+        path: ファイルのパス
+
+    Returns:
+        16進数のハッシュ文字列
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(*parts) -> str:
+    """
+    キャッシュのキーを作る
+
+    Args:
+        parts: キーに含める値（文字列、バイト列、またはJSONに変換できる値）
+
+    Returns:
+        16進数のハッシュ文字列
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            data = part
+        elif isinstance(part, str):
+            data = part.encode("utf-8")
+        else:
+            data = json.dumps(part, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        # 区切りが曖昧にならないよう、長さを前に付ける
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    """ハードリンクを作る（別のファイルシステムなどで作れない場合はコピーする）"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class FileLock:
+    """
+    ロックファイルによるプロセス間の排他ロック（fcntlのないWindowsでも動く）
+
+    ロックファイルを排他的に作成できたプロセスがロックを持つ。
+    異常終了で残ったロックファイルは、一定時間が過ぎたら取り除く。
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0, stale: float = 60.0):
+        """
+        Args:
+            path: ロックファイルのパス
+            timeout: ロックを待つ最大の時間（秒）
+            stale: この時間（秒）より古いロックファイルは残骸とみなす
+        """
+        self.path = path
+        self.timeout = timeout
+        self.stale = stale
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        delay = 0.005
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode("ascii"))
+                os.close(fd)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale:
+                        os.remove(self.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"ロックを取得できませんでした: {self.path}")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class DiskCache:
+    """
+    キーごとに1ファイルを保存するディスクキャッシュ
+
+    書き込みは一時ファイルを作ってから置き換えるため、途中で失敗しても壊れたファイルは残らない。
+    保存した時刻はファイルの更新日時（TTL用）、最終使用時刻はアクセス日時（LRU用）で管理する。
+    容量の調整と統計の更新はロックファイルで排他するため、複数のプロセスで同じディレクトリを共有できる。
+    """
+
+    # キャッシュのディレクトリ内の管理用ファイル（キーは16進数なので衝突しない）
+    STATS_FILE = "_stats.json"
+    LOCK_FILE = "_lock"
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES, suffix: str = "",
+                 ttl: float = None):
+        """
+        Args:
+            cache_dir: キャッシュを保存するディレクトリ
+            max_bytes: キャッシュ全体の容量の上限（バイト）
+            suffix: 保存するファイルの拡張子（例: ".mp4"）
+            ttl: 保存してからの有効期限（秒）。Noneの場合は期限なし
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.ttl = ttl
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def lock(self) -> FileLock:
+        """キャッシュ全体の排他ロックを返す（with文で使う）"""
+        return FileLock(os.path.join(self.cache_dir, self.LOCK_FILE))
+
+    def _expired(self, stat: os.stat_result, now: float = None) -> bool:
+        return self.ttl is not None and (now or time.time()) - stat.st_mtime > self.ttl
+
+    def path_for(self, key: str) -> str:
+        """キーに対応するファイルのパスを返す（存在するとは限らない）"""
+        return os.path.join(self.cache_dir, key[:2], key + self.suffix)
+
+    def get(self, key: str) -> str | None:
+        """
+        キャッシュされたファイルのパスを取得する
+
+        Args:
+            key: キャッシュのキー
+
+        Returns:
+            ファイルのパス。キャッシュにない場合はNone
+        """
+        path = self.path_for(key)
+        try:
+            stat = os.stat(path)
+            if self._expired(stat):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            # 使用したことを記録する（アクセス日時をLRU用に更新し、保存した時刻は残す）
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            self._record(misses=1)
+            return None
+        self._record(hits=1, bytes_saved=stat.st_size)
+        return path
+
+    def fetch(self, key: str, dest: str) -> str | None:
+        """
+        キャッシュされたファイルを dest にリンク（できない場合はコピー）する
+
+        リンクしたファイルは、ほかのプロセスが evict() でキャッシュから削除しても消えないため、
+        使い終わるまで（セグメントの連結など）安全に使える。
+
+        Args:
+            key: キャッシュのキー
+            dest: リンク先のパス（存在しないこと）
+
+        Returns:
+            dest。キャッシュにない場合はNone
+        """
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            _link_or_copy(path, dest)
+        except FileNotFoundError:
+            # get() の後で、ほかのプロセスに削除された
+            return None
+        return dest
+
+    def get_bytes(self, key: str) -> bytes | None:
+        """
+        キャッシュされたファイルの内容を取得する
+
+        Returns:
+            ファイルの内容。キャッシュにない場合はNone
+        """
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # 読み込む前に別のプロセスが削除した
+            return None
+
+    def put(self, key: str, src_path: str, evict: bool = True, keep_src: bool = False) -> str:
+        """
+        ファイルをキャッシュに移動する
+
+        Args:
+            key: キャッシュのキー
+            src_path: 保存するファイル（キャッシュ内に移動される）
+            evict: 保存後に容量の上限を超えた分を削除するかどうか
+            keep_src: Trueの場合は移動せずにリンク（できない場合はコピー）し、src_pathを残す
+                （ほかのプロセスの evict() で消えないよう、呼び出し元が自分のファイルを使い続ける場合）
+
+        Returns:
+            キャッシュ内のファイルのパス
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # 同じディレクトリの一時ファイルを経由して、アトミックに置き換える
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            if keep_src:
+                os.remove(temp_path)
+                _link_or_copy(src_path, temp_path)
+            else:
+                shutil.move(src_path, temp_path)
+            os.replace(temp_path, path)
+            # 保存した時刻と最終使用時刻を現在にする
+            os.utime(path, None)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        if evict:
+            self.evict()
+        return path
+
+    def put_bytes(self, key: str, data: bytes, evict: bool = True) -> str:
+        """
+        データをキャッシュに保存する
+
+        Args:
+            key: キャッシュのキー
+            data: 保存するデータ
+            evict: 保存後に容量の上限を超えた分を削除するかどうか
+
+        Returns:
+            キャッシュ内のファイルのパス
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return self.put(key, temp_path, evict)
+
+    def _entries(self) -> list:
+        """キャッシュ内のファイルを (最終使用時刻, サイズ, パス, 期限切れかどうか) のリストで返す"""
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp") or name.startswith("_"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path, self._expired(stat, now)))
+        return entries
+
+    def size(self) -> int:
+        """キャッシュ全体のサイズ（バイト）を返す"""
+        return sum(size for _, size, _, _ in self._entries())
+
+    def evict(self) -> int:
+        """
+        期限切れのものと、容量の上限を超えた分を最も長く使われていないものから削除する
+
+        Returns:
+            削除したバイト数
+        """
+        with self.lock():
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _, _ in entries)
+            removed = 0
+            for _, size, path, expired in entries:
+                if total <= self.max_bytes and not expired:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += size
+            return removed
+
+    def _record(self, hits: int = 0, misses: int = 0, bytes_saved: int = 0) -> None:
+        """ヒット数などの統計を更新する（プロセスをまたいで集計する）"""
+        stats_path = os.path.join(self.cache_dir, self.STATS_FILE)
+        try:
+            with self.lock():
+                stats = self._read_stats()
+                stats["hits"] += hits
+                stats["misses"] += misses
+                stats["bytes_saved"] += bytes_saved
+                temp_path = stats_path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(stats, f)
+                os.replace(temp_path, stats_path)
+        except (OSError, TimeoutError) as e:
+            # 統計の更新に失敗しても、キャッシュ自体は使えるようにする
+            print(f"警告: キャッシュの統計を更新できませんでした: {str(e)}")
+
+    def _read_stats(self) -> dict:
+        stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+        try:
+            with open(os.path.join(self.cache_dir, self.STATS_FILE), encoding="utf-8") as f:
+                stats.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+        return stats
+
+    def stats(self) -> dict:
+        """
+        キャッシュの統計を返す
+
+        Returns:
+            {"hits", "misses", "hit_rate", "bytes_saved", "entries", "size_bytes"} の辞書。
+            bytes_savedはキャッシュから返したファイルの合計サイズ
+        """
+        stats = self._read_stats()
+        lookups = stats["hits"] + stats["misses"]
+        entries = self._entries()
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = len(entries)
+        stats["size_bytes"] = sum(size for _, size, _, _ in entries)
+        return stats
+
+    def clear_stats(self) -> None:
+        """統計をリセットする"""
+        with self.lock():
+            try:
+                os.remove(os.path.join(self.cache_dir, self.STATS_FILE))
+            except FileNotFoundError:
+                pass
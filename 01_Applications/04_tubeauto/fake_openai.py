@@ -0,0 +1,564 @@
+"""
+OpenAI APIの代わりになるローカルのサーバー（負荷試験・オフラインでの動作確認用）
+台本生成（chat.completions、ストリーミング対応）、画像生成（URL・b64_json）、音声合成（MP3・WAV/PCM・Opus）の
+エンドポイントを、APIキーもネットワークも使わずに応答する
+
+応答の内容はダミー（単色の画像、無音の音声、決まった形の台本）だが、形式は本物のAPIと同じなので、
+utils.py から動画の完成までをそのまま実行できる。応答時間の分布、429・5xxのエラー、
+1分あたりのリクエスト数の上限を設定して、レート制限や再試行の動きも確かめられる。
+
+使い方:
+    python fake_openai.py --port 8765
+    python fake_openai.py --latency images=lognormal:6:0.3 --latency speech=uniform:0.5:2 --errors 429=0.05 --errors images:500=0.02
+    python fake_openai.py --rpm images=5 --server-concurrency 16 --time-scale 0.1
+
+    # アプリやバッチを偽のサーバーに向ける
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=sk-fake-0123456789abcdef python batch.py themes.txt
+
+    # 統計（エンドポイントごとのリクエスト数、エラー数、応答時間）
+    curl http://127.0.0.1:8765/stats
+"""
+
+import io
+import re
+import json
+import math
+import time
+import wave
+import zlib
+import base64
+import random
+import struct
+import shutil
+import sys
+import hashlib
+import argparse
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# エンドポイント名（rate_limiter と同じ）-> パス
+ENDPOINTS = {
+    "chat": "/v1/chat/completions",
+    "images": "/v1/images/generations",
+    "speech": "/v1/audio/speech",
+}
+
+# デフォルトの応答時間（秒）の分布。本物のAPIのおおよその傾向に合わせる
+DEFAULT_LATENCY = {
+    "chat": "lognormal:1.0:0.3",    # 最初のトークンまで
+    "images": "lognormal:8.0:0.3",
+    "speech": "lognormal:1.0:0.3",  # 音声の最初のバイトまで
+}
+
+# 台本のセクション数と、ストリーミングで1回に送る文字数・間隔
+DEFAULT_SECTIONS = 4
+STREAM_CHUNK_CHARS = 8
+STREAM_INTERVAL = 0.02
+
+# 音声の長さ: 1文字あたりの秒数と最短の長さ
+SPEECH_SECONDS_PER_CHAR = 0.12
+SPEECH_MIN_SECONDS = 1.0
+PCM_SAMPLE_RATE = 24000
+SPEECH_CHUNK_SIZE = 16 * 1024
+
+# 無音のMP3フレーム（MPEG-1 Layer III、128kbps、44.1kHz、モノラル。本体がすべて0のフレームは無音になる）
+MP3_SAMPLE_RATE = 44100
+MP3_FRAME_SAMPLES = 1152
+MP3_SILENT_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC4]) + bytes(144 * 128000 // MP3_SAMPLE_RATE - 4)
+
+ERROR_TYPES = {
+    429: ("rate_limit_exceeded", "Rate limit reached (fake server)."),
+    500: ("server_error", "The server had an error while processing your request (fake server)."),
+    502: ("server_error", "Bad gateway (fake server)."),
+    503: ("server_error", "The engine is currently overloaded (fake server)."),
+}
+
+
+def parse_latency(spec: str):
+    """
+    応答時間の分布の指定を解析する
+
+    Args:
+        spec: "const:秒"、"uniform:最小:最大"、"normal:平均:標準偏差"、"lognormal:中央値:シグマ"、"exp:平均"
+
+    Returns:
+        乱数生成器を受け取って秒数を返す関数
+
+    Raises:
+        ValueError: 指定の形式が正しくない場合
+    """
+    name, *values = spec.split(":")
+    try:
+        values = [float(v) for v in values]
+    except ValueError:
+        raise ValueError(f"応答時間の分布の値が数値ではありません: {spec}")
+    distributions = {
+        "const": (1, lambda rng, s: s),
+        "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+        "normal": (2, lambda rng, mean, sd: rng.gauss(mean, sd)),
+        "lognormal": (2, lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma)),
+        "exp": (1, lambda rng, mean: rng.expovariate(1.0 / mean) if mean > 0 else 0.0),
+    }
+    if name not in distributions or len(values) != distributions[name][0]:
+        raise ValueError(f"応答時間の分布の指定が正しくありません: {spec}"
+                         "（const:秒、uniform:最小:最大、normal:平均:標準偏差、lognormal:中央値:シグマ、exp:平均）")
+    sample = distributions[name][1]
+    return lambda rng: max(0.0, sample(rng, *values))
+
+
+def parse_errors(specs: list) -> dict:
+    """
+    エラーを返す割合の指定を解析する
+
+    Args:
+        specs: "ステータス=割合"（すべてのエンドポイント）または "エンドポイント:ステータス=割合" のリスト
+
+    Returns:
+        {エンドポイント: {ステータス: 割合}}（すべてのエンドポイントは "*"）
+
+    Raises:
+        ValueError: 指定の形式が正しくない場合
+    """
+    errors = {}
+    for spec in specs or []:
+        match = re.fullmatch(r"(?:(\w+):)?(\d{3})=([\d.]+)", spec.strip())
+        if match is None:
+            raise ValueError(f"エラーの指定が正しくありません: {spec}（例: 429=0.05、images:500=0.02）")
+        endpoint, status, rate = match.group(1) or "*", int(match.group(2)), float(match.group(3))
+        if endpoint != "*" and endpoint not in ENDPOINTS:
+            raise ValueError(f"不明なエンドポイントです: {endpoint}（{', '.join(ENDPOINTS)}）")
+        errors.setdefault(endpoint, {})[status] = rate
+    return errors
+
+
+def parse_pairs(specs: list, value_type=float) -> dict:
+    """"エンドポイント=値" のリストを辞書にする"""
+    pairs = {}
+    for spec in specs or []:
+        endpoint, _, value = spec.partition("=")
+        if endpoint not in ENDPOINTS or not value:
+            raise ValueError(f"指定が正しくありません: {spec}（例: images=5。エンドポイント: {', '.join(ENDPOINTS)}）")
+        pairs[endpoint] = value_type(value)
+    return pairs
+
+
+def make_png(width: int, height: int, color: tuple) -> bytes:
+    """単色のPNG画像を作る（外部ライブラリを使わない）"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    row = b"\x00" + bytes(color) * width
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(row * height, 6)) + chunk(b"IEND", b""))
+
+
+def make_speech(seconds: float, audio_format: str) -> bytes:
+    """
+    無音の音声を指定の形式で作る
+
+    Args:
+        seconds: 音声の長さ
+        audio_format: "mp3"、"wav"、"pcm"、"opus"
+
+    Returns:
+        音声のバイト列
+
+    Raises:
+        ValueError: 作れない形式の場合（opusはffmpegが必要）
+    """
+    if audio_format == "mp3":
+        return MP3_SILENT_FRAME * max(1, round(seconds * MP3_SAMPLE_RATE / MP3_FRAME_SAMPLES))
+    pcm = bytes(2 * int(seconds * PCM_SAMPLE_RATE))
+    if audio_format == "pcm":
+        return pcm
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(PCM_SAMPLE_RATE)
+        f.writeframes(pcm)
+    if audio_format == "wav":
+        return buffer.getvalue()
+    if audio_format == "opus" and shutil.which("ffmpeg"):
+        result = subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-f", "wav", "-i", "-", "-c:a", "libopus", "-f", "ogg", "-"],
+            input=buffer.getvalue(), capture_output=True,
+        )
+        if result.returncode == 0:
+            return result.stdout
+    raise ValueError(f"この形式の音声は作れません: {audio_format}")
+
+
+class TokenBucket:
+    """1分あたりのリクエスト数の上限（超えた場合は待つ秒数を返す）"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, per_minute / 60.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> float:
+        """
+        1リクエスト分を使う
+
+        Returns:
+            0（使えた場合）、または使えるようになるまでの秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0.0
+            return (1.0 - self.tokens) / self.rate
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """偽のOpenAI APIサーバー（設定と統計を持つ）"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: dict = None, errors: dict = None,
+                 rpm: dict = None, concurrency: int = None, sections: int = DEFAULT_SECTIONS,
+                 time_scale: float = 1.0, retry_after: float = 1.0, seed: int = None):
+        """
+        Args:
+            host: 待ち受けるアドレス
+            port: 待ち受けるポート（0の場合は空いているポート）
+            latency: {エンドポイント: 分布の指定}（DEFAULT_LATENCY を上書きする）
+            errors: parse_errors() の結果
+            rpm: {エンドポイント: 1分あたりのリクエスト数の上限}
+            concurrency: 同時に処理するリクエスト数の上限（超えた分は待たせる。Noneの場合は無制限）
+            sections: 台本のセクション数
+            time_scale: 応答時間に掛ける倍率（0.1なら10倍速）
+            retry_after: 429を返すときの Retry-After（秒。レート制限の場合は実際の待ち時間）
+            seed: 乱数のシード
+        """
+        super().__init__((host, port), FakeOpenAIHandler)
+        self.latency = {endpoint: parse_latency(spec) for endpoint, spec in {**DEFAULT_LATENCY, **(latency or {})}.items()}
+        self.errors = errors or {}
+        self.buckets = {endpoint: TokenBucket(limit) for endpoint, limit in (rpm or {}).items() if limit > 0}
+        self.slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+        self.sections = sections
+        self.time_scale = time_scale
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.images = {}  # 画像のID -> PNG（URLで返した画像）
+        self.started_at = time.time()
+        self._stats = {endpoint: {"requests": 0, "errors": {}, "latency": []} for endpoint in ENDPOINTS}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def sample_latency(self, endpoint: str) -> float:
+        with self._lock:
+            return self.latency[endpoint](self.rng) * self.time_scale
+
+    def pick_error(self, endpoint: str) -> int | None:
+        """設定した割合でエラーのステータスを選ぶ（エラーにしない場合はNone）"""
+        rates = {**self.errors.get("*", {}), **self.errors.get(endpoint, {})}
+        with self._lock:
+            draw = self.rng.random()
+        for status, rate in rates.items():
+            if draw < rate:
+                return status
+            draw -= rate
+        return None
+
+    def record(self, endpoint: str, seconds: float, status: int = 200) -> None:
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats["requests"] += 1
+            if status != 200:
+                stats["errors"][str(status)] = stats["errors"].get(str(status), 0) + 1
+            else:
+                stats["latency"].append(seconds)
+
+    def stats(self) -> dict:
+        """エンドポイントごとのリクエスト数、エラー数、成功したリクエストの応答時間（p50・p95・最大）"""
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            result = {"uptime_seconds": round(elapsed, 2), "endpoints": {}}
+            for endpoint, stats in self._stats.items():
+                latency = sorted(stats["latency"])
+                result["endpoints"][endpoint] = {
+                    "requests": stats["requests"],
+                    "requests_per_second": round(stats["requests"] / elapsed, 3) if elapsed else 0.0,
+                    "errors": dict(stats["errors"]),
+                    "latency_p50": round(percentile(latency, 50), 3),
+                    "latency_p95": round(percentile(latency, 95), 3),
+                    "latency_max": round(latency[-1], 3) if latency else 0.0,
+                }
+            return result
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.started_at = time.time()
+            for stats in self._stats.values():
+                stats.update(requests=0, errors={}, latency=[])
+
+
+def percentile(values: list, q: float) -> float:
+    """並べ替え済みのリストのパーセンタイル（空の場合は0）"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """OpenAI APIの形式でダミーの応答を返す"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "fake-openai"
+
+    def log_message(self, format, *args):
+        pass  # アクセスのたびにログを出さない
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, retry_after: float = None, message: str = None) -> None:
+        error_type, default_message = ERROR_TYPES.get(status, ("invalid_request_error", "Bad request (fake server)."))
+        headers = {}
+        if retry_after is not None:
+            headers = {"retry-after": f"{math.ceil(retry_after)}", "retry-after-ms": f"{int(retry_after * 1000)}"}
+        self._send_json(status, {"error": {"message": message or default_message, "type": error_type,
+                                           "code": error_type, "param": None}}, headers)
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/stats":
+            self._send_json(200, self.server.stats())
+        elif path == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "fake"}
+                for model in ("gpt-4o", "dall-e-3", "tts-1")
+            ]})
+        elif path.startswith("/files/images/") and path[len("/files/images/"):-4] in self.server.images:
+            data = self.server.images[path[len("/files/images/"):-4]]
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_error(404, message=f"Unknown path: {path}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, message="Invalid JSON body.")
+            return
+        path = self.path.split("?")[0]
+        endpoint = next((name for name, endpoint_path in ENDPOINTS.items() if endpoint_path == path), None)
+        if endpoint is None:
+            self._send_error(404, message=f"Unknown path: {path}")
+            return
+
+        start = time.perf_counter()
+        server = self.server
+        bucket = server.buckets.get(endpoint)
+        wait = bucket.take() if bucket else 0.0
+        if wait > 0:
+            server.record(endpoint, 0.0, 429)
+            self._send_error(429, retry_after=wait)
+            return
+        status = server.pick_error(endpoint)
+        if status is not None:
+            time.sleep(server.sample_latency(endpoint) * 0.2)
+            server.record(endpoint, time.perf_counter() - start, status)
+            self._send_error(status, retry_after=server.retry_after if status == 429 else None)
+            return
+
+        if server.slots:
+            server.slots.acquire()
+        try:
+            time.sleep(server.sample_latency(endpoint))
+            getattr(self, f"_handle_{endpoint}")(request)
+        except (BrokenPipeError, ConnectionResetError):
+            return  # クライアントが切断した
+        except ValueError as e:
+            self._send_error(400, message=str(e))
+            return
+        finally:
+            if server.slots:
+                server.slots.release()
+        server.record(endpoint, time.perf_counter() - start)
+
+    def _script_content(self, request: dict) -> str:
+        """台本のJSON（テーマをユーザーのメッセージから取り出して、セクションの文に使う）"""
+        messages = request.get("messages") or [{}]
+        match = re.search(r"「(.+?)」", str(messages[-1].get("content", "")))
+        theme = match.group(1) if match else "テーマ"
+        sections = [
+            {
+                "text": f"{theme}について、{i + 1}つ目のポイントを紹介します。これは負荷試験用の台本です。",
+                "visual_prompt": f"{theme}, scene {i + 1}, illustration",
+                "subtitle": f"{theme}（{i + 1}）",
+            }
+            for i in range(self.server.sections)
+        ]
+        return json.dumps({"sections": sections}, ensure_ascii=False)
+
+    def _handle_chat(self, request: dict) -> None:
+        content = self._script_content(request)
+        model = request.get("model", "gpt-4o")
+        created = int(time.time())
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(content), "total_tokens": len(content)},
+            })
+            return
+
+        # Server-Sent Eventsで少しずつ送る（チャンク形式のHTTP/1.1）
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data: str) -> None:
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            send_event(json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[i:i + STREAM_CHUNK_CHARS]},
+                             "finish_reason": None}],
+            }, ensure_ascii=False))
+            time.sleep(STREAM_INTERVAL * self.server.time_scale)
+        send_event(json.dumps({
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _handle_images(self, request: dict) -> None:
+        width, height = (int(v) for v in str(request.get("size", "1024x1024")).split("x"))
+        digest = hashlib.sha256(str(request.get("prompt", "")).encode("utf-8")).digest()
+        png = make_png(width, height, tuple(digest[:3]))
+        if request.get("response_format") == "b64_json":
+            item = {"b64_json": base64.b64encode(png).decode("ascii")}
+        else:
+            image_id = digest.hex()[:16]
+            self.server.images[image_id] = png
+            host, port = self.server.server_address[:2]
+            item = {"url": f"http://{host}:{port}/files/images/{image_id}.png"}
+        self._send_json(200, {"created": int(time.time()), "data": [{**item, "revised_prompt": request.get("prompt")}]})
+
+    def _handle_speech(self, request: dict) -> None:
+        audio_format = request.get("response_format", "mp3")
+        seconds = max(SPEECH_MIN_SECONDS, len(str(request.get("input", ""))) * SPEECH_SECONDS_PER_CHAR)
+        data = make_speech(seconds, audio_format)
+        content_types = {"mp3": "audio/mpeg", "wav": "audio/wav", "pcm": "audio/pcm", "opus": "audio/ogg"}
+        self.send_response(200)
+        self.send_header("Content-Type", content_types.get(audio_format, "application/octet-stream"))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        for i in range(0, len(data), SPEECH_CHUNK_SIZE):
+            self.wfile.write(data[i:i + SPEECH_CHUNK_SIZE])
+
+
+def start_server(**kwargs) -> FakeOpenAIServer:
+    """
+    偽のサーバーをバックグラウンドのスレッドで起動する（負荷試験のドライバーなどから使う）
+
+    Args:
+        kwargs: FakeOpenAIServer の引数
+
+    Returns:
+        起動したサーバー（base_url でURLが分かる。終わったら shutdown() する）
+    """
+    server = FakeOpenAIServer(**kwargs)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """偽のサーバーの設定のコマンドライン引数を追加する（loadtest.py と共通）"""
+    parser.add_argument("--latency", action="append", default=[],
+                        help="応答時間の分布（例: images=lognormal:8:0.3、speech=uniform:0.5:2、chat=const:1）")
+    parser.add_argument("--errors", action="append", default=[],
+                        help="エラーを返す割合（例: 429=0.05、images:500=0.02）")
+    parser.add_argument("--rpm", action="append", default=[],
+                        help="1分あたりのリクエスト数の上限。超えたら429を返す（例: images=5）")
+    parser.add_argument("--server-concurrency", type=int, default=None, help="同時に処理するリクエスト数の上限")
+    parser.add_argument("--sections", type=int, default=DEFAULT_SECTIONS, help="台本のセクション数")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="応答時間に掛ける倍率（0.1なら10倍速）")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="エラーの429で返す Retry-After（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="乱数のシード")
+
+
+def server_options(args) -> dict:
+    """
+    コマンドライン引数から FakeOpenAIServer の引数を作る
+
+    Raises:
+        ValueError: 指定の形式が正しくない場合
+    """
+    latency = {}
+    for spec in args.latency:
+        endpoint, _, distribution = spec.partition("=")
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"不明なエンドポイントです: {endpoint}（{', '.join(ENDPOINTS)}）")
+        parse_latency(distribution)
+        latency[endpoint] = distribution
+    return {
+        "latency": latency,
+        "errors": parse_errors(args.errors),
+        "rpm": parse_pairs(args.rpm),
+        "concurrency": args.server_concurrency,
+        "sections": args.sections,
+        "time_scale": args.time_scale,
+        "retry_after": args.retry_after,
+        "seed": args.seed,
+    }
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="OpenAI APIの代わりになるローカルのサーバー")
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=8765, help="待ち受けるポート")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        server = FakeOpenAIServer(host=args.host, port=args.port, **server_options(args))
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"偽のOpenAI APIサーバーを起動しました: {server.base_url}")
+    print(f"  OPENAI_BASE_URL={server.base_url} を設定して使ってください（統計: http://{args.host}:{args.port}/stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
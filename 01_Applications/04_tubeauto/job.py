@@ -0,0 +1,434 @@
+"""
+ジョブ管理モジュール
+動画1本分の生成（台本 -> 画像・音声 -> 動画）をジョブのディレクトリ単位で管理し、
+途中で失敗しても、完了した工程と素材を再利用して続きから再開できるようにする
+
+ジョブのディレクトリには manifest.json を置き、各工程が終わるたびに書き換える
+（一時ファイルから置き換えるので、途中で止まっても壊れない）:
+    {
+        "theme": "日本の四季",
+        "stages": {"script": "done", "assets": "failed", "video": "pending"},
+        "script": [{"text": ..., "visual_prompt": ..., "subtitle": ...}, ...],
+        "assets": {"0": {"image": {"path": "image_0.png", "sha256": ..., "source": ...}, "audio": {...}}},
+        "video": {"path": "video.mp4", "sha256": ...},
+        "error": null
+    }
+
+素材は、ファイルの内容（sha256）と元になった台本の内容（source）が一致する場合だけ再利用する。
+"""
+
+import os
+import json
+import threading
+from datetime import datetime, timezone
+
+from disk_cache import hash_file, make_key
+from runtime import load_env
+
+MANIFEST_FILE = "manifest.json"
+VIDEO_FILE = "video.mp4"
+MANIFEST_VERSION = 1
+
+# 工程（実行順）と状態
+STAGES = ("script", "assets", "video")
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+# アプリのジョブを保存するディレクトリ（環境変数 TUBEAUTO_JOBS_DIR で変更できる）
+load_env()
+JOBS_DIR = os.getenv("TUBEAUTO_JOBS_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "tubeauto", "jobs")
+
+# 素材の元になる台本のフィールド
+_ASSET_SOURCES = {"image": "visual_prompt", "audio": "text"}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def job_id_for(theme: str) -> str:
+    """テーマからジョブのIDを作る（同じテーマは同じジョブになる）"""
+    return make_key("theme", theme)[:12]
+
+
+def job_dir_for(theme: str, jobs_dir: str = None) -> str:
+    """テーマのジョブのディレクトリを返す"""
+    return os.path.join(jobs_dir or JOBS_DIR, job_id_for(theme))
+
+
+class JobManifest:
+    """
+    ジョブの進捗（台本、セクションごとの素材のパスとハッシュ、工程の状態）を記録するマニフェスト
+
+    記録するたびに manifest.json を書き換える。素材の生成は並行して完了するため、
+    記録と書き出しはロックで排他する。
+    """
+
+    def __init__(self, job_dir: str, data: dict):
+        """
+        Args:
+            job_dir: ジョブのディレクトリ
+            data: マニフェストの内容
+        """
+        self.job_dir = os.path.abspath(job_dir)
+        self.data = data
+        self._lock = threading.RLock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.job_dir, MANIFEST_FILE)
+
+    @classmethod
+    def load(cls, job_dir: str) -> "JobManifest | None":
+        """
+        ジョブのマニフェストを読み込む
+
+        Args:
+            job_dir: ジョブのディレクトリ
+
+        Returns:
+            JobManifest。ない場合や壊れている場合はNone
+        """
+        try:
+            with open(os.path.join(job_dir, MANIFEST_FILE), encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(job_dir, data)
+
+    @classmethod
+    def open(cls, job_dir: str, theme: str, restart: bool = False) -> "JobManifest":
+        """
+        ジョブのマニフェストを開く（同じテーマの記録があれば続きから、なければ新しく作る）
+
+        Args:
+            job_dir: ジョブのディレクトリ
+            theme: 動画のテーマ
+            restart: Trueの場合は記録を捨てて最初からやり直す
+
+        Returns:
+            JobManifest
+        """
+        os.makedirs(job_dir, exist_ok=True)
+        manifest = None if restart else cls.load(job_dir)
+        if manifest is None or manifest.data.get("theme") != theme:
+            manifest = cls(job_dir, {
+                "version": MANIFEST_VERSION,
+                "theme": theme,
+                "created_at": _now(),
+                "stages": {stage: PENDING for stage in STAGES},
+                "script": [],
+                "assets": {},
+                "video": None,
+                "error": None,
+            })
+            manifest.save()
+        return manifest
+
+    def save(self) -> None:
+        """マニフェストを書き出す（一時ファイルから置き換える）"""
+        with self._lock:
+            self.data["updated_at"] = _now()
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+
+    @property
+    def theme(self) -> str:
+        return self.data["theme"]
+
+    def stage(self, stage: str) -> str:
+        """工程の状態を返す"""
+        return self.data["stages"].get(stage, PENDING)
+
+    @property
+    def status(self) -> str:
+        """ジョブ全体の状態（すべて完了なら "done"、失敗した工程があれば "failed"）"""
+        states = [self.stage(stage) for stage in STAGES]
+        if all(state == DONE for state in states):
+            return DONE
+        if FAILED in states:
+            return FAILED
+        if RUNNING in states:
+            return RUNNING
+        return PENDING
+
+    def set_stage(self, stage: str, status: str, error: str = None) -> None:
+        """工程の状態を記録する"""
+        with self._lock:
+            self.data["stages"][stage] = status
+            self.data["error"] = error if status == FAILED else None
+            self.save()
+
+    def fail(self, error: Exception | str) -> None:
+        """実行中の工程をすべて失敗として記録する"""
+        with self._lock:
+            for stage in STAGES:
+                if self.stage(stage) == RUNNING:
+                    self.data["stages"][stage] = FAILED
+            self.data["error"] = str(error)
+            self.save()
+
+    def start_script(self) -> None:
+        """台本の生成を始める（途中まで届いていた前回の台本は捨てる。素材の記録は内容の一致で再利用する）"""
+        with self._lock:
+            self.data["script"] = []
+            self.set_stage("script", RUNNING)
+
+    def add_section(self, section: dict) -> int:
+        """台本のセクションを記録する（ストリーミングで届いた順に）。セクションの番号を返す"""
+        with self._lock:
+            self.data["script"].append({key: section.get(key, "") for key in ("text", "visual_prompt", "subtitle")})
+            self.save()
+            return len(self.data["script"]) - 1
+
+    def script(self) -> list | None:
+        """
+        完了した台本を返す（画像・音声はまだ設定しない）
+
+        Returns:
+            台本データ。台本の工程が完了していない場合はNone
+        """
+        if self.stage("script") != DONE or not self.data["script"]:
+            return None
+        return [dict(section) for section in self.data["script"]]
+
+    def record_asset(self, index: int, kind: str, path: str, section: dict) -> None:
+        """
+        生成した素材を記録する
+
+        Args:
+            index: セクションの番号
+            kind: "image" または "audio"
+            path: 素材のファイルのパス
+            section: 素材の元になったセクション
+        """
+        entry = {
+            "path": os.path.relpath(os.path.abspath(path), self.job_dir),
+            "sha256": hash_file(path),
+            "source": make_key(kind, section.get(_ASSET_SOURCES[kind], "")),
+        }
+        with self._lock:
+            self.data["assets"].setdefault(str(index), {})[kind] = entry
+            self.save()
+
+    def restore_assets(self, index: int, section: dict) -> int:
+        """
+        記録済みの素材のうち、ファイルが残っていて内容が一致するものをセクションに設定する
+
+        Args:
+            index: セクションの番号
+            section: 台本のセクション（"image_path"、"audio_path" を設定する）
+
+        Returns:
+            再利用できた素材の数
+        """
+        restored = 0
+        for kind, entry in self.data["assets"].get(str(index), {}).items():
+            path = os.path.join(self.job_dir, entry["path"])
+            if entry["source"] != make_key(kind, section.get(_ASSET_SOURCES[kind], "")):
+                continue
+            try:
+                if hash_file(path) != entry["sha256"]:
+                    continue
+            except FileNotFoundError:
+                continue
+            section[f"{kind}_path"] = path
+            restored += 1
+        return restored
+
+    def assets_complete(self) -> bool:
+        """台本のすべてのセクションの画像と音声が記録されているかどうか"""
+        if self.stage("script") != DONE:
+            return False
+        assets = self.data["assets"]
+        return all(
+            {"image", "audio"} <= set(assets.get(str(i), {})) for i in range(len(self.data["script"]))
+        )
+
+    def record_video(self, path: str) -> None:
+        """完成した動画を記録し、ジョブを完了にする"""
+        with self._lock:
+            self.data["video"] = {
+                "path": os.path.relpath(os.path.abspath(path), self.job_dir),
+                "sha256": hash_file(path),
+                "bytes": os.path.getsize(path),
+            }
+            self.data["stages"].update({stage: DONE for stage in STAGES})
+            self.data["error"] = None
+            self.save()
+
+    def video_path(self) -> str | None:
+        """完成した動画のパス（ジョブが完了していて、動画が記録どおり残っている場合のみ）"""
+        video = self.data.get("video")
+        if self.status != DONE or not video:
+            return None
+        path = os.path.join(self.job_dir, video["path"])
+        if not os.path.exists(path) or os.path.getsize(path) != video.get("bytes"):
+            return None
+        return path
+
+    def summary(self) -> dict:
+        """一覧表示用の要約"""
+        return {
+            "job_dir": self.job_dir,
+            "theme": self.theme,
+            "status": self.status,
+            "stages": dict(self.data["stages"]),
+            "sections": len(self.data["script"]),
+            "error": self.data.get("error"),
+            "updated_at": self.data.get("updated_at"),
+        }
+
+
+def list_jobs(jobs_dir: str = None, unfinished: bool = False) -> list:
+    """
+    ジョブの一覧を返す（新しい順）
+
+    Args:
+        jobs_dir: ジョブを保存するディレクトリ（Noneの場合はJOBS_DIR）
+        unfinished: Trueの場合は完了していないジョブだけを返す
+
+    Returns:
+        JobManifest.summary() のリスト
+    """
+    jobs_dir = jobs_dir or JOBS_DIR
+    try:
+        names = os.listdir(jobs_dir)
+    except FileNotFoundError:
+        return []
+    jobs = []
+    for name in names:
+        if name.startswith("."):
+            continue  # 削除中のジョブなど
+        manifest = JobManifest.load(os.path.join(jobs_dir, name))
+        if manifest is None or (unfinished and manifest.status == DONE):
+            continue
+        jobs.append(manifest.summary())
+    return sorted(jobs, key=lambda job: job["updated_at"] or "", reverse=True)
+
+
+async def _record_script(manifest: JobManifest, sections):
+    """ストリーミングで届いた台本のセクションを記録しながら返す（前回の素材が使えれば設定する）"""
+    async for section in sections:
+        index = manifest.add_section(section)
+        manifest.restore_assets(index, section)
+        yield section
+    manifest.set_stage("script", DONE)
+
+
+async def arun_job(theme: str, job_dir: str, pipelined: bool = True, refresh: bool = False,
+                   restart: bool = False, on_progress=None, image_concurrency: int = None,
+                   audio_concurrency: int = None, resolution: tuple = None, fps: int = None,
+                   workspace=None, **render_kwargs) -> str:
+    """
+    ジョブを実行する（記録があれば、完了した工程と残っている素材を再利用して続きから）
+
+    Args:
+        theme: 動画のテーマ
+        job_dir: ジョブのディレクトリ（素材、動画、manifest.json を保存する）
+        pipelined: Trueの場合は素材の生成とレンダリングを並行して行う（ffmpegが必要）
+        refresh: Trueの場合はAPIキャッシュを使わずに生成し直す
+        restart: Trueの場合はジョブの記録を捨てて最初からやり直す
+        on_progress: 進捗を通知する関数 on_progress(kind, index, path)（agenerate_video_pipelined() と同じ）
+        image_concurrency: 画像生成の同時リクエスト数の上限
+        audio_concurrency: 音声生成の同時リクエスト数の上限
+        resolution: 動画の解像度 (幅, 高さ)
+        fps: フレームレート
+        workspace: workspace.Workspace。指定した場合は素材やセグメントができるたびにジョブのディスク使用量の上限を確かめる
+        render_kwargs: agenerate_video_pipelined() のその他の引数（パイプライン生成の場合のみ）
+
+    Returns:
+        生成された動画ファイルのパス
+
+    Raises:
+        Exception: 生成に失敗した場合（失敗した工程はマニフェストに記録される）
+    """
+    import asyncio
+    import shutil
+    from utils import agenerate_assets, aiter_script_sections, IMAGE_CONCURRENCY, AUDIO_CONCURRENCY
+    from video_generator import FPS, acreate_video, discard_decoded_images
+
+    manifest = JobManifest.open(job_dir, theme, restart)
+    video_path = manifest.video_path()
+    if video_path:
+        return video_path
+
+    output_file = os.path.join(manifest.job_dir, VIDEO_FILE)
+    segment_cache = os.path.join(manifest.job_dir, "segments")
+    image_concurrency = image_concurrency or IMAGE_CONCURRENCY
+    audio_concurrency = audio_concurrency or AUDIO_CONCURRENCY
+    fps = fps or FPS
+
+    script = manifest.script()
+    if script is not None:
+        for index, section in enumerate(script):
+            manifest.restore_assets(index, section)
+        source = script
+    else:
+        manifest.start_script()
+        source = _record_script(manifest, aiter_script_sections(theme, refresh))
+    sections = script if script is not None else []
+
+    def on_asset(kind: str, index: int, path: str) -> None:
+        if kind in _ASSET_SOURCES:
+            manifest.record_asset(index, kind, path, sections[index])
+            if manifest.assets_complete():
+                manifest.set_stage("assets", DONE)
+        if on_progress:
+            on_progress(kind, index, path)
+        if workspace is not None:
+            workspace.check_job(manifest.job_dir)
+
+    async def collect(aiter):
+        async for section in aiter:
+            sections.append(section)
+            yield section
+
+    if script is None:
+        source = collect(source)
+
+    try:
+        manifest.set_stage("assets", RUNNING)
+        if pipelined:
+            from pipeline import agenerate_video_pipelined
+            manifest.set_stage("video", RUNNING)
+            if not render_kwargs.get("cache_dir"):
+                # 途中で失敗してもレンダリング済みのセグメントを再利用できるよう、ジョブ内にキャッシュする
+                render_kwargs["cache_dir"] = segment_cache
+            await agenerate_video_pipelined(
+                source, manifest.job_dir, output_file, resolution=resolution, fps=fps,
+                image_concurrency=image_concurrency, audio_concurrency=audio_concurrency,
+                on_progress=on_asset, refresh=refresh, skip_existing=True, **render_kwargs
+            )
+        else:
+            await agenerate_assets(source, manifest.job_dir, image_concurrency, audio_concurrency, on_asset,
+                                   refresh, decode_images=True, skip_existing=True)
+            manifest.set_stage("video", RUNNING)
+            await acreate_video(sections, output_file, resolution=resolution, fps=fps)
+    except asyncio.CancelledError:
+        manifest.fail("キャンセルされました")
+        raise
+    except BaseException as e:
+        manifest.fail(e)
+        raise
+    finally:
+        # レンダリングで使われなかったデコード済みの画像をメモリに残さない
+        discard_decoded_images(manifest.job_dir)
+
+    manifest.record_video(output_file)
+    # 完成したらセグメントのキャッシュは不要
+    shutil.rmtree(segment_cache, ignore_errors=True)
+    return output_file
+
+
+def run_job(theme: str, job_dir: str, **kwargs) -> str:
+    """
+    ジョブを実行する（同期版）
+
+    引数と戻り値は arun_job() と同じ。on_progressは呼び出し元のスレッドで呼ばれる。
+    """
+    from utils import run_async
+    return run_async(arun_job(theme, job_dir, **kwargs))
@@ -0,0 +1,415 @@
+"""
+バックグラウンドジョブ実行モジュール
+動画の生成（job.arun_job()）をサーバー側のスレッドで実行し、UIからは実行IDで状態を問い合わせる
+
+Streamlitのスクリプトの実行とは別のスレッドで動くため、ボタンの操作やページの再読み込みで
+生成が止まったり、やり直しになったりしない。実行中のジョブは取り消すことができる。
+
+サーバー全体で1つのスケジューラーを共有し、複数のユーザーが同時に生成しても負荷が一定になるようにする:
+    - 同時に実行するジョブ数を制限し、あふれたジョブは実行待ちの列に並べる（順番と開始・完了の見込みを表示）
+    - 実行待ちの列では、見込み時間の短いジョブ（再開したジョブなど）を先に実行する。
+      待ち時間の長いジョブは優先度を上げ、いつまでも後回しにはしない
+    - レンダリングはサーバー全体で1つのプロセスプール（CPUコア数と空きメモリで上限を決める）で行う
+    - APIのレート制限（rate_limiter.scheduler）とOpenAIクライアントはプロセス内で共有される
+
+使い方:
+    runner = get_runner()
+    run_id = runner.submit(theme, job_dir, pipelined=True)
+    runner.status(run_id)   # {"status": "queued", "queue_position": 2, "eta_seconds": 240, ...}
+    runner.cancel(run_id)
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 実行の状態
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# 同時に実行するジョブ数（環境変数 TUBEAUTO_MAX_JOBS で変更できる）
+MAX_CONCURRENT_JOBS = 2
+
+# レンダリングのワーカー1つあたりのメモリの見積もり（MB。環境変数 TUBEAUTO_RENDER_WORKER_MB で変更できる）
+RENDER_WORKER_MB = 400
+
+# 所要時間の見積もり: 実績がないときの1セクションあたりの秒数と、台本がないときのセクション数
+DEFAULT_SECONDS_PER_SECTION = 20.0
+DEFAULT_SECTIONS = 5
+# 実績の反映の強さ（指数移動平均の係数）
+ESTIMATE_SMOOTHING = 0.3
+# 実行待ちの1秒ごとに、見込み時間から差し引く秒数（長く待っているジョブほど先に実行する）
+QUEUE_AGING = 1.0
+
+# 終了した実行の記録を残す時間（秒）
+KEEP_FINISHED_SECONDS = 6 * 3600
+
+# 表示用に残す進捗の数
+MAX_EVENTS = 50
+
+
+def available_memory_mb() -> float | None:
+    """空きメモリ（MB）。調べられない場合はNone"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 1024 ** 2
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def render_worker_count() -> int:
+    """
+    サーバー全体のレンダリングのワーカー数を決める（CPUコア数と、空きメモリに収まる数の小さいほう）
+
+    環境変数 TUBEAUTO_RENDER_WORKERS が設定されていれば、それを使う。
+    """
+    configured = os.getenv("TUBEAUTO_RENDER_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    workers = os.cpu_count() or 1
+    memory = available_memory_mb()
+    if memory is not None:
+        per_worker = float(os.getenv("TUBEAUTO_RENDER_WORKER_MB", RENDER_WORKER_MB))
+        workers = min(workers, int(memory // per_worker))
+    return max(1, workers)
+
+
+class JobRun:
+    """
+    1回の実行（テーマ、ジョブのディレクトリ、オプション）と、その状態・進捗
+
+    進捗はジョブのスレッドから、状態の取得はStreamlitのスレッドから行うため、ロックで排他する。
+    """
+
+    def __init__(self, theme: str, job_dir: str, options: dict, estimate: float):
+        """
+        Args:
+            theme: 動画のテーマ
+            job_dir: ジョブのディレクトリ
+            options: job.arun_job() のその他の引数
+            estimate: 所要時間の見込み（秒）
+        """
+        self.run_id = uuid.uuid4().hex[:12]
+        self.theme = theme
+        self.job_dir = os.path.abspath(job_dir)
+        self.options = options
+        self.estimate = estimate
+        self.status = QUEUED
+        self.events = []        # (kind, index) の最近の進捗
+        self.completed = 0      # 完了した進捗の数
+        self.sections = set()   # 届いたセクションの番号
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.video_path = None
+        self.error = None
+        self.cancel_requested = False
+        self.queue_position = None
+        self.eta_seconds = None
+        self._loop = None
+        self._task = None
+        self._lock = threading.Lock()
+
+    @property
+    def steps_per_section(self) -> int:
+        """1セクションあたりの進捗の数（台本、画像、音声、パイプライン生成ではセグメント）"""
+        return 4 if self.options.get("pipelined", True) else 3
+
+    def on_progress(self, kind: str, index: int, path: str) -> None:
+        """ジョブの進捗を記録する（job.arun_job() の on_progress）"""
+        with self._lock:
+            self.completed += 1
+            self.sections.add(index)
+            self.events.append((kind, index))
+            del self.events[:-MAX_EVENTS]
+
+    def progress(self) -> int:
+        """進捗の見積もり（0〜100）。セクション数は台本が届くまで分からないため、最低3セクションとして見積もる"""
+        if self.status == DONE:
+            return 100
+        expected = max(len(self.sections), 3) * self.steps_per_section
+        return min(95, self.completed * 95 // expected)
+
+    def remaining(self, now: float) -> float:
+        """完了までの残り時間の見込み（秒）"""
+        if self.status == RUNNING:
+            return max(0.0, self.estimate - (now - self.started_at))
+        return self.estimate
+
+    def snapshot(self) -> dict:
+        """現在の状態をUI用の辞書で返す"""
+        with self._lock:
+            now = time.time()
+            end = self.finished_at or now
+            return {
+                "run_id": self.run_id,
+                "theme": self.theme,
+                "job_dir": self.job_dir,
+                "status": self.status,
+                "progress": self.progress(),
+                "events": list(self.events),
+                "sections": len(self.sections),
+                "elapsed": end - (self.started_at or end),
+                "queue_position": self.queue_position,
+                "eta_seconds": self.eta_seconds if self.status == QUEUED else (
+                    self.remaining(now) if self.status == RUNNING else None),
+                "video_path": self.video_path,
+                "error": self.error,
+                "cancel_requested": self.cancel_requested,
+            }
+
+
+class JobRunner:
+    """
+    ジョブを優先度付きの実行待ちの列に並べ、空きができたものから実行するスケジューラー
+    （サーバーのプロセス内で1つを共有する）
+    """
+
+    def __init__(self, max_jobs: int = MAX_CONCURRENT_JOBS, render_workers: int = None, workspace=None):
+        """
+        Args:
+            max_jobs: 同時に実行するジョブ数
+            render_workers: レンダリングのワーカー数（Noneの場合は render_worker_count()）
+            workspace: workspace.Workspace。指定した場合はジョブを始める前に空き容量を確保し、
+                ジョブ1つあたりの容量の上限を守らせる
+        """
+        self.max_jobs = max(1, max_jobs)
+        self.render_workers = render_workers or render_worker_count()
+        self.workspace = workspace
+        self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="tubeauto-job")
+        self._render_executor = None
+        self._runs = {}
+        self._queue = []
+        self._running = 0
+        self._seconds_per_section = DEFAULT_SECONDS_PER_SECTION
+        self._lock = threading.Lock()
+
+    def submit(self, theme: str, job_dir: str, **options) -> str:
+        """
+        ジョブを実行待ちに追加する（同じジョブのディレクトリが実行中の場合は、その実行IDを返す）
+
+        Args:
+            theme: 動画のテーマ
+            job_dir: ジョブのディレクトリ
+            options: job.arun_job() のその他の引数（pipelined、refresh、restart など）
+
+        Returns:
+            実行ID
+        """
+        estimate = self._estimate(job_dir, options)
+        with self._lock:
+            self._prune()
+            active = self._find_active(job_dir)
+            if active is not None:
+                return active.run_id
+            run = JobRun(theme, job_dir, options, estimate)
+            self._runs[run.run_id] = run
+            self._queue.append(run)
+            self._dispatch()
+        return run.run_id
+
+    def status(self, run_id: str) -> dict | None:
+        """実行の状態を返す（見つからない場合はNone）"""
+        run = self._runs.get(run_id)
+        if run is None:
+            return None
+        if run.status == QUEUED:
+            with self._lock:
+                self._update_queue()
+        return run.snapshot()
+
+    def stats(self) -> dict:
+        """サーバー全体の状態（実行中・実行待ちのジョブ数、レンダリングのワーカー数）"""
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": len(self._queue),
+                "max_jobs": self.max_jobs,
+                "render_workers": self.render_workers,
+                "seconds_per_section": round(self._seconds_per_section, 1),
+            }
+
+    def active_job_dirs(self) -> set:
+        """実行中・実行待ちのジョブのディレクトリ"""
+        with self._lock:
+            return {run.job_dir for run in self._runs.values() if run.status in ACTIVE_STATES}
+
+    def cancel(self, run_id: str) -> bool:
+        """
+        実行を取り消す（実行待ちの場合は列から外す。実行中の場合は処理を中断する）
+
+        Args:
+            run_id: 実行ID
+
+        Returns:
+            取り消しを受け付けた場合はTrue
+        """
+        run = self._runs.get(run_id)
+        if run is None:
+            return False
+        with self._lock:
+            if run in self._queue:
+                self._queue.remove(run)
+                with run._lock:
+                    run.status = CANCELLED
+                    run.cancel_requested = True
+                    run.finished_at = time.time()
+                return True
+        with run._lock:
+            if run.status != RUNNING:
+                return False
+            run.cancel_requested = True
+            loop, task = run._loop, run._task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # イベントループが既に終了している
+        return True
+
+    def _estimate(self, job_dir: str, options: dict) -> float:
+        """
+        ジョブの所要時間を見積もる（記録があれば、台本のセクション数と生成済みの素材を考慮する）
+        """
+        from job import JobManifest
+
+        manifest = None if options.get("restart") else JobManifest.load(job_dir)
+        sections = DEFAULT_SECTIONS
+        remaining = 1.0
+        if manifest is not None:
+            if manifest.video_path():
+                return 1.0
+            sections = len(manifest.data["script"]) or DEFAULT_SECTIONS
+            assets = sum(len(entry) for entry in manifest.data["assets"].values())
+            # 素材の生成とレンダリングがおおよそ半分ずつ
+            remaining -= 0.5 * min(1.0, assets / (2 * sections))
+        return sections * self._seconds_per_section * remaining
+
+    def _priority(self, run: JobRun, now: float) -> float:
+        """小さいほど先に実行する（見込み時間が短く、長く待っているジョブ）"""
+        return run.estimate - QUEUE_AGING * (now - run.created_at)
+
+    def _update_queue(self) -> None:
+        """実行待ちの列を優先度順に並べ、順番と開始・完了の見込みを更新する（ロックを持って呼ぶ）"""
+        now = time.time()
+        self._queue.sort(key=lambda run: self._priority(run, now))
+        # 空きができる時刻の見込み（実行中のジョブの残り時間）
+        slots = sorted(run.remaining(now) for run in self._runs.values() if run.status == RUNNING)
+        slots += [0.0] * (self.max_jobs - len(slots))
+        for position, run in enumerate(self._queue, 1):
+            start = min(slots)
+            slots[slots.index(start)] = start + run.estimate
+            run.queue_position = position
+            run.eta_seconds = start + run.estimate
+
+    def _dispatch(self) -> None:
+        """空きがあれば、優先度の高いジョブから実行を始める（ロックを持って呼ぶ）"""
+        self._update_queue()
+        while self._queue and self._running < self.max_jobs:
+            run = self._queue.pop(0)
+            with run._lock:
+                # スレッドが動き出す前でも、実行待ちの順番ではなく実行中として表示する
+                run.status = RUNNING
+                run.started_at = time.time()
+                run.queue_position = None
+            self._running += 1
+            self._executor.submit(self._execute, run)
+        self._update_queue()
+
+    def _get_render_executor(self):
+        """サーバー全体で共有するレンダリングのプロセスプール（最初に使うときに作る）"""
+        with self._lock:
+            if self._render_executor is None:
+                from pipeline import create_render_executor
+                self._render_executor = create_render_executor(self.render_workers)
+            return self._render_executor
+
+    def _find_active(self, job_dir: str) -> JobRun | None:
+        job_dir = os.path.abspath(job_dir)
+        for run in self._runs.values():
+            if run.job_dir == job_dir and run.status in ACTIVE_STATES:
+                return run
+        return None
+
+    def _prune(self) -> None:
+        """終了してから時間の経った実行の記録を削除する"""
+        now = time.time()
+        for run_id, run in list(self._runs.items()):
+            if run.finished_at and now - run.finished_at > KEEP_FINISHED_SECONDS:
+                del self._runs[run_id]
+
+    def _execute(self, run: JobRun) -> None:
+        """ジョブのスレッドで実行する"""
+        try:
+            self._run_job(run)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if run.status == DONE and run.sections:
+                    # 実績から1セクションあたりの秒数の見積もりを更新する
+                    observed = (run.finished_at - run.started_at) / len(run.sections)
+                    self._seconds_per_section += ESTIMATE_SMOOTHING * (observed - self._seconds_per_section)
+                self._dispatch()
+
+    def _run_job(self, run: JobRun) -> None:
+        from job import arun_job
+        from utils import run_async
+
+        options = dict(run.options)
+        if options.get("pipelined", True):
+            # 同時に実行するジョブのレンダリングは、共有のプロセスプールで順番に行う
+            options.setdefault("executor", self._get_render_executor())
+
+        async def main():
+            with run._lock:
+                run._loop = asyncio.get_running_loop()
+                run._task = asyncio.current_task()
+                if run.cancel_requested:
+                    raise asyncio.CancelledError()
+            return await arun_job(run.theme, run.job_dir, on_progress=run.on_progress, **options)
+
+        with run._lock:
+            if run.cancel_requested:
+                run.status = CANCELLED
+                run.finished_at = time.time()
+                return
+        try:
+            if self.workspace is not None:
+                # 古いジョブを削除して、このジョブの分の空き容量を確保する（実行中のジョブは残す）
+                from workspace import tree_size
+                needed = max(0, self.workspace.max_job_bytes - tree_size(run.job_dir))
+                self.workspace.reserve(self.active_job_dirs(), needed)
+                options.setdefault("workspace", self.workspace)
+            video_path = run_async(main())
+            status, error = DONE, None
+        except asyncio.CancelledError:
+            video_path, status, error = None, CANCELLED, None
+        except Exception as e:
+            video_path, status, error = None, FAILED, str(e)
+        with run._lock:
+            run.status = status
+            run.video_path = video_path
+            run.error = error
+            run.finished_at = time.time()
+            run._loop = run._task = None
+
+
+@functools.lru_cache(maxsize=None)
+def get_runner() -> JobRunner:
+    """サーバーのプロセス内で共有するJobRunnerを取得する（Streamlitのセッションと再実行をまたいで同じもの）"""
+    from runtime import load_env
+    from workspace import Workspace
+
+    load_env()
+    workspace = Workspace()
+    # 前回の異常終了で残った一時ファイルを削除する
+    workspace.clean_orphans()
+    return JobRunner(int(os.getenv("TUBEAUTO_MAX_JOBS", MAX_CONCURRENT_JOBS)), workspace=workspace)
@@ -0,0 +1,226 @@
+"""
+エンドツーエンドの負荷試験
+偽のOpenAI APIサーバー（fake_openai.py）に向けて、台本 -> 画像・音声 -> 動画のジョブを同時に実行し、
+1分あたりに完成する動画の数と、工程ごとの所要時間を計測する（APIの料金もネットワークも使わない）
+
+使い方:
+    python loadtest.py --jobs 8 --concurrency 2
+    python loadtest.py --jobs 20 --concurrency 4 --time-scale 0.2 --errors 429=0.05 --errors 500=0.01 --json loadtest.json
+    python loadtest.py --jobs 10 --rpm images=5        # 本物に近いレート制限
+    python loadtest.py --base-url http://127.0.0.1:8765/v1  # 別に起動した fake_openai.py を使う
+
+APIキャッシュは使わない（毎回APIを呼ぶ）。rate_limiter のレート制限は環境変数（TUBEAUTO_RPM_IMAGES など）に従う。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import platform
+import urllib.request
+from datetime import datetime, timezone
+
+from fake_openai import add_server_arguments, percentile, server_options, start_server
+
+# 偽のサーバーに送るAPIキー（本物のキーを送らないようにする）
+FAKE_API_KEY = "sk-fake-loadtest-0123456789abcdef"
+
+# 集計する工程（ジョブの開始からの時間）
+STAGES = ["queue", "first_section", "script", "assets", "video"]
+STAGE_LABELS = {
+    "queue": "開始待ち",
+    "first_section": "最初のセクション",
+    "script": "台本の完成",
+    "assets": "素材の完成",
+    "video": "動画の完成",
+}
+
+
+async def run_job(index: int, args, executor, slots: asyncio.Semaphore) -> dict:
+    """
+    1つのジョブを実行し、工程ごとの時刻を記録する
+
+    Returns:
+        {"index", "status", "error", "stages": {工程: 秒}}
+    """
+    from job import arun_job
+
+    job_dir = os.path.join(args.work_dir, f"job_{index:03d}")
+    submitted = time.perf_counter()
+    async with slots:
+        start = time.perf_counter()
+        events = {}
+
+        def on_progress(kind: str, index: int, path: str) -> None:
+            now = time.perf_counter() - start
+            if kind == "script":
+                events.setdefault("first_section", now)
+                events["script"] = now
+            elif kind in ("image", "audio"):
+                events["assets"] = now
+
+        try:
+            await arun_job(
+                f"負荷試験 {index + 1}", job_dir, pipelined=not args.no_pipeline, restart=True,
+                on_progress=on_progress, resolution=args.resolution, fps=args.fps, executor=executor,
+            )
+            status, error = "done", None
+            events["video"] = time.perf_counter() - start
+        except Exception as e:
+            status, error = "failed", str(e)
+        events["queue"] = start - submitted
+        if not args.keep:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        return {"index": index, "status": status, "error": error,
+                "stages": {stage: round(seconds, 3) for stage, seconds in events.items()}}
+
+
+async def run_load(args) -> list:
+    """ジョブをまとめて実行する（レンダリングのプロセスプールは共有する）"""
+    from pipeline import create_render_executor
+
+    executor = create_render_executor(args.render_workers)
+    slots = asyncio.Semaphore(max(1, args.concurrency))
+    try:
+        return await asyncio.gather(*(run_job(i, args, executor, slots) for i in range(args.jobs)))
+    finally:
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+
+def fetch_server_stats(base_url: str) -> dict | None:
+    """偽のサーバーの統計を取得する（取得できない場合はNone）"""
+    url = base_url.rstrip("/").removesuffix("/v1") + "/stats"
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    """ジョブの結果から、スループットと工程ごとの所要時間（p50・p95・最大）を集計する"""
+    done = [r for r in results if r["status"] == "done"]
+    stages = {}
+    for stage in STAGES:
+        values = sorted(r["stages"][stage] for r in done if stage in r["stages"])
+        stages[stage] = {
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "max": round(values[-1], 3) if values else 0.0,
+        }
+    return {
+        "jobs": len(results),
+        "done": len(done),
+        "failed": len(results) - len(done),
+        "seconds": round(elapsed, 2),
+        "jobs_per_minute": round(len(done) / elapsed * 60, 2) if elapsed else 0.0,
+        "stages": stages,
+    }
+
+
+def print_report(summary: dict, server_stats: dict | None, scheduler_stats: dict) -> None:
+    """結果を表示する"""
+    print(f"\n完了: {summary['done']}件 / 失敗: {summary['failed']}件 / {summary['seconds']:.1f}秒")
+    print(f"  ジョブ/分: {summary['jobs_per_minute']}")
+    print(f"  API: リクエスト {scheduler_stats['requests']}回、再試行 {scheduler_stats['retries']}回、"
+          f"レート制限の待ち {scheduler_stats['waited_seconds']:.1f}秒")
+
+    print("\n工程（ジョブの開始からの秒数）")
+    print(f"  {'':<12}{'p50':>9}{'p95':>9}{'max':>9}")
+    for stage in STAGES:
+        values = summary["stages"][stage]
+        print(f"  {STAGE_LABELS[stage]:<12}{values['p50']:>9.2f}{values['p95']:>9.2f}{values['max']:>9.2f}")
+
+    if server_stats:
+        print("\nサーバー側（成功したリクエストの応答時間、秒）")
+        print(f"  {'':<8}{'req':>6}{'req/s':>8}{'p50':>8}{'p95':>8}{'max':>8}  エラー")
+        for endpoint, stats in server_stats["endpoints"].items():
+            errors = "、".join(f"{status}: {count}" for status, count in stats["errors"].items()) or "-"
+            print(f"  {endpoint:<8}{stats['requests']:>6}{stats['requests_per_second']:>8.2f}"
+                  f"{stats['latency_p50']:>8.2f}{stats['latency_p95']:>8.2f}{stats['latency_max']:>8.2f}  {errors}")
+
+
+def parse_resolution(value: str) -> tuple:
+    """'1920x1080' 形式の解像度を (幅, 高さ) に変換する"""
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"解像度は 幅x高さ の形式で指定してください: {value}")
+    return width, height
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="偽のOpenAI APIサーバーを使ったエンドツーエンドの負荷試験")
+    parser.add_argument("--jobs", type=int, default=8, help="実行するジョブ数")
+    parser.add_argument("--concurrency", type=int, default=2, help="同時に実行するジョブ数")
+    parser.add_argument("--render-workers", type=int, default=None, help="レンダリングのプロセス数（デフォルト: CPUコア数）")
+    parser.add_argument("--resolution", type=parse_resolution, default=(640, 360), help="解像度（例: 1280x720）")
+    parser.add_argument("--fps", type=int, default=24, help="フレームレート")
+    parser.add_argument("--no-pipeline", action="store_true", help="素材をそろえてから動画を合成する（パイプライン生成を使わない）")
+    parser.add_argument("--base-url", default=None,
+                        help="別に起動した偽のサーバーのURL（例: http://127.0.0.1:8765/v1。指定しない場合はこのプロセスで起動する）")
+    parser.add_argument("--work-dir", default=None, help="ジョブのディレクトリ（デフォルト: 一時ディレクトリ）")
+    parser.add_argument("--keep", action="store_true", help="生成したジョブのディレクトリを残す")
+    parser.add_argument("--json", dest="json_path", help="結果をJSONで保存するパス")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.base_url is None:
+        try:
+            server = start_server(**server_options(args))
+        except ValueError as e:
+            parser.error(str(e))
+        args.base_url = server.base_url
+        print(f"偽のOpenAI APIサーバーを起動しました: {args.base_url}", file=sys.stderr)
+
+    # utils と rate_limiter は読み込むときに環境変数を読むため、先に設定する
+    os.environ["OPENAI_BASE_URL"] = args.base_url
+    os.environ["OPENAI_API_KEY"] = FAKE_API_KEY
+    os.environ["TUBEAUTO_API_CACHE"] = "0"
+    from rate_limiter import scheduler
+    from utils import run_async
+
+    own_work_dir = args.work_dir is None
+    args.work_dir = args.work_dir or tempfile.mkdtemp(prefix="tubeauto_loadtest_")
+    os.makedirs(args.work_dir, exist_ok=True)
+    print(f"ジョブ: {args.jobs}件（同時に {args.concurrency}件）", file=sys.stderr)
+    try:
+        start = time.perf_counter()
+        results = run_async(run_load(args))
+        elapsed = time.perf_counter() - start
+    finally:
+        if own_work_dir and not args.keep:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    summary = summarize(results, elapsed)
+    server_stats = fetch_server_stats(args.base_url)
+    print_report(summary, server_stats, scheduler.stats)
+    for result in results:
+        if result["error"]:
+            print(f"❌ job_{result['index']:03d}: {result['error']}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "options": {key: value for key, value in vars(args).items() if key != "json_path"},
+                "summary": summary,
+                "scheduler": dict(scheduler.stats),
+                "server": server_stats,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.json_path}")
+    if server:
+        server.shutdown()
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
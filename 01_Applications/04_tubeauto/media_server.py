@@ -0,0 +1,246 @@
+"""
+動画配信モジュール
+完成した動画をディスクから少しずつ読み出して配信する、HTTPのRangeリクエストに対応した小さなサーバー
+
+st.video() や st.download_button() に動画のバイト列を渡すと、動画全体がPythonのメモリと
+Streamlitのメディアストアにコピーされ、再実行のたびに繰り返される。このサーバーは登録した
+ファイルだけをURLで配信するため、動画の大きさに関係なくセッションごとのメモリは一定になる。
+ブラウザは必要な範囲だけを取得するので、再生位置の移動（シーク）もすぐにできる。
+
+ブラウザはStreamlitとは別のURL（別のポート）から動画を取得するため、ブラウザからそのURLに届く場合にしか使えない
+（リモートのユーザー、Streamlit Cloud、Docker、HTTPSのページ（混在コンテンツとしてブロックされる）では届かない）。
+そのため、環境変数で固定のポートを設定した場合だけ起動する。設定していない場合、
+get_media_server() はNoneを返し、アプリは同じオリジンの st.video() / st.download_button() で表示する。
+
+環境変数（TUBEAUTO_MEDIA_PORT を設定すると使う。URLやアドレスだけを設定した場合は警告して使わない）:
+    TUBEAUTO_MEDIA_HOST: 待ち受けるアドレス（デフォルト: 127.0.0.1。他のマシンから見る場合は 0.0.0.0）
+    TUBEAUTO_MEDIA_PORT: 待ち受けるポート（固定のポート。ブラウザやリバースプロキシから届くようにする）
+    TUBEAUTO_MEDIA_URL: ブラウザから見たサーバーのURL（例: https://example.com/tubeauto-media。
+        HTTPSのページではHTTPSのURLにする。デフォルト: http://localhost:<ポート>）
+
+使い方:
+    media_server = get_media_server()
+    if media_server is not None:
+        url = media_server.url_for(video_path)                 # 再生用
+        url = media_server.url_for(video_path, download=True)  # ダウンロード用
+"""
+
+import os
+import re
+import secrets
+import functools
+import threading
+import mimetypes
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 1回に読み出して送る大きさ
+CHUNK_SIZE = 1024 * 1024
+
+# 登録しておくファイルの数の上限（古いものから登録を解除する）
+MAX_REGISTERED_FILES = 1000
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Rangeヘッダー（1つの範囲だけ）を解析する
+
+    Args:
+        header: Rangeヘッダーの値（例: "bytes=0-1023"、"bytes=1024-"、"bytes=-500"）
+        size: ファイルの大きさ
+
+    Returns:
+        (開始位置, 終了位置) のタプル（終了位置を含む）。満たせない範囲の場合はNone
+
+    Raises:
+        ValueError: ヘッダーの形式が正しくない場合
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None or match.groups() == ("", ""):
+        raise ValueError(f"Rangeヘッダーの形式が正しくありません: {header}")
+    start, end = match.groups()
+    if start == "":
+        # 末尾からの長さの指定
+        length = int(end)
+        if length == 0:
+            return None
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = size - 1 if end == "" else min(int(end), size - 1)
+    if start >= size or start > end:
+        return None
+    return start, end
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """登録されたファイルを /media/<トークン>/<ファイル名> で配信する"""
+
+    server_version = "tubeauto-media"
+
+    def log_message(self, format, *args):
+        pass  # アクセスのたびにログを出さない
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        path = self.server.files.get(parts[1]) if len(parts) == 3 and parts[0] == "media" else None
+        if path is None or not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        status = 200
+        if self.headers.get("Range"):
+            try:
+                requested = parse_range(self.headers["Range"], size)
+            except ValueError:
+                requested = (0, size - 1)  # 解釈できない場合はファイル全体を返す
+            if requested is None:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if requested != (0, size - 1):
+                start, end = requested
+                status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Cache-Control", "private, max-age=3600")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        if "download=1" in url.query:
+            filename = urllib.parse.quote(urllib.parse.unquote(parts[2]))
+            self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{filename}")
+        self.end_headers()
+        if not send_body:
+            return
+
+        remaining = end - start + 1
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ブラウザがシークなどで接続を切った
+
+
+class MediaServer:
+    """バックグラウンドのスレッドで動く動画配信サーバー"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, base_url: str = None):
+        """
+        Args:
+            host: 待ち受けるアドレス
+            port: 待ち受けるポート（0の場合は空いているポート）
+            base_url: ブラウザから見たサーバーのURL（Noneの場合は http://localhost:<ポート>）
+
+        Raises:
+            OSError: ポートを開けなかった場合
+        """
+        self._server = ThreadingHTTPServer((host, port), MediaHandler)
+        self._server.daemon_threads = True
+        self._server.files = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self.port = self._server.server_address[1]
+        self.base_url = (base_url or f"http://localhost:{self.port}").rstrip("/")
+        threading.Thread(target=self._server.serve_forever, name="tubeauto-media", daemon=True).start()
+
+    def register(self, path: str) -> str:
+        """
+        ファイルを配信の対象に登録する（同じファイルは同じトークンになる）
+
+        Args:
+            path: ファイルのパス
+
+        Returns:
+            URLに使うトークン（推測できないランダムな文字列）
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            token = self._tokens.get(path)
+            if token is None:
+                token = secrets.token_urlsafe(16)
+                self._tokens[path] = token
+                self._server.files[token] = path
+                while len(self._tokens) > MAX_REGISTERED_FILES:
+                    oldest = next(iter(self._tokens))
+                    del self._server.files[self._tokens.pop(oldest)]
+            return token
+
+    def url_for(self, path: str, download: bool = False, filename: str = None) -> str:
+        """
+        ファイルを配信するURLを返す
+
+        Args:
+            path: ファイルのパス
+            download: Trueの場合はダウンロード用のURL（保存ダイアログを出す）
+            filename: URLに使うファイル名（Noneの場合は元のファイル名）
+
+        Returns:
+            URL
+        """
+        token = self.register(path)
+        name = urllib.parse.quote(filename or os.path.basename(path))
+        return f"{self.base_url}/media/{token}/{name}" + ("?download=1" if download else "")
+
+    def shutdown(self) -> None:
+        """サーバーを停止する"""
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def is_configured() -> bool:
+    """
+    固定のポートが設定されているかどうか
+
+    URLやアドレスだけを設定した場合はランダムなポートで待ち受けることになり、ブラウザから届かないため、
+    警告して設定されていないものとして扱う。
+    """
+    from runtime import load_env
+
+    load_env()
+    if os.getenv("TUBEAUTO_MEDIA_PORT"):
+        return True
+    if os.getenv("TUBEAUTO_MEDIA_URL") or os.getenv("TUBEAUTO_MEDIA_HOST"):
+        print("警告: 動画配信サーバーには TUBEAUTO_MEDIA_PORT（固定のポート）の設定が必要です。"
+              "動画配信サーバーを使わずに表示します。")
+    return False
+
+
+@functools.lru_cache(maxsize=None)
+def get_media_server() -> MediaServer | None:
+    """
+    サーバーのプロセス内で共有するMediaServerを取得する（最初に呼ばれたときに起動する）
+
+    Returns:
+        MediaServer。設定されていない場合はNone（ランダムなポートのlocalhostのURLは、多くの環境でブラウザから届かない）
+
+    Raises:
+        OSError: ポートを開けなかった場合
+    """
+    if not is_configured():
+        return None
+    return MediaServer(
+        host=os.getenv("TUBEAUTO_MEDIA_HOST", "127.0.0.1"),
+        port=int(os.getenv("TUBEAUTO_MEDIA_PORT")),
+        base_url=os.getenv("TUBEAUTO_MEDIA_URL") or None,
+    )
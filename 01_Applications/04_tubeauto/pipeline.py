@@ -0,0 +1,202 @@
+"""
+パイプライン生成モジュール
+画像と音声の生成（API待ち）と動画のレンダリング（CPU処理）を重ねて実行する
+
+セクションの画像と音声がそろった時点で、そのセクションのセグメントをレンダリングし始め、
+最後にすべてのセグメントを順番どおりに再エンコードせずに連結する。
+完成までの時間は「API時間 + レンダリング時間」ではなく、おおよそ長いほうになる。
+"""
+
+import os
+import shutil
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from disk_cache import DiskCache, DEFAULT_MAX_BYTES
+from utils import agenerate_assets, aiter_script_sections, run_async, IMAGE_CONCURRENCY, AUDIO_CONCURRENCY
+from video_generator import (
+    FPS, VIDEO_WIDTH, VIDEO_HEIGHT, acreate_video, concat_segments, is_ffmpeg_available,
+    discard_decoded_images, plan_section, render_section_segment, section_cache_key, _init_render_worker,
+)
+from workspace import make_scratch_dir
+
+
+def create_render_executor(workers: int = None) -> ProcessPoolExecutor:
+    """
+    セクションのレンダリング用のプロセスプールを作る
+
+    Args:
+        workers: ワーカープロセス数（Noneの場合はCPUコア数）
+
+    Returns:
+        ProcessPoolExecutor
+    """
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=_init_render_worker)
+
+
+def _terminate_workers(executor: ProcessPoolExecutor) -> None:
+    """
+    実行中のレンダリングの終了を待たずに、ワーカープロセスを終了する（取り消し・失敗時に、CPUとメモリをすぐに空ける）
+
+    ProcessPoolExecutorにはワーカーを止める公開APIがないため、プロセスを直接終了する。
+    ワーカーが起動したffmpegは、標準入力が閉じられて終了する。
+    """
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+
+
+async def _collect(sections, into: list):
+    """非同期イテレーターのセクションをリストに追加しながら、そのまま返す"""
+    async for section in sections:
+        into.append(section)
+        yield section
+
+
+async def agenerate_video_pipelined(script_data, output_dir: str, output_file: str,
+                                    ken_burns: dict = None, workers: int = None, frame_threads: int = 1,
+                                    cache_dir: str = None, cache_max_bytes: int = DEFAULT_MAX_BYTES,
+                                    resolution: tuple = None, fps: int = FPS,
+                                    image_concurrency: int = IMAGE_CONCURRENCY,
+                                    audio_concurrency: int = AUDIO_CONCURRENCY, on_progress=None,
+                                    refresh: bool = False, executor: ProcessPoolExecutor = None,
+                                    skip_existing: bool = False) -> str:
+    """
+    台本から素材を生成しながら、そろったセクションから順にレンダリングして動画を作る
+
+    Args:
+        script_data: 台本データのリスト、またはセクションを返す非同期イテレーター（aiter_script_sections() など）。
+            非同期イテレーターの場合は、台本の生成中でも届いたセクションから素材の生成を始める
+        output_dir: 画像・音声・セグメントを保存するディレクトリ
+        output_file: 出力する動画ファイルのパス
+        ken_burns: Ken Burns効果の設定（KEN_BURNS_DEFAULTSのキーを上書きする）
+        workers: レンダリングのワーカープロセス数（Noneの場合はCPUコア数）
+        frame_threads: 各セクションのフレーム合成のスレッド数
+        cache_dir: セグメントのキャッシュを保存するディレクトリ（Noneの場合はキャッシュしない）
+        cache_max_bytes: キャッシュ全体の容量の上限（バイト）
+        resolution: 動画の解像度 (幅, 高さ)（Noneの場合は1920x1080）
+        fps: フレームレート
+        image_concurrency: 画像生成の同時リクエスト数の上限
+        audio_concurrency: 音声生成の同時リクエスト数の上限
+        on_progress: 進捗を通知する関数 on_progress(kind, index, path)。
+            kindは "script"（セクションが届いた）、"image"、"audio"（素材の生成完了）、
+            "render"（セグメントの書き出し完了）のいずれか
+        refresh: Trueの場合はAPIキャッシュを使わずに素材を生成し直す
+        executor: レンダリングに使うプロセスプール（複数のジョブで共有する場合。Noneの場合はこのジョブ用に作る）
+        skip_existing: Trueの場合は素材のファイルが既にあるセクションの素材を生成しない（agenerate_assets() を参照）
+
+    Returns:
+        生成された動画ファイルのパス
+
+    Raises:
+        Exception: 素材の生成または動画の生成に失敗した場合
+    """
+    width, height = resolution or (VIDEO_WIDTH, VIDEO_HEIGHT)
+    sections = script_data if isinstance(script_data, list) else []
+    source = script_data if isinstance(script_data, list) else _collect(script_data, sections)
+
+    if not is_ffmpeg_available():
+        # セグメントの書き出しにはffmpegが必要なため、素材をそろえてから通常どおり合成する
+        print("警告: パイプライン生成にはffmpegが必要です。素材の生成後に動画を合成します。")
+        await agenerate_assets(source, output_dir, image_concurrency, audio_concurrency, on_progress, refresh,
+                               decode_images=True, skip_existing=skip_existing)
+        return await acreate_video(sections, output_file, ken_burns=ken_burns, resolution=resolution, fps=fps)
+
+    loop = asyncio.get_running_loop()
+    cache = DiskCache(cache_dir, cache_max_bytes, suffix=".mp4") if cache_dir else None
+    segment_dir = make_scratch_dir("segments_", output_dir)
+    own_executor = executor is None
+    if own_executor:
+        executor = create_render_executor(workers)
+    renders = {}  # セクション番号 -> セグメントのパスを返すタスク
+    ready = {}    # セクション番号 -> 生成済みの素材の種類
+    futures = []  # このジョブがプロセスプールに投入したレンダリング
+    # 作成すると、このジョブの実行中のレンダリングが中断する（共有のプロセスプールではワーカーを終了できないため）
+    cancel_path = os.path.join(segment_dir, ".cancel")
+
+    async def render(index: int) -> str:
+        """そろったセクションを、キャッシュになければワーカープロセスでレンダリングする"""
+        plan = plan_section(sections[index], index, fps, ken_burns)
+        key = section_cache_key(plan, fps, width, height) if cache else None
+        # キャッシュにあればセグメントのディレクトリにリンクする（連結する前にほかのプロセスが
+        # キャッシュから削除しても、このジョブのセグメントは残る）
+        path = os.path.join(segment_dir, f"segment_{index:04d}.mp4")
+        if not (cache and cache.fetch(key, path)):
+            future = executor.submit(
+                render_section_segment, plan, path, fps, width, height, frame_threads, None, cancel_path
+            )
+            futures.append(future)
+            # タスクが取り消されると、開始前のレンダリングも取り消される
+            await asyncio.wrap_future(future)
+            if cache:
+                # セグメントは残したままキャッシュにリンクする（容量の調整は最後にまとめて行う）
+                cache.put(key, path, evict=False, keep_src=True)
+        if on_progress:
+            on_progress("render", index, path)
+        return path
+
+    def on_asset(kind: str, index: int, path: str) -> None:
+        if on_progress:
+            on_progress(kind, index, path)
+        if kind == "script":
+            return
+        ready.setdefault(index, set()).add(kind)
+        if ready[index] == {"image", "audio"}:
+            renders[index] = asyncio.create_task(render(index))
+
+    try:
+        await agenerate_assets(source, output_dir, image_concurrency, audio_concurrency, on_asset, refresh,
+                               decode_images=True, skip_existing=skip_existing)
+        segment_paths = [await renders[i] for i in range(len(sections))]
+        await asyncio.to_thread(concat_segments, segment_paths, output_file)
+    except BaseException:
+        with open(cancel_path, "w"):
+            pass
+        for task in renders.values():
+            task.cancel()
+        await asyncio.gather(*renders.values(), return_exceptions=True)
+        if own_executor:
+            # このジョブ専用のワーカーなので、途中のセグメントを書き終えるのを待たない
+            _terminate_workers(executor)
+        # 共有のプロセスプールでも、このジョブのレンダリングが止まるのを待ってからセグメントを消す
+        await asyncio.to_thread(wait, futures)
+        raise
+    finally:
+        # 実行中のレンダリングの終了を待ってから一時ファイルを消す
+        if own_executor:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        discard_decoded_images(output_dir)
+        if cache:
+            cache.evict()
+
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        raise Exception(f"動画ファイルが正しく作成されませんでした: {output_file}")
+    return output_file
+
+
+def generate_video_pipelined(script_data: list, output_dir: str, output_file: str, **kwargs) -> str:
+    """
+    台本から素材を生成しながら動画を作る（同期版）
+
+    引数と戻り値は agenerate_video_pipelined() と同じ。on_progressは呼び出し元のスレッドで呼ばれる。
+    """
+    return run_async(agenerate_video_pipelined(script_data, output_dir, output_file, **kwargs))
+
+
+def generate_video_from_theme(theme: str, output_dir: str, output_file: str, refresh: bool = False, **kwargs) -> str:
+    """
+    テーマから台本をストリーミングで生成し、届いたセクションから素材の生成とレンダリングを始めて動画を作る
+
+    Args:
+        theme: 動画のテーマ
+        output_dir: 画像・音声・セグメントを保存するディレクトリ
+        output_file: 出力する動画ファイルのパス
+        refresh: Trueの場合はAPIキャッシュを使わずに生成し直す
+        kwargs: agenerate_video_pipelined() のその他の引数
+
+    Returns:
+        生成された動画ファイルのパス
+    """
+    return run_async(agenerate_video_pipelined(
+        aiter_script_sections(theme, refresh), output_dir, output_file, refresh=refresh, **kwargs
+    ))
@@ -0,0 +1,258 @@
+"""
+APIリクエストのスケジューラー
+エンドポイント（chat、images、speech）ごとのトークンバケットでリクエストの開始を調整し、
+429（レート制限）と5xxはRetry-Afterに従って、ジッター付きの指数バックオフで再試行する
+
+トークンバケットは先着順に「開始してよい時刻」を予約するため、同じプロセス内の複数のジョブが
+同時にリクエストしても、順番どおりに公平に実行され、全体のスループットはAPIの上限に保たれる。
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+# エンドポイントごとのデフォルトの上限（1分あたりのリクエスト数とトークン数）。
+# 環境変数 TUBEAUTO_RPM_CHAT、TUBEAUTO_TPM_CHAT などで上書きできる（0は無制限）
+DEFAULT_LIMITS = {
+    "chat": {"rpm": 500, "tpm": 30000},
+    "images": {"rpm": 5, "tpm": 0},
+    "speech": {"rpm": 50, "tpm": 0},
+}
+
+# 再試行の設定
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0   # 最初の待ち時間（秒）
+BACKOFF_MAX = 60.0   # 待ち時間の上限（秒）
+
+
+class TokenBucket:
+    """
+    トークンバケット（1分あたりの上限を、一定の速度で補充されるトークンとして扱う）
+
+    reserve() は待たずに「開始してよいまでの秒数」を返すので、スレッドからも非同期コードからも使える。
+    トークンは前借りでき、前借りした分だけ後の呼び出しが待つため、呼び出した順に開始できる。
+    """
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        """
+        Args:
+            per_minute: 1分あたりに補充されるトークン数
+            capacity: 一度に使えるトークン数の上限（Noneの場合は1分ぶん）
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """
+        トークンを予約する
+
+        Args:
+            amount: 使うトークン数（バケットの容量を超える場合は容量として扱う）
+
+        Returns:
+            リクエストを開始するまでに待つ秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= min(amount, self.capacity)
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """
+        APIからRetry-Afterを指定された場合に、このバケットの新しいリクエストを一時停止する
+
+        Args:
+            seconds: 停止する秒数
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def _limit_from_env(endpoint: str, kind: str) -> float:
+    value = os.getenv(f"TUBEAUTO_{kind.upper()}_{endpoint.upper()}")
+    return float(value) if value else DEFAULT_LIMITS.get(endpoint, {}).get(kind, 0)
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """
+    例外のレスポンスヘッダーから、再試行までの秒数を読み取る
+
+    Args:
+        error: APIの例外（openaiのAPIStatusErrorなど、responseを持つもの）
+
+    Returns:
+        待つ秒数。ヘッダーがない場合はNone
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    # OpenAIはミリ秒単位のヘッダーも返す
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        # HTTP日付形式
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    再試行すべき例外かどうか（429、5xx、接続エラー・タイムアウト）
+
+    Args:
+        error: 発生した例外
+
+    Returns:
+        再試行すべき場合はTrue
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    try:
+        import openai
+        return isinstance(error, (openai.APIConnectionError, openai.APITimeoutError))
+    except ImportError:
+        return False
+
+
+class RequestScheduler:
+    """
+    エンドポイントごとのレート制限と再試行を行うスケジューラー
+
+    使い方:
+        response = scheduler.call("chat", client.chat.completions.create, tokens=1200, **request)
+        response = await scheduler.acall("speech", async_client.audio.speech.create, **request)
+    """
+
+    def __init__(self, limits: dict = None, max_retries: int = MAX_RETRIES,
+                 backoff_base: float = BACKOFF_BASE, backoff_max: float = BACKOFF_MAX):
+        """
+        Args:
+            limits: エンドポイントごとの {"rpm": ..., "tpm": ...}（0は無制限）
+            max_retries: 再試行の最大回数
+            backoff_base: 最初の待ち時間（秒）
+            backoff_max: 待ち時間の上限（秒）
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.buckets = {}
+        for endpoint, limit in (limits or {}).items():
+            self.buckets[endpoint] = {
+                kind: TokenBucket(per_minute)
+                for kind, per_minute in limit.items() if per_minute
+            }
+        self.stats = {"requests": 0, "retries": 0, "waited_seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RequestScheduler":
+        """環境変数（TUBEAUTO_RPM_<ENDPOINT>、TUBEAUTO_TPM_<ENDPOINT>）から上限を読んで作る"""
+        from runtime import load_env
+        load_env()
+        limits = {
+            endpoint: {kind: _limit_from_env(endpoint, kind) for kind in ("rpm", "tpm")}
+            for endpoint in DEFAULT_LIMITS
+        }
+        max_retries = int(os.getenv("TUBEAUTO_MAX_RETRIES", MAX_RETRIES))
+        return cls(limits, max_retries=max_retries)
+
+    def _admit(self, endpoint: str, tokens: float) -> float:
+        """リクエストの開始を予約し、待つ秒数を返す"""
+        buckets = self.buckets.get(endpoint, {})
+        wait = 0.0
+        if "rpm" in buckets:
+            wait = max(wait, buckets["rpm"].reserve(1))
+        if "tpm" in buckets and tokens:
+            wait = max(wait, buckets["tpm"].reserve(tokens))
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["waited_seconds"] += wait
+        return wait
+
+    def _backoff(self, endpoint: str, error: Exception, attempt: int) -> float:
+        """再試行までの待ち時間を決める（Retry-Afterがあれば従い、同じエンドポイントの他のリクエストも止める）"""
+        delay = retry_after_seconds(error)
+        if delay is not None:
+            for bucket in self.buckets.get(endpoint, {}).values():
+                bucket.pause(delay)
+        else:
+            # フルジッター付きの指数バックオフ
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        with self._stats_lock:
+            self.stats["retries"] += 1
+        return delay
+
+    def call(self, endpoint: str, func, *args, tokens: float = 0, **kwargs):
+        """
+        レート制限に従ってAPIを呼び出す（同期版）
+
+        Args:
+            endpoint: エンドポイントの名前（"chat"、"images"、"speech"）
+            func: 呼び出す関数
+            tokens: このリクエストで使うトークン数の見積もり（TPMの制限に使う）
+            args, kwargs: funcに渡す引数
+
+        Returns:
+            funcの戻り値
+
+        Raises:
+            Exception: 再試行しても失敗した場合は最後の例外
+        """
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self._admit(endpoint, tokens))
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(self._backoff(endpoint, e, attempt))
+
+    async def acall(self, endpoint: str, func, *args, tokens: float = 0, **kwargs):
+        """
+        レート制限に従ってAPIを呼び出す（非同期版）
+
+        引数と戻り値は call() と同じ。funcはコルーチン関数。
+        """
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self._admit(endpoint, tokens))
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                await asyncio.sleep(self._backoff(endpoint, e, attempt))
+
+
+# プロセス内で共有するスケジューラー（同時に実行される複数のジョブで上限を分け合う）
+scheduler = RequestScheduler.from_env()
@@ -0,0 +1,323 @@
+"""
+実行環境の初期化モジュール
+環境変数の読み込み、OpenAIクライアント、字幕のフォント、ffmpegの機能を
+最初に使うときに1回だけ用意し、プロセス内で共有する
+
+インポートしただけでは何も読み込まない（重いライブラリは使う関数の中でインポートする）ため、
+StreamlitのUIやレンダリング用のワーカープロセスの起動を遅くしない。
+
+起動時間の診断:
+    python runtime.py importtime                 # 主なモジュールのインポート時間
+    python runtime.py importtime utils --top 20  # 指定したモジュールの内訳
+    python runtime.py info                       # 初期化したリソースの状態
+"""
+
+import os
+import sys
+import functools
+import subprocess
+
+# プレースホルダー値のリスト
+PLACEHOLDER_VALUES = [
+    'your_api_key_here',
+    'your_api*****here',
+    'your_api',
+    'sk-your-api-key-here',
+    'sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx',
+    'sk-proj-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx',
+]
+
+MISSING_API_KEY_MESSAGE = "OpenAI APIキーが設定されていません。`.env.local`または`.env`ファイルに`OPENAI_API_KEY`を設定してください。"
+
+# importtime で計測するモジュール（UIの起動、生成、レンダリングのワーカーで読み込むもの）
+DIAGNOSTIC_MODULES = ["runtime", "job", "subtitles", "utils", "pipeline", "video_generator"]
+
+
+def _find_env_files(name: str) -> list:
+    """
+    環境変数ファイルを探す（カレントディレクトリと、このモジュールのディレクトリから上にたどったもの）
+
+    別のディレクトリから起動した場合（例: リポジトリのルートで streamlit run 01_Applications/04_tubeauto/app.py）でも、
+    アプリのディレクトリやその上にあるファイルを読み込めるようにする。
+
+    Args:
+        name: ファイル名（例: ".env"）
+
+    Returns:
+        見つかったファイルのパスのリスト（優先する順、重複なし）
+    """
+    paths = [os.path.abspath(name)] if os.path.isfile(name) else []
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            if path not in paths:
+                paths.append(path)
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    return paths
+
+
+@functools.lru_cache(maxsize=None)
+def load_env() -> None:
+    """
+    環境変数を読み込む（プロセス内で1回だけ）
+
+    .env.localを優先し、.envはまだ設定されていない値だけを補う（_find_env_files() で探す）。
+    既に設定されている環境変数は上書きしない。
+    """
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    for name in (".env.local", ".env"):
+        for path in _find_env_files(name):
+            load_dotenv(path)
+
+
+def validate_api_key(api_key: str) -> tuple[bool, str]:
+    """
+    APIキーの妥当性をチェックする
+
+    Args:
+        api_key: チェックするAPIキー
+
+    Returns:
+        (is_valid, error_message)のタプル
+    """
+    if not api_key:
+        return False, "APIキーが設定されていません。"
+
+    # プレースホルダー値のチェック
+    api_key_lower = api_key.lower().strip()
+    for placeholder in PLACEHOLDER_VALUES:
+        if placeholder.lower() in api_key_lower:
+            return False, f"APIキーがプレースホルダー値（{placeholder}）のままです。実際のAPIキーを設定してください。"
+
+    # 形式チェック
+    if not (api_key.startswith('sk-') or api_key.startswith('BlbkFJ')):
+        return False, f"APIキーの形式が正しくありません。'sk-'または'BlbkFJ'で始まる必要があります。"
+
+    # 長さチェック（最低限の長さ）
+    if len(api_key) < 20:
+        return False, "APIキーが短すぎます。正しいAPIキーを設定してください。"
+
+    return True, ""
+
+
+def initialize_openai_client() -> tuple:
+    """
+    OpenAIクライアントを初期化し、APIキーの妥当性をチェックする
+
+    Returns:
+        (client, error_message)のタプル
+        clientがNoneの場合はエラーメッセージが返される
+    """
+    load_env()
+    api_key = os.getenv("OPENAI_API_KEY")
+
+    if not api_key:
+        return None, MISSING_API_KEY_MESSAGE
+
+    # APIキーの妥当性チェック
+    is_valid, error_message = validate_api_key(api_key)
+    if not is_valid:
+        return None, f"APIキーの設定に問題があります: {error_message}"
+
+    try:
+        from openai import OpenAI
+        # 再試行はrate_limiterのスケジューラーで行うため、クライアント自身では再試行しない
+        client = OpenAI(api_key=api_key, max_retries=0)
+        # 簡単なAPI呼び出しでテスト（オプション）
+        # client.models.list()  # コメントアウト: 起動時に毎回API呼び出しすると遅い
+        return client, ""
+    except Exception as e:
+        error_str = str(e)
+        if "401" in error_str or "invalid_api_key" in error_str.lower():
+            return None, "APIキーが無効です。正しいAPIキーを設定してください。https://platform.openai.com/account/api-keys から取得できます。"
+        elif "429" in error_str:
+            return None, "レート制限に達しています。しばらく待ってから再試行してください。"
+        else:
+            return None, f"OpenAIクライアントの初期化に失敗しました: {error_str}"
+
+
+@functools.lru_cache(maxsize=None)
+def get_client() -> tuple:
+    """
+    プロセス内で共有するOpenAIクライアントを取得する（最初に呼ばれたときに作る）
+
+    Returns:
+        (client, error_message)のタプル（initialize_openai_client() と同じ）
+    """
+    return initialize_openai_client()
+
+
+def require_client():
+    """
+    OpenAIクライアントを取得する
+
+    Returns:
+        OpenAIクライアント
+
+    Raises:
+        Exception: APIキーが設定されていない、またはクライアントを作れなかった場合
+    """
+    client, client_error = get_client()
+    if client is None:
+        raise Exception(client_error or MISSING_API_KEY_MESSAGE)
+    return client
+
+
+@functools.lru_cache(maxsize=None)
+def get_font_path() -> str | None:
+    """
+    字幕に使う日本語フォントのパス（最初に呼ばれたときに検出し、見つからなければ1回だけ警告する）
+
+    Returns:
+        フォントファイルのパス。見つからない場合はNone
+    """
+    from subtitles import find_font_path
+
+    load_env()
+    font_path = find_font_path()
+    if font_path is None:
+        print("警告: 日本語フォントが見つかりませんでした。字幕が正しく表示されない可能性があります。")
+        print("環境変数 TUBEAUTO_FONT_PATH にフォントファイルのパスを設定してください。")
+    return font_path
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_capabilities(ffmpeg_cmd: str = "ffmpeg") -> dict:
+    """
+    ffmpegのバージョンと、動画の書き出しに使うエンコーダーの有無を調べる（プロセス内で1回だけ）
+
+    Args:
+        ffmpeg_cmd: ffmpegのコマンド
+
+    Returns:
+        {"available": bool, "version": str | None, "encoders": {"libx264": bool, "aac": bool}}
+    """
+    flags = subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0
+    try:
+        version = subprocess.run([ffmpeg_cmd, '-version'], capture_output=True, text=True, creationflags=flags)
+        if version.returncode != 0:
+            raise OSError(version.stderr)
+        encoders = subprocess.run([ffmpeg_cmd, '-hide_banner', '-encoders'], capture_output=True, text=True,
+                                  creationflags=flags).stdout
+    except (FileNotFoundError, OSError):
+        return {"available": False, "version": None, "encoders": {"libx264": False, "aac": False}}
+    names = {line.split()[1] for line in encoders.splitlines() if len(line.split()) > 1}
+    first_line = version.stdout.splitlines()[0] if version.stdout else ""
+    return {
+        "available": True,
+        "version": first_line.split()[2] if len(first_line.split()) > 2 else None,
+        "encoders": {name: name in names for name in ("libx264", "aac")},
+    }
+
+
+def parse_importtime(output: str) -> list:
+    """
+    `python -X importtime` の出力を解析する
+
+    Args:
+        output: 標準エラー出力
+
+    Returns:
+        (深さ, モジュール名, 自身の時間(ms), 累積の時間(ms)) のリスト（出力順）
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # 見出しの行
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(parts[0]) / 1000, int(parts[1]) / 1000))
+    return entries
+
+
+def importtime_report(module: str, top: int = 10) -> dict:
+    """
+    モジュールを新しいプロセスでインポートし、インポート時間とその内訳を計測する
+
+    Args:
+        module: モジュール名
+        top: 内訳として返す、時間のかかったインポートの数
+
+    Returns:
+        {"module", "total_ms", "heaviest": [(モジュール名, 累積の時間(ms)), ...], "error"}
+
+    Raises:
+        Exception: Pythonを実行できなかった場合
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    entries = parse_importtime(result.stderr)
+    # 内訳はモジュールの行より前、1つ前の深さ0の行（Pythonの起動時に読み込まれたもの）より後に並ぶ
+    end = next((i for i in range(len(entries) - 1, -1, -1)
+                if entries[i][0] == 0 and entries[i][1] == module), None)
+    total, children = None, []
+    if end is not None:
+        start = next((i + 1 for i in range(end - 1, -1, -1) if entries[i][0] == 0), 0)
+        total = entries[end][3]
+        children = [(name, cumulative) for depth, name, _, cumulative in entries[start:end] if depth == 1]
+    error = None
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["不明なエラー"])[-1]
+    return {
+        "module": module,
+        "total_ms": total,
+        "heaviest": sorted(children, key=lambda item: item[1], reverse=True)[:top],
+        "error": error,
+    }
+
+
+def describe() -> dict:
+    """初期化したリソースの状態（診断用）"""
+    client, client_error = get_client()
+    return {
+        "python": sys.version.split()[0],
+        "openai_client": "OK" if client is not None else client_error,
+        "font_path": get_font_path(),
+        "ffmpeg": ffmpeg_capabilities(),
+    }
+
+
+def main(argv: list = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="起動時間とリソースの診断")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importtime = commands.add_parser("importtime", help="モジュールのインポート時間を計測する")
+    importtime.add_argument("modules", nargs="*", default=DIAGNOSTIC_MODULES, help="計測するモジュール")
+    importtime.add_argument("--top", type=int, default=5, help="表示する内訳の数")
+    commands.add_parser("info", help="初期化したリソースの状態を表示する")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        for key, value in describe().items():
+            print(f"{key}: {value}")
+        return 0
+
+    failed = False
+    for module in args.modules:
+        report = importtime_report(module, args.top)
+        if report["error"]:
+            failed = True
+            print(f"❌ {module}: {report['error']}")
+            continue
+        print(f"{module}: {report['total_ms']:.1f} ms")
+        for name, cumulative in report["heaviest"]:
+            print(f"    {cumulative:8.1f} ms  {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+字幕描画モジュール
+日本語フォントの検出、フォントの読み込み（プロセス内で1回だけ）、
+字幕の折り返しと縁取り付きの描画を行う
+
+PillowとNumPyは字幕を描画するときに読み込むため、フォントの検出だけなら
+このモジュールを軽くインポートできる。
+"""
+
+import os
+import functools
+
+# よくある日本語フォントのパス（上にあるものを優先する）
+POSSIBLE_FONT_PATHS = [
+    # Windows
+    "C:/Windows/Fonts/msgothic.ttc",  # MS ゴシック
+    "C:/Windows/Fonts/msmincho.ttc",   # MS 明朝
+    "C:/Windows/Fonts/meiryo.ttc",     # メイリオ
+    "C:/Windows/Fonts/yugothic.ttf",   # 游ゴシック
+    # macOS
+    "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+    "/System/Library/Fonts/ヒラギノ明朝 W3.ttc",
+    # Linux
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    # 日本語を含まないが、最後の手段として使う
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+]
+
+# 字幕のデフォルトのスタイル
+DEFAULT_FONT_SIZE = 50
+MIN_FONT_SIZE = 28
+STROKE_WIDTH = 3
+TEXT_COLOR = (255, 255, 255, 255)
+STROKE_COLOR = (0, 0, 0, 255)
+LINE_SPACING = 8
+# 左右の余白（画像の幅に対する割合）
+HORIZONTAL_MARGIN = 0.05
+
+# 行頭に来てはいけない文字（禁則処理）
+_NO_LINE_START = set("、。，．,.!?！？」』）)]】ー～ぁぃぅぇぉっゃゅょァィゥェォッャュョ")
+
+
+@functools.lru_cache(maxsize=None)
+def find_font_path() -> str | None:
+    """
+    日本語フォントのパスを検出する（結果はプロセス内でキャッシュする）
+
+    環境変数 TUBEAUTO_FONT_PATH が設定されていれば、それを優先する。
+
+    Returns:
+        フォントファイルのパス。見つからない場合はNone
+    """
+    env_path = os.getenv("TUBEAUTO_FONT_PATH")
+    if env_path and os.path.exists(env_path):
+        return env_path
+    for path in POSSIBLE_FONT_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def get_font(font_path: str | None, font_size: int, index: int = 0):
+    """
+    フォントを読み込む（パス・サイズ・インデックスごとにプロセス内で1回だけ読み込む）
+
+    Args:
+        font_path: フォントファイルのパス（Noneの場合はPillowのデフォルトフォント）
+        font_size: フォントサイズ
+        index: TTCファイル内のフォントの番号
+
+    Returns:
+        PillowのFontオブジェクト
+    """
+    from PIL import ImageFont
+
+    if font_path and os.path.exists(font_path):
+        try:
+            # TTCファイル以外ではインデックスは0のみ
+            return ImageFont.truetype(font_path, font_size, index=index if font_path.endswith('.ttc') else 0)
+        except Exception as e:
+            print(f"フォント読み込みエラー: {str(e)}")
+    return ImageFont.load_default(font_size)
+
+
+def wrap_text(text: str, font, max_width: int, stroke_width: int = 0) -> list:
+    """
+    テキストを指定した幅に収まるように折り返す
+
+    日本語は文字単位で、英語などスペースで区切られた部分は単語単位で折り返す。
+    句読点や小書き文字が行頭に来る場合は、前の行に含める。
+
+    Args:
+        text: 折り返すテキスト（改行を含んでもよい）
+        font: PillowのFontオブジェクト
+        max_width: 1行の最大の幅（ピクセル）
+        stroke_width: 縁取りの太さ（幅の計算に含める）
+
+    Returns:
+        行のリスト
+    """
+    def width_of(s: str) -> float:
+        return font.getlength(s) + stroke_width * 2
+
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        # スペースで区切られた単語は分けない
+        tokens = []
+        for word in paragraph.split(" "):
+            if tokens:
+                tokens.append(" ")
+            if word.isascii():
+                tokens.append(word)
+            else:
+                tokens.extend(word)
+
+        line = ""
+        for token in tokens:
+            candidate = line + token
+            if not line or width_of(candidate) <= max_width or (token in _NO_LINE_START):
+                line = candidate
+                continue
+            lines.append(line.rstrip())
+            line = token.lstrip()
+        lines.append(line.rstrip())
+    return lines
+
+
+@functools.lru_cache(maxsize=256)
+def _render_subtitle_cached(text: str, width: int, height: int, font_path: str | None, font_size: int,
+                            stroke_width: int, fill: tuple, stroke_fill: tuple, spacing: int):
+    """render_subtitle_rgba() の本体（引数がすべてハッシュ可能なのでメモ化できる）"""
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    max_width = int(width * (1 - HORIZONTAL_MARGIN * 2))
+
+    # 高さに収まるまで、フォントを小さくしながら折り返す
+    size = font_size
+    while True:
+        font = get_font(font_path, size)
+        wrapped = "\n".join(wrap_text(text, font, max_width, stroke_width))
+        bbox = draw.multiline_textbbox(
+            (0, 0), wrapped, font=font, spacing=spacing, align="center", stroke_width=stroke_width
+        )
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+        if (text_height <= height and text_width <= width) or size <= MIN_FONT_SIZE:
+            break
+        size = max(size - 4, MIN_FONT_SIZE)
+
+    # 中央に配置（バウンディングボックスのずれを補正する）
+    x = (width - text_width) // 2 - bbox[0]
+    y = (height - text_height) // 2 - bbox[1]
+
+    # 縁取りはPillowのstroke機能で1回で描画する
+    draw.multiline_text(
+        (x, y), wrapped, font=font, fill=fill, spacing=spacing, align="center",
+        stroke_width=stroke_width, stroke_fill=stroke_fill
+    )
+
+    result = np.array(img)
+    # キャッシュを共有するため、書き換えられないようにする
+    result.flags.writeable = False
+    return result
+
+
+def render_subtitle_rgba(text: str, width: int = 1920, height: int = 200, font_path: str = None,
+                         font_size: int = DEFAULT_FONT_SIZE, stroke_width: int = STROKE_WIDTH,
+                         fill: tuple = TEXT_COLOR, stroke_fill: tuple = STROKE_COLOR,
+                         spacing: int = LINE_SPACING):
+    """
+    字幕を透過付きの画像として描画する
+
+    長い字幕は画像の幅で折り返し、高さに収まらない場合はフォントを小さくする。
+    同じテキストとスタイルの結果はメモ化し、2回目以降は描画しない。
+
+    Args:
+        text: 字幕テキスト
+        width: 画像の幅
+        height: 画像の高さ
+        font_path: フォントファイルのパス（Noneの場合は自動検出したフォント）
+        font_size: フォントサイズ（収まらない場合はMIN_FONT_SIZEまで小さくする）
+        stroke_width: 縁取りの太さ
+        fill: 文字の色（RGBA）
+        stroke_fill: 縁取りの色（RGBA）
+        spacing: 行間（ピクセル）
+
+    Returns:
+        字幕画像のnumpy配列（RGBA形式、読み取り専用）
+    """
+    if font_path is None:
+        font_path = find_font_path()
+    return _render_subtitle_cached(
+        text, width, height, font_path, font_size, stroke_width, tuple(fill), tuple(stroke_fill), spacing
+    )
+
+
+def clear_caches() -> None:
+    """フォントと字幕画像のキャッシュを消去する（フォントを入れ替えた場合など）"""
+    find_font_path.cache_clear()
+    get_font.cache_clear()
+    _render_subtitle_cached.cache_clear()
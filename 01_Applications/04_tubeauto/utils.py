@@ -1,120 +1,411 @@
 """
 OpenAI API連携モジュール
 GPT-4o、DALL-E 3、TTSを使用して台本生成、画像生成、音声生成を行う
+
+openaiとrequestsは重いため、クライアントやセッションを最初に作るときにインポートする。
 """
 
 import os
+import re
 import json
-from openai import OpenAI
-from dotenv import load_dotenv
+import base64
+import shutil
+import tempfile
+import asyncio
+import weakref
+import functools
+
+from audio import AudioStreamWriter
+from disk_cache import DiskCache, make_key
+from rate_limiter import scheduler
+from runtime import (
+    PLACEHOLDER_VALUES, load_env, validate_api_key, initialize_openai_client, get_client, require_client,
+)
+
+# 環境変数を読み込む（プロセス内で1回だけ。以下の設定は環境変数から読む）
+load_env()
+
+
+def __getattr__(name: str):
+    """
+    以前のモジュール変数 client、client_error の互換用
+    （クライアントはインポート時ではなく、最初に使うときに作る）
+    """
+    if name == "client":
+        return get_client()[0]
+    if name == "client_error":
+        return get_client()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# 非同期クライアント（イベントループごとに1つ作って共有する）
+_async_clients = weakref.WeakKeyDictionary()
+
+# APIレスポンスのキャッシュ（環境変数で変更できる。TUBEAUTO_API_CACHE=0 で無効）
+API_CACHE_DIR = os.getenv("TUBEAUTO_API_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tubeauto", "api"))
+API_CACHE_MAX_BYTES = int(os.getenv("TUBEAUTO_API_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+API_CACHE_TTL = float(os.getenv("TUBEAUTO_API_CACHE_TTL", 30 * 24 * 3600))  # 30日
+
+# 音声の形式（"mp3"、"opus"、"wav"）。"wav"はPCMをストリーミングで受け取ってWAVとして保存するため、
+# 正確なサンプル数がヘッダーに入り、動画の合成時にデコードせずに長さが分かる
+TTS_FORMAT = os.getenv("TUBEAUTO_TTS_FORMAT", "mp3")
+# 形式 -> (APIに指定する形式, 保存するファイルの拡張子)
+TTS_FORMATS = {
+    "mp3": ("mp3", ".mp3"),
+    "opus": ("opus", ".opus"),
+    "wav": ("pcm", ".wav"),
+    "pcm": ("pcm", ".wav"),
+}
+TTS_PCM_SAMPLE_RATE = 24000  # OpenAI TTSのPCM出力は24kHz・16bit・モノラル
+TTS_CHUNK_SIZE = 64 * 1024
+
+# 画像の受け取り方（"b64_json": レスポンスに含めて受け取る、"url": URLからダウンロードする）
+IMAGE_RESPONSE_FORMAT = os.getenv("TUBEAUTO_IMAGE_RESPONSE_FORMAT", "b64_json")
+
+# 画像ダウンロードのタイムアウト（接続, 読み込み）（秒）
+DOWNLOAD_TIMEOUT = (10, 120)
+
+# エンドポイントごとの同時リクエスト数の上限（デフォルト）
+IMAGE_CONCURRENCY = 3
+AUDIO_CONCURRENCY = 4
+
+
+def get_async_client() -> "AsyncOpenAI":
+    """
+    実行中のイベントループで共有する非同期OpenAIクライアントを取得する
+    
+    非同期クライアントの接続プールはイベントループに結び付くため、ループごとに1つ作る。
+    
+    Returns:
+        AsyncOpenAIクライアント
+        
+    Raises:
+        Exception: APIキーが設定されていない場合
+    """
+    client = require_client()
+    
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        from openai import AsyncOpenAI
+        async_client = AsyncOpenAI(api_key=client.api_key, max_retries=0)
+        _async_clients[loop] = async_client
+    return async_client
 
-# 環境変数を読み込む
-# .env.localがあれば優先的に読み込み、なければ.envを読み込む
-load_dotenv('.env.local')  # .env.localを優先
-load_dotenv()  # .envも読み込む（.env.localがない場合のフォールバック）
 
-# プレースホルダー値のリスト
-PLACEHOLDER_VALUES = [
-    'your_api_key_here',
-    'your_api*****here',
-    'your_api',
-    'sk-your-api-key-here',
-    'sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx',
-    'sk-proj-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx',
-]
+@functools.lru_cache(maxsize=None)
+def get_api_cache() -> DiskCache | None:
+    """
+    APIレスポンスのキャッシュを取得する
+    
+    Returns:
+        DiskCache。無効にしている場合や作成できない場合はNone
+    """
+    if os.getenv("TUBEAUTO_API_CACHE", "1").lower() in ("0", "false", "off"):
+        return None
+    try:
+        return DiskCache(API_CACHE_DIR, API_CACHE_MAX_BYTES, ttl=API_CACHE_TTL)
+    except OSError as e:
+        print(f"警告: APIキャッシュのディレクトリを作成できませんでした: {str(e)}")
+        return None
 
 
-def validate_api_key(api_key: str) -> tuple[bool, str]:
+def api_cache_key(endpoint: str, params: dict) -> str:
     """
-    APIキーの妥当性をチェックする
+    APIリクエストのキャッシュキーを作る
     
     Args:
-        api_key: チェックするAPIキー
+        endpoint: エンドポイントの名前（例: "images.generate"）
+        params: 結果に影響するリクエストのパラメータ（モデル、声、サイズ、品質、温度、プロンプトなど）
         
     Returns:
-        (is_valid, error_message)のタプル
+        キャッシュキー
+    """
+    return make_key("openai", endpoint, params)
+
+
+def api_cache_stats() -> dict:
     """
-    if not api_key:
-        return False, "APIキーが設定されていません。"
+    APIキャッシュの統計（ヒット数、ミス数、ヒット率、節約したバイト数など）を返す
     
-    # プレースホルダー値のチェック
-    api_key_lower = api_key.lower().strip()
-    for placeholder in PLACEHOLDER_VALUES:
-        if placeholder.lower() in api_key_lower:
-            return False, f"APIキーがプレースホルダー値（{placeholder}）のままです。実際のAPIキーを設定してください。"
+    Returns:
+        DiskCache.stats() の辞書。キャッシュが無効な場合は空の辞書
+    """
+    cache = get_api_cache()
+    return cache.stats() if cache else {}
+
+
+def _load_cached_file(key: str, path: str, refresh: bool = False) -> bool:
+    """
+    キャッシュにあるファイルを指定したパスにコピーする
+    
+    Args:
+        key: キャッシュキー
+        path: コピー先のパス
+        refresh: Trueの場合はキャッシュを使わない（再生成する）
+        
+    Returns:
+        キャッシュからコピーできた場合はTrue
+    """
+    cache = get_api_cache()
+    if cache is None or refresh:
+        return False
+    cached_path = cache.get(key)
+    if cached_path is None:
+        return False
+    try:
+        shutil.copyfile(cached_path, path)
+    except FileNotFoundError:
+        # コピーする前に別のプロセスが削除した
+        return False
+    return True
+
+
+def _store_cached_file(key: str, path: str) -> None:
+    """ファイルをコピーしてキャッシュに保存する（失敗しても処理は続ける）"""
+    cache = get_api_cache()
+    if cache is None:
+        return
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=cache.cache_dir, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(path, temp_path)
+        cache.put(key, temp_path)
+    except (OSError, TimeoutError) as e:
+        print(f"警告: APIキャッシュに保存できませんでした: {str(e)}")
+
+
+def _store_cached_bytes(key: str, data: bytes) -> None:
+    """APIの結果をキャッシュに保存する（失敗しても処理は続ける）"""
+    cache = get_api_cache()
+    if cache is None:
+        return
+    try:
+        cache.put_bytes(key, data)
+    except (OSError, TimeoutError) as e:
+        print(f"警告: APIキャッシュに保存できませんでした: {str(e)}")
+
+
+@functools.lru_cache(maxsize=None)
+def get_http_session() -> "requests.Session":
+    """
+    画像のダウンロードに使う共有のHTTPセッションを取得する
     
-    # 形式チェック
-    if not (api_key.startswith('sk-') or api_key.startswith('BlbkFJ')):
-        return False, f"APIキーの形式が正しくありません。'sk-'または'BlbkFJ'で始まる必要があります。"
+    接続を使い回し（keep-alive）、接続エラーや5xxは自動で再試行する。
+    requests.Sessionはスレッドから同時に使える。
     
-    # 長さチェック（最低限の長さ）
-    if len(api_key) < 20:
-        return False, "APIキーが短すぎます。正しいAPIキーを設定してください。"
+    Returns:
+        requests.Session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     
-    return True, ""
+    session = requests.Session()
+    retry = Retry(
+        total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",), respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
-def initialize_openai_client() -> tuple[OpenAI | None, str]:
+def download_file(url: str, path: str, chunk_size: int = 256 * 1024) -> str:
     """
-    OpenAIクライアントを初期化し、APIキーの妥当性をチェックする
+    URLのファイルを少しずつ読みながら保存する（全体をメモリに持たない）
     
+    一時ファイルに書いてから置き換えるため、途中で失敗しても壊れたファイルは残らない。
+    
+    Args:
+        url: ダウンロードするURL
+        path: 保存先のパス
+        chunk_size: 一度に読むバイト数
+        
     Returns:
-        (client, error_message)のタプル
-        clientがNoneの場合はエラーメッセージが返される
+        保存したファイルのパス
     """
-    api_key = os.getenv("OPENAI_API_KEY")
+    temp_path = f"{path}.part"
+    try:
+        with get_http_session().get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            with open(temp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def _speech_request(text: str, audio_format: str = None) -> tuple[dict, str, str]:
+    """
+    音声生成のリクエストのパラメータ、キャッシュキー、保存する拡張子を決める
     
-    if not api_key:
-        return None, "OpenAI APIキーが設定されていません。`.env.local`または`.env`ファイルに`OPENAI_API_KEY`を設定してください。"
+    Args:
+        text: 音声化するテキスト
+        audio_format: 音声の形式（Noneの場合はTTS_FORMAT）
+        
+    Returns:
+        (リクエストのパラメータ, キャッシュキー, 拡張子)のタプル
+        
+    Raises:
+        Exception: 対応していない形式の場合
+    """
+    audio_format = audio_format or TTS_FORMAT
+    if audio_format not in TTS_FORMATS:
+        raise Exception(f"対応していない音声の形式です: {audio_format}（{', '.join(TTS_FORMATS)}のいずれか）")
+    response_format, ext = TTS_FORMATS[audio_format]
+    request = dict(model="tts-1", voice="alloy", input=text, response_format=response_format)
+    return request, api_cache_key("audio.speech", request), ext
+
+
+def _open_speech_writer(audio_path: str, request: dict) -> AudioStreamWriter:
+    """音声の保存先を開く（PCMの場合はWAVとして書き出す）"""
+    pcm = request["response_format"] == "pcm"
+    return AudioStreamWriter(audio_path, TTS_PCM_SAMPLE_RATE if pcm else None)
+
+
+def _stream_speech(request: dict, audio_path: str) -> str:
+    """音声をストリーミングで受け取り、届いた順にファイルへ書き込む"""
+    with require_client().audio.speech.with_streaming_response.create(**request) as response:
+        writer = _open_speech_writer(audio_path, request)
+        try:
+            for chunk in response.iter_bytes(TTS_CHUNK_SIZE):
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+
+async def _astream_speech(request: dict, audio_path: str) -> str:
+    """音声をストリーミングで受け取り、届いた順にファイルへ書き込む（非同期版）"""
+    async with get_async_client().audio.speech.with_streaming_response.create(**request) as response:
+        writer = _open_speech_writer(audio_path, request)
+        try:
+            async for chunk in response.iter_bytes(TTS_CHUNK_SIZE):
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+
+def _image_request(prompt: str) -> tuple[dict, str]:
+    """
+    画像生成のリクエストのパラメータとキャッシュキーを作る
     
-    # APIキーの妥当性チェック
-    is_valid, error_message = validate_api_key(api_key)
-    if not is_valid:
-        return None, f"APIキーの設定に問題があります: {error_message}"
+    受け取り方（response_format）は結果の画像に影響しないため、キャッシュキーには含めない。
     
-    try:
-        client = OpenAI(api_key=api_key)
-        # 簡単なAPI呼び出しでテスト（オプション）
-        # client.models.list()  # コメントアウト: 起動時に毎回API呼び出しすると遅い
-        return client, ""
-    except Exception as e:
-        error_str = str(e)
-        if "401" in error_str or "invalid_api_key" in error_str.lower():
-            return None, "APIキーが無効です。正しいAPIキーを設定してください。https://platform.openai.com/account/api-keys から取得できます。"
-        elif "429" in error_str:
-            return None, "レート制限に達しています。しばらく待ってから再試行してください。"
-        else:
-            return None, f"OpenAIクライアントの初期化に失敗しました: {error_str}"
+    Returns:
+        (リクエストのパラメータ, キャッシュキー)のタプル
+    """
+    params = dict(model="dall-e-3", prompt=prompt, size="1024x1024", quality="standard", n=1)
+    return {**params, "response_format": IMAGE_RESPONSE_FORMAT}, api_cache_key("images.generate", params)
 
 
-# OpenAIクライアントを初期化
-client, client_error = initialize_openai_client()
+def _save_image_response(response, image_path: str, cache_key: str, decode: bool = False) -> str:
+    """
+    画像生成のレスポンスを保存する
+    
+    b64_jsonで受け取った場合はそのままデコードして保存し（ダウンロードの往復なし）、
+    URLの場合は共有セッションで少しずつダウンロードする。
+    
+    Args:
+        response: images.generate() のレスポンス
+        image_path: 保存先のパス
+        cache_key: APIキャッシュのキー
+        decode: Trueの場合はデコードした画素をレンダラーに渡す（video_generator.register_decoded_image）
+        
+    Returns:
+        保存した画像ファイルのパス
+    """
+    item = response.data[0]
+    if item.b64_json:
+        data = base64.b64decode(item.b64_json)
+        with open(image_path, "wb") as f:
+            f.write(data)
+        _store_cached_bytes(cache_key, data)
+        if decode:
+            import cv2
+            import numpy as np
+            from video_generator import register_decoded_image
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                register_decoded_image(image_path, image)
+    else:
+        download_file(item.url, image_path)
+        _store_cached_file(cache_key, image_path)
+    return image_path
 
 
-def generate_script(theme: str) -> list:
+def _estimate_chat_tokens(request: dict, max_output_tokens: int = 2000) -> int:
     """
-    テーマから台本を生成する
+    チャットのリクエストで使うトークン数を見積もる（TPMの制限用）
+    
+    日本語は1文字がおよそ1トークンになるため、文字数をそのまま入力のトークン数とみなす。
     
     Args:
-        theme: 動画のテーマ
+        request: chat.completions.create() に渡すパラメータ
+        max_output_tokens: 出力のトークン数の見積もり
         
     Returns:
-        台本データのリスト。各要素は {"text": "...", "visual_prompt": "...", "subtitle": "..."} の形式
+        トークン数の見積もり
+    """
+    return sum(len(m.get("content", "")) for m in request.get("messages", [])) + max_output_tokens
+
+
+def run_async(coro):
+    """
+    コルーチンを新しいイベントループで実行する（同期コードから非同期版の関数を呼ぶ場合）
+    
+    終了時に、そのループで作った非同期クライアントの接続プールを閉じる。
+    
+    Args:
+        coro: 実行するコルーチン
         
-    Raises:
-        Exception: API呼び出しに失敗した場合
+    Returns:
+        コルーチンの戻り値
     """
-    if client is None:
-        raise Exception(client_error if client_error else "OpenAI APIキーが設定されていません。`.env.local`または`.env`ファイルに`OPENAI_API_KEY`を設定してください。")
+    async def main():
+        try:
+            return await coro
+        finally:
+            async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+            if async_client is not None:
+                await async_client.close()
     
-    try:
-        # GPT-4oを使用して台本を生成
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """あなたは動画制作のプロデューサーです。
+    return asyncio.run(main())
+
+
+def _api_error(e: Exception, action: str) -> Exception:
+    """
+    API呼び出しの例外を、ユーザー向けのメッセージの例外に変換する
+    
+    Args:
+        e: 発生した例外
+        action: 失敗した処理の名前（例: "画像生成"）
+        
+    Returns:
+        メッセージを変換した例外
+    """
+    error_str = str(e)
+    if "401" in error_str or "invalid_api_key" in error_str.lower():
+        return Exception("APIキーが未設定または無効です。`.env.local`ファイルを確認してください。")
+    elif "429" in error_str:
+        return Exception("レート制限です。しばらく待ってから再試行してください。")
+    elif "500" in error_str or "503" in error_str:
+        return Exception("サーバーエラーです。時間をおいて再試行してください。")
+    else:
+        return Exception(f"{action}に失敗しました: {error_str}")
+
+
+# 台本生成のシステムプロンプト
+SCRIPT_SYSTEM_PROMPT = """あなたは動画制作のプロデューサーです。
 テーマに基づいて、親しみやすい口語体の日本語で台本を作成してください。
 各セクションは、以下の3つのフィールドを含むJSONオブジェクトです:
 - "text": 話すテキスト（口語体の日本語）
@@ -128,111 +419,387 @@ JSON形式で、以下のような構造で返してください:
     {"text": "...", "visual_prompt": "...", "subtitle": "..."}
   ]
 }"""
-                },
-                {
-                    "role": "user",
-                    "content": f"テーマ「{theme}」について、3〜5セクションの台本を作成してください。各セクションは話すテキスト、視覚的なプロンプト、字幕を含むJSONオブジェクトにしてください。"
-                }
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.7
-        )
+
+
+def _script_request(theme: str) -> tuple[dict, str]:
+    """
+    台本生成のリクエストのパラメータとキャッシュキーを作る
+    
+    Returns:
+        (リクエストのパラメータ, キャッシュキー)のタプル
+    """
+    request = dict(
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "system",
+                "content": SCRIPT_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": f"テーマ「{theme}」について、3〜5セクションの台本を作成してください。各セクションは話すテキスト、視覚的なプロンプト、字幕を含むJSONオブジェクトにしてください。"
+            }
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.7
+    )
+    return request, api_cache_key("chat.completions", request)
+
+
+def _normalize_section(section) -> dict | None:
+    """
+    台本のセクションのキーをそろえる（日本語のキーなどにも対応する）
+    
+    Args:
+        section: APIが返したセクション
         
-        # レスポンスからJSONを抽出
-        content = response.choices[0].message.content
-        result = json.loads(content)
+    Returns:
+        {"text": "...", "visual_prompt": "...", "subtitle": "..."} の辞書。必要な値がない場合はNone
+    """
+    if not isinstance(section, dict):
+        return None
+    formatted_section = {
+        "text": section.get("text", section.get("話すテキスト", "")),
+        "visual_prompt": section.get("visual_prompt", section.get("visualPrompt", section.get("視覚的なプロンプト", ""))),
+        "subtitle": section.get("subtitle", section.get("字幕", section.get("text", "")))
+    }
+    # 空の値がないか確認
+    if not formatted_section["text"] or not formatted_section["visual_prompt"]:
+        return None
+    return formatted_section
+
+
+def _parse_script_content(content: str) -> list:
+    """
+    台本生成のレスポンス（JSON）から台本データを取り出す
+    
+    Args:
+        content: レスポンスの本文
+        
+    Returns:
+        台本データのリスト
         
-        # "sections"キーから台本データを取得
-        if "sections" in result:
-            script_data = result["sections"]
-        elif isinstance(result, list):
-            script_data = result
+    Raises:
+        Exception: 有効なセクションが1つもない場合
+        ValueError: JSONとして解析できない場合
+    """
+    result = json.loads(content)
+    
+    # "sections"キーから台本データを取得
+    if isinstance(result, dict) and "sections" in result:
+        script_data = result["sections"]
+    elif isinstance(result, list):
+        script_data = result
+    else:
+        # フォールバック: 直接配列として扱う
+        script_data = [result] if isinstance(result, dict) else []
+    
+    # 各セクションに必要なキーがあるか確認し、なければ除く
+    formatted_data = [s for s in map(_normalize_section, script_data) if s]
+    if not formatted_data:
+        raise Exception("有効な台本データが生成されませんでした。")
+    return formatted_data
+
+
+def _script_error(e: Exception) -> Exception:
+    """台本生成の例外を、ユーザー向けのメッセージの例外に変換する"""
+    error_str = str(e)
+    # エラーの種類に応じて適切なメッセージを返す
+    if "401" in error_str or "invalid_api_key" in error_str.lower():
+        return Exception("APIキーが未設定または無効です。`.env.local`ファイルを確認してください。https://platform.openai.com/account/api-keys から正しいAPIキーを取得してください。")
+    return _api_error(e, "台本生成")
+
+
+def generate_script(theme: str, refresh: bool = False) -> list:
+    """
+    テーマから台本を生成する
+    
+    同じテーマとパラメータの結果はAPIキャッシュから返す。
+    
+    Args:
+        theme: 動画のテーマ
+        refresh: Trueの場合はキャッシュを使わずに生成し直す
+        
+    Returns:
+        台本データのリスト。各要素は {"text": "...", "visual_prompt": "...", "subtitle": "..."} の形式
+        
+    Raises:
+        Exception: API呼び出しに失敗した場合
+    """
+    client = require_client()
+    
+    try:
+        # GPT-4oを使用して台本を生成
+        request, cache_key = _script_request(theme)
+        cache = get_api_cache()
+        cached = None if (cache is None or refresh) else cache.get_bytes(cache_key)
+        
+        if cached is not None:
+            content = cached.decode("utf-8")
         else:
-            # フォールバック: 直接配列として扱う
-            script_data = [result] if isinstance(result, dict) else []
-        
-        # 各セクションに必要なキーがあるか確認し、なければデフォルト値を設定
-        formatted_data = []
-        for section in script_data:
-            formatted_section = {
-                "text": section.get("text", section.get("話すテキスト", "")),
-                "visual_prompt": section.get("visual_prompt", section.get("visualPrompt", section.get("視覚的なプロンプト", ""))),
-                "subtitle": section.get("subtitle", section.get("字幕", section.get("text", "")))
-            }
-            # 空の値がないか確認
-            if not formatted_section["text"] or not formatted_section["visual_prompt"]:
-                continue
-            formatted_data.append(formatted_section)
+            response = scheduler.call(
+                "chat", client.chat.completions.create, tokens=_estimate_chat_tokens(request), **request
+            )
+            # レスポンスからJSONを抽出
+            content = response.choices[0].message.content
+        formatted_data = _parse_script_content(content)
         
-        if not formatted_data:
-            raise Exception("有効な台本データが生成されませんでした。")
+        # 有効な台本だけをキャッシュする
+        if cached is None:
+            _store_cached_bytes(cache_key, content.encode("utf-8"))
         
         return formatted_data
         
     except Exception as e:
-        error_str = str(e)
-        # エラーの種類に応じて適切なメッセージを返す
-        if "401" in error_str or "invalid_api_key" in error_str.lower():
-            raise Exception("APIキーが未設定または無効です。`.env.local`ファイルを確認してください。https://platform.openai.com/account/api-keys から正しいAPIキーを取得してください。")
-        elif "429" in error_str:
-            raise Exception("レート制限です。しばらく待ってから再試行してください。")
-        elif "500" in error_str or "503" in error_str:
-            raise Exception("サーバーエラーです。時間をおいて再試行してください。")
-        else:
-            raise Exception(f"台本生成に失敗しました: {error_str}")
+        raise _script_error(e)
+
+
+class SectionStreamParser:
+    """
+    ストリーミングで届くJSONから、"sections"配列の要素を完成したものから順に取り出す
+    
+    文字列の中の括弧やエスケープを考慮して要素の終わりを見つけ、要素ごとにjson.loadsする。
+    """
+    
+    _SECTIONS_START = re.compile(r'"sections"\s*:\s*\[')
+    
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0             # 次に調べる位置
+        self.in_array = False    # "sections"配列の中かどうか
+        self.depth = 0           # 配列の要素の中の括弧の深さ
+        self.in_string = False
+        self.escape = False
+        self.start = None        # 解析中の要素の開始位置
+        self.done = False        # 配列の終わりまで読んだかどうか
+    
+    def feed(self, text: str) -> list:
+        """
+        届いたテキストを追加し、新しく完成した要素を返す
+        
+        Args:
+            text: 届いたテキスト
+            
+        Returns:
+            完成した要素（JSONを解析したもの）のリスト
+            
+        Raises:
+            ValueError: 要素をJSONとして解析できなかった場合
+        """
+        self.buffer += text
+        results = []
+        if not self.in_array:
+            match = self._SECTIONS_START.search(self.buffer)
+            if match is None:
+                return results
+            self.in_array = True
+            self.pos = match.end()
+        
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf) and not self.done:
+            c = buf[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                if self.depth == 0:
+                    self.start = i
+                self.depth += 1
+            elif c in "}]":
+                if self.depth == 0:
+                    # "sections"配列の終わり
+                    self.done = True
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        results.append(json.loads(buf[self.start:i + 1]))
+            i += 1
+        self.pos = i
+        return results
+
+
+class _ScriptStream:
+    """ストリーミングの台本生成で、届いたテキストからセクションを取り出す（同期版・非同期版で共通）"""
+    
+    def __init__(self):
+        self.parser = SectionStreamParser()
+        self.chunks = []
+        self.yielded = 0
+        self.failed = False
+    
+    def feed(self, chunk) -> list:
+        """ストリームのチャンクを受け取り、新しく完成したセクション（キーをそろえたもの）を返す"""
+        if not chunk.choices:
+            return []
+        text = chunk.choices[0].delta.content or ""
+        self.chunks.append(text)
+        if self.failed:
+            return []
+        try:
+            sections = [s for s in map(_normalize_section, self.parser.feed(text)) if s]
+        except ValueError:
+            # 途中の解析に失敗した場合は、最後に全体を解析する
+            self.failed = True
+            return []
+        self.yielded += len(sections)
+        return sections
+    
+    def finish(self, cache_key: str) -> list | None:
+        """
+        ストリームの終わりに全体を解析し、まだ返していないセクションを返す
+        
+        Returns:
+            残りのセクションのリスト。全体も解析できず、1つもセクションを返していない場合はNone
+            
+        Raises:
+            Exception: 一部のセクションを返した後で、全体を解析できなかった場合
+                （生成し直すと返したセクションと食い違うため、途中までの台本で動画を作らないよう失敗にする）
+        """
+        content = "".join(self.chunks)
+        try:
+            sections = _parse_script_content(content)
+        except Exception as e:
+            if self.yielded == 0:
+                return None
+            raise _script_error(Exception(f"台本を最後まで解析できませんでした（{self.yielded}セクションまで）: {e}"))
+        _store_cached_bytes(cache_key, content.encode("utf-8"))
+        return sections[self.yielded:]
 
 
-def generate_audio(text: str, filename: str) -> str:
+def iter_script_sections(theme: str, refresh: bool = False):
+    """
+    テーマから台本を生成し、完成したセクションから順に返す（ストリーミング）
+    
+    台本全体を待たずに、最初のセクションの画像や音声の生成を始められる。
+    途中の解析に失敗した場合は、最後に全体を解析する。それもできない場合は generate_script() で生成し直す。
+    
+    Args:
+        theme: 動画のテーマ
+        refresh: Trueの場合はキャッシュを使わずに生成し直す
+        
+    Yields:
+        {"text": "...", "visual_prompt": "...", "subtitle": "..."} の形式のセクション
+        
+    Raises:
+        Exception: API呼び出しに失敗した場合
+    """
+    client = require_client()
+    
+    request, cache_key = _script_request(theme)
+    cache = get_api_cache()
+    cached = None if (cache is None or refresh) else cache.get_bytes(cache_key)
+    if cached is not None:
+        yield from _parse_script_content(cached.decode("utf-8"))
+        return
+    
+    stream = _ScriptStream()
+    try:
+        response = scheduler.call(
+            "chat", client.chat.completions.create, tokens=_estimate_chat_tokens(request), stream=True, **request
+        )
+        for chunk in response:
+            yield from stream.feed(chunk)
+    except Exception as e:
+        raise _script_error(e)
+    
+    remaining = stream.finish(cache_key)
+    if remaining is None:
+        # ストリーミングの結果を解析できなかったので、通常の方法で生成し直す
+        yield from generate_script(theme, refresh=True)
+        return
+    yield from remaining
+
+
+async def aiter_script_sections(theme: str, refresh: bool = False):
+    """
+    テーマから台本を生成し、完成したセクションから順に返す（ストリーミング、非同期版）
+    
+    引数と返すセクションは iter_script_sections() と同じ。
+    """
+    async_client = get_async_client()
+    
+    request, cache_key = _script_request(theme)
+    cache = get_api_cache()
+    cached = None if (cache is None or refresh) else cache.get_bytes(cache_key)
+    if cached is not None:
+        for section in _parse_script_content(cached.decode("utf-8")):
+            yield section
+        return
+    
+    stream = _ScriptStream()
+    try:
+        response = await scheduler.acall(
+            "chat", async_client.chat.completions.create, tokens=_estimate_chat_tokens(request), stream=True, **request
+        )
+        async for chunk in response:
+            for section in stream.feed(chunk):
+                yield section
+    except Exception as e:
+        raise _script_error(e)
+    
+    remaining = stream.finish(cache_key)
+    if remaining is None:
+        # ストリーミングの結果を解析できなかったので、通常の方法で生成し直す
+        remaining = await asyncio.to_thread(generate_script, theme, True)
+    for section in remaining:
+        yield section
+
+
+def generate_audio(text: str, filename: str, refresh: bool = False, audio_format: str = None) -> str:
     """
     テキストから音声を生成する
     
+    音声はストリーミングで受け取り、届いた順にファイルへ書き込む。
+    同じテキストとパラメータの結果はAPIキャッシュから返す。
+    
     Args:
         text: 音声化するテキスト
         filename: 保存するファイル名（拡張子なし）
+        refresh: Trueの場合はキャッシュを使わずに生成し直す
+        audio_format: 音声の形式（"mp3"、"opus"、"wav"。Noneの場合はTTS_FORMAT）
         
     Returns:
-        生成された音声ファイルのパス
+        生成された音声ファイルのパス（拡張子は形式による）
         
     Raises:
         Exception: API呼び出しに失敗した場合
     """
-    if client is None:
-        raise Exception(client_error if client_error else "OpenAI APIキーが設定されていません。`.env.local`または`.env`ファイルに`OPENAI_API_KEY`を設定してください。")
+    require_client()  # APIキーが設定されているか確認する
     
     try:
-        # OpenAI TTSを使用して音声を生成
-        response = client.audio.speech.create(
-            model="tts-1",
-            voice="alloy",
-            input=text
-        )
+        request, cache_key, ext = _speech_request(text, audio_format)
+        audio_path = f"{filename}{ext}"
+        if _load_cached_file(cache_key, audio_path, refresh):
+            return audio_path
         
-        # 音声ファイルを保存
-        audio_path = f"{filename}.mp3"
-        with open(audio_path, "wb") as f:
-            f.write(response.content)
+        # OpenAI TTSを使用して音声を生成
+        scheduler.call("speech", _stream_speech, request, audio_path)
+        _store_cached_file(cache_key, audio_path)
         
         return audio_path
         
     except Exception as e:
-        error_str = str(e)
-        if "401" in error_str or "invalid_api_key" in error_str.lower():
-            raise Exception("APIキーが未設定または無効です。`.env.local`ファイルを確認してください。")
-        elif "429" in error_str:
-            raise Exception("レート制限です。しばらく待ってから再試行してください。")
-        elif "500" in error_str or "503" in error_str:
-            raise Exception("サーバーエラーです。時間をおいて再試行してください。")
-        else:
-            raise Exception(f"音声生成に失敗しました: {error_str}")
+        raise _api_error(e, "音声生成")
 
 
-def generate_image(prompt: str, filename: str) -> str:
+def generate_image(prompt: str, filename: str, refresh: bool = False, decode: bool = False) -> str:
     """
     プロンプトから画像を生成する
     
+    同じプロンプトとパラメータの結果はAPIキャッシュから返す。
+    
     Args:
         prompt: 画像生成用のプロンプト
         filename: 保存するファイル名（拡張子なし）
+        refresh: Trueの場合はキャッシュを使わずに生成し直す
+        decode: Trueの場合はデコードした画素をレンダラーに渡し、レンダリング時にファイルを読み直さない
         
     Returns:
         生成された画像ファイルのパス
@@ -240,39 +807,176 @@ def generate_image(prompt: str, filename: str) -> str:
     Raises:
         Exception: API呼び出しに失敗した場合
     """
-    if client is None:
-        raise Exception(client_error if client_error else "OpenAI APIキーが設定されていません。`.env.local`または`.env`ファイルに`OPENAI_API_KEY`を設定してください。")
+    client = require_client()
     
     try:
+        request, cache_key = _image_request(prompt)
+        image_path = f"{filename}.png"
+        if _load_cached_file(cache_key, image_path, refresh):
+            return image_path
+        
         # DALL-E 3を使用して画像を生成
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1
-        )
+        response = scheduler.call("images", client.images.generate, **request)
+        
+        # 画像を保存
+        return _save_image_response(response, image_path, cache_key, decode)
+        
+    except Exception as e:
+        raise _api_error(e, "画像生成")
+
+
+async def agenerate_audio(text: str, filename: str, refresh: bool = False, audio_format: str = None) -> str:
+    """
+    テキストから音声を生成する（非同期版）
+    
+    Args:
+        text: 音声化するテキスト
+        filename: 保存するファイル名（拡張子なし）
+        refresh: Trueの場合はキャッシュを使わずに生成し直す
+        audio_format: 音声の形式（"mp3"、"opus"、"wav"。Noneの場合はTTS_FORMAT）
+        
+    Returns:
+        生成された音声ファイルのパス（拡張子は形式による）
+        
+    Raises:
+        Exception: API呼び出しに失敗した場合
+    """
+    get_async_client()  # APIキーが設定されているか確認する
+    
+    try:
+        request, cache_key, ext = _speech_request(text, audio_format)
+        audio_path = f"{filename}{ext}"
+        if await asyncio.to_thread(_load_cached_file, cache_key, audio_path, refresh):
+            return audio_path
+        
+        # OpenAI TTSを使用して音声を生成
+        await scheduler.acall("speech", _astream_speech, request, audio_path)
+        await asyncio.to_thread(_store_cached_file, cache_key, audio_path)
+        
+        return audio_path
+        
+    except Exception as e:
+        raise _api_error(e, "音声生成")
+
+
+async def agenerate_image(prompt: str, filename: str, refresh: bool = False, decode: bool = False) -> str:
+    """
+    プロンプトから画像を生成する（非同期版）
+    
+    Args:
+        prompt: 画像生成用のプロンプト
+        filename: 保存するファイル名（拡張子なし）
+        refresh: Trueの場合はキャッシュを使わずに生成し直す
+        decode: Trueの場合はデコードした画素をレンダラーに渡し、レンダリング時にファイルを読み直さない
         
-        # 画像URLを取得
-        image_url = response.data[0].url
+    Returns:
+        生成された画像ファイルのパス
         
-        # 画像をダウンロードして保存
-        import requests
-        img_response = requests.get(image_url)
+    Raises:
+        Exception: API呼び出しに失敗した場合
+    """
+    async_client = get_async_client()
+    
+    try:
+        request, cache_key = _image_request(prompt)
         image_path = f"{filename}.png"
-        with open(image_path, "wb") as f:
-            f.write(img_response.content)
+        if await asyncio.to_thread(_load_cached_file, cache_key, image_path, refresh):
+            return image_path
+        
+        # DALL-E 3を使用して画像を生成
+        response = await scheduler.acall("images", async_client.images.generate, **request)
         
-        return image_path
+        # 画像を保存（デコードとダウンロードでイベントループを止めないよう別スレッドで）
+        return await asyncio.to_thread(_save_image_response, response, image_path, cache_key, decode)
         
     except Exception as e:
-        error_str = str(e)
-        if "401" in error_str or "invalid_api_key" in error_str.lower():
-            raise Exception("APIキーが未設定または無効です。`.env.local`ファイルを確認してください。")
-        elif "429" in error_str:
-            raise Exception("レート制限です。しばらく待ってから再試行してください。")
-        elif "500" in error_str or "503" in error_str:
-            raise Exception("サーバーエラーです。時間をおいて再試行してください。")
+        raise _api_error(e, "画像生成")
+
+
+async def agenerate_assets(script_data, output_dir: str, image_concurrency: int = IMAGE_CONCURRENCY,
+                           audio_concurrency: int = AUDIO_CONCURRENCY, on_progress=None,
+                           refresh: bool = False, decode_images: bool = False, skip_existing: bool = False) -> list:
+    """
+    台本のすべてのセクションの画像と音声を並行して生成する
+    
+    すべてのリクエストを一度に開始し、エンドポイントごとの同時リクエスト数だけを制限する。
+    生成したファイルのパスは各セクションの "image_path" と "audio_path" に設定する。
+    script_dataに aiter_script_sections() などの非同期イテレーターを渡すと、
+    台本の生成中でも、届いたセクションから順に生成を始める。
+    
+    Args:
+        script_data: 台本データのリスト、またはセクションを返す非同期イテレーター
+        output_dir: 画像と音声を保存するディレクトリ
+        image_concurrency: 画像生成の同時リクエスト数の上限
+        audio_concurrency: 音声生成の同時リクエスト数の上限
+        on_progress: 進捗を通知する関数 on_progress(kind, index, path)。
+            kindは "image" または "audio"（素材の生成完了）、"script"（非同期イテレーターからセクションが届いた。
+            pathはNone）のいずれか。indexはセクションの番号（0から）
+        refresh: Trueの場合はAPIキャッシュを使わずに生成し直す
+        decode_images: Trueの場合は画像の画素をレンダラーに渡す（同じプロセスでレンダリングする場合）
+        skip_existing: Trueの場合は "image_path"、"audio_path" のファイルが既にあるセクションの素材を生成しない
+            （再開したジョブで、前回生成した素材を使う場合。on_progressは通常どおり呼ばれる）
+        
+    Returns:
+        パスを設定した台本データ
+        
+    Raises:
+        Exception: いずれかの生成に失敗した場合（残りのリクエストはキャンセルする）
+    """
+    limits = {
+        "image": asyncio.Semaphore(max(1, image_concurrency)),
+        "audio": asyncio.Semaphore(max(1, audio_concurrency)),
+    }
+    
+    sections = script_data if isinstance(script_data, list) else []
+    tasks = []
+    
+    async def run(kind: str, index: int):
+        section = sections[index]
+        path = section.get(f"{kind}_path") if skip_existing else None
+        if not (path and os.path.exists(path)):
+            async with limits[kind]:
+                if kind == "image":
+                    path = await agenerate_image(section["visual_prompt"], os.path.join(output_dir, f"image_{index}"),
+                                                 refresh, decode_images)
+                else:
+                    path = await agenerate_audio(section["text"], os.path.join(output_dir, f"audio_{index}"), refresh)
+            section[f"{kind}_path"] = path
+        if on_progress:
+            on_progress(kind, index, path)
+    
+    def start(index: int) -> None:
+        tasks.extend(asyncio.create_task(run(kind, index)) for kind in ("image", "audio"))
+    
+    try:
+        if isinstance(script_data, list):
+            for i in range(len(sections)):
+                start(i)
         else:
-            raise Exception(f"画像生成に失敗しました: {error_str}")
+            async for section in script_data:
+                sections.append(section)
+                if on_progress:
+                    on_progress("script", len(sections) - 1, None)
+                start(len(sections) - 1)
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # 1つでも失敗したら、残りのリクエストを取り消す
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    
+    return sections
 
+
+def generate_assets(script_data: list, output_dir: str, image_concurrency: int = IMAGE_CONCURRENCY,
+                    audio_concurrency: int = AUDIO_CONCURRENCY, on_progress=None, refresh: bool = False,
+                    decode_images: bool = False, skip_existing: bool = False) -> list:
+    """
+    台本のすべてのセクションの画像と音声を並行して生成する（同期版）
+    
+    引数と戻り値は agenerate_assets() と同じ。on_progressは呼び出し元のスレッドで呼ばれる。
+    """
+    return run_async(agenerate_assets(
+        script_data, output_dir, image_concurrency, audio_concurrency, on_progress, refresh, decode_images, skip_existing
+    ))
@@ -1,88 +1,232 @@
 """
 動画編集モジュール
-OpenCVとpydubを使用して、画像、音声、字幕を組み合わせて動画を生成する
+OpenCVを使用して、画像、音声、字幕を組み合わせて動画を生成する
+ffmpegがあれば、フレームを直接ffmpegに渡して音声と一緒に1回でエンコードする
+
+OpenCVとnumpyは読み込みに時間がかかるため、使う関数の中でインポートする。
 """
 
+from __future__ import annotations
+
 import os
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-from pydub import AudioSegment
+import shutil
+import asyncio
+import functools
 import subprocess
 import tempfile
+import threading
+import time
+import queue
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator
+
+from disk_cache import DiskCache, DEFAULT_MAX_BYTES, hash_file, make_key
+from subtitles import render_subtitle_rgba
+from audio import get_audio_duration, write_concat_list
+from runtime import get_font_path, ffmpeg_capabilities
+
+# 動画の標準設定
+VIDEO_WIDTH = 1920
+VIDEO_HEIGHT = 1080
+FPS = 24
+SUBTITLE_HEIGHT = 150
+
+# ffmpegでのエンコード設定
+FFMPEG_CMD = 'ffmpeg'
+X264_PRESET = 'veryfast'
+X264_CRF = 20
+AUDIO_BITRATE = '192k'
+# セグメントを再エンコードせずに連結できるよう、音声の形式を揃える
+AUDIO_SAMPLE_RATE = 48000
+AUDIO_CHANNELS = 2
+
+# レンダリング結果が変わる変更をしたら上げる（古いキャッシュを使わないようにする）
+RENDER_CACHE_VERSION = 1
+
+
+def __getattr__(name: str):
+    """
+    日本語フォントのパス FONT_PATH（インポート時ではなく、最初に使うときに検出する。
+    変更する場合は環境変数 TUBEAUTO_FONT_PATH を設定する）
+    """
+    if name == "FONT_PATH":
+        return get_font_path()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _ease_linear(t: float) -> float:
+    return t
+
 
-# 日本語フォントのパスを設定
-# Windowsの場合の一般的なパス例（実際の環境に合わせて変更してください）
-FONT_PATH = "C:/Windows/Fonts/msgothic.ttc"
-
-# よくある日本語フォントのパスを自動検出
-POSSIBLE_FONT_PATHS = [
-    # Windows
-    "C:/Windows/Fonts/msgothic.ttc",  # MS ゴシック
-    "C:/Windows/Fonts/msmincho.ttc",   # MS 明朝
-    "C:/Windows/Fonts/meiryo.ttc",     # メイリオ
-    "C:/Windows/Fonts/yugothic.ttf",   # 游ゴシック
-    # macOS
-    "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
-    "/System/Library/Fonts/ヒラギノ明朝 W3.ttc",
-    # Linux
-    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-]
-
-# フォントパスを自動検出
-for path in POSSIBLE_FONT_PATHS:
-    if os.path.exists(path):
-        FONT_PATH = path
-        break
-
-# フォントが見つからない場合の警告
-if FONT_PATH is None:
-    print("警告: 日本語フォントが見つかりませんでした。字幕が正しく表示されない可能性があります。")
-    print("FONT_PATHを手動で設定してください。")
-
-
-def get_audio_duration(audio_path: str) -> float:
-    """
-    音声ファイルの長さを取得する
+def _ease_in(t: float) -> float:
+    return t * t
+
+
+def _ease_out(t: float) -> float:
+    return 1.0 - (1.0 - t) * (1.0 - t)
+
+
+def _ease_in_out(t: float) -> float:
+    return t * t * (3.0 - 2.0 * t)
+
+
+# Ken Burns効果のイージング（進行度0〜1を0〜1に変換する関数）
+EASING_FUNCTIONS = {
+    "linear": _ease_linear,
+    "ease_in": _ease_in,
+    "ease_out": _ease_out,
+    "ease_in_out": _ease_in_out,
+}
+
+# パン方向（余白に対する移動方向。x: 右が正、y: 下が正）
+PAN_DIRECTIONS = {
+    "none": (0.0, 0.0),
+    "left": (-1.0, 0.0),
+    "right": (1.0, 0.0),
+    "up": (0.0, -1.0),
+    "down": (0.0, 1.0),
+}
+
+# 補間の品質（draft: プレビュー用、standard: 標準、high: 高画質、best: 最高画質だが低速）
+# ズーム倍率が小さいため、standard（バイリニア）でも旧実装のLanczosとほぼ見分けがつかない
+# 値はOpenCVの補間方法の定数名（cv2を読み込まずに定義するため）
+KEN_BURNS_QUALITY = {
+    "draft": "INTER_NEAREST",
+    "standard": "INTER_LINEAR",
+    "high": "INTER_CUBIC",
+    "best": "INTER_LANCZOS4",
+}
+
+# Ken Burns効果のデフォルト設定
+KEN_BURNS_DEFAULTS = {
+    "zoom_start": 1.0,
+    "zoom_end": 1.15,
+    "pan_direction": "none",
+    "easing": "linear",
+    "quality": "standard",
+}
+
+
+def ken_burns_params(progress: float, zoom_start: float = 1.0, zoom_end: float = 1.15,
+                     pan_direction: str = "none", easing: str = "linear") -> tuple[float, tuple[float, float]]:
+    """
+    進行度からKen Burns効果のズーム倍率とパン位置を計算する
     
     Args:
-        audio_path: 音声ファイルのパス
+        progress: セクション内の進行度（0.0〜1.0）
+        zoom_start: 開始時のズーム倍率
+        zoom_end: 終了時のズーム倍率
+        pan_direction: パン方向（PAN_DIRECTIONSのキー）
+        easing: イージング（EASING_FUNCTIONSのキー）
         
     Returns:
-        音声の長さ（秒）
+        (ズーム倍率, (パンx, パンy))のタプル。パンは余白に対する割合（-1.0〜1.0）
     """
-    audio = AudioSegment.from_mp3(audio_path)
-    return len(audio) / 1000.0  # ミリ秒を秒に変換
+    if easing not in EASING_FUNCTIONS:
+        raise ValueError(f"不明なイージングです: {easing}")
+    if pan_direction not in PAN_DIRECTIONS:
+        raise ValueError(f"不明なパン方向です: {pan_direction}")
+    
+    t = EASING_FUNCTIONS[easing](min(max(progress, 0.0), 1.0))
+    zoom = zoom_start + (zoom_end - zoom_start) * t
+    dx, dy = PAN_DIRECTIONS[pan_direction]
+    return zoom, (dx * t, dy * t)
 
 
-def apply_ken_burns_effect(image: np.ndarray, zoom_factor: float = 1.2, num_frames: int = 1) -> np.ndarray:
+def prepare_ken_burns_source(image: np.ndarray, width: int, height: int, max_zoom: float) -> np.ndarray:
+    """
+    Ken Burns効果の元画像を準備する
+    
+    最大ズーム時でも縮小になるほど大きい画像は、エイリアシングを防ぐため
+    あらかじめ1回だけINTER_AREAで必要なサイズまで縮小しておく。
+    
+    Args:
+        image: 入力画像
+        width: 出力の幅
+        height: 出力の高さ
+        max_zoom: セクション中の最大ズーム倍率
+        
+    Returns:
+        Ken Burns効果の元画像
+    """
+    import cv2
+    
+    h, w = image.shape[:2]
+    scale = max(width / w, height / h) * max(max_zoom, 1.0)
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)), interpolation=cv2.INTER_AREA)
+
+
+def apply_ken_burns_effect(image: np.ndarray, zoom_factor: float = 1.2, num_frames: int = 1,
+                           pan: tuple[float, float] = (0.0, 0.0), quality: str = "standard",
+                           output_size: tuple[int, int] = None, dst: np.ndarray = None) -> np.ndarray:
     """
     Ken Burns効果（緩やかなズーム）を適用した画像を生成する
     
+    画像全体を拡大してから切り抜くのではなく、「画面を覆うリサイズ・ズーム・パン」を
+    1つのアフィン変換にまとめ、出力フレームの画素だけを元画像から直接計算する。
+    
     Args:
         image: 入力画像（numpy配列）
         zoom_factor: ズーム倍率（デフォルト: 1.2）
-        num_frames: フレーム数（デフォルト: 1、アニメーション用）
+        num_frames: フレーム数（互換性のために残している引数）
+        pan: 余白に対するパン位置（-1.0〜1.0）。(1.0, 0.0)で右端に寄せる
+        quality: 補間の品質（KEN_BURNS_QUALITYのキー）
+        output_size: 出力サイズ (幅, 高さ)。Noneの場合は入力画像と同じサイズ
+        dst: 書き込み先のバッファ（Noneの場合は新しく確保する）
         
     Returns:
         ズーム効果が適用された画像
     """
+    import cv2
+    import numpy as np
+    
+    if quality not in KEN_BURNS_QUALITY:
+        raise ValueError(f"不明な品質設定です: {quality}")
+    
     h, w = image.shape[:2]
+    out_w, out_h = output_size if output_size else (w, h)
     
-    # ズーム後のサイズを計算
-    new_h = int(h * zoom_factor)
-    new_w = int(w * zoom_factor)
+    # 画面を覆う倍率にズームを掛ける
+    scale = max(out_w / w, out_h / h) * zoom_factor
     
-    # リサイズ
-    img_resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LANCZOS4)
+    # はみ出した分（片側）の余白の範囲でパンする
+    margin_x = (w * scale - out_w) / 2
+    margin_y = (h * scale - out_h) / 2
+    tx = (out_w - w * scale) / 2 - pan[0] * margin_x
+    ty = (out_h - h * scale) / 2 - pan[1] * margin_y
     
-    # 中央をクロップ
-    start_y = (new_h - h) // 2
-    start_x = (new_w - w) // 2
-    img_cropped = img_resized[start_y:start_y + h, start_x:start_x + w]
+    # 画素の中心を合わせる補正
+    tx += 0.5 * (scale - 1.0)
+    ty += 0.5 * (scale - 1.0)
     
-    return img_cropped
+    matrix = np.array([[scale, 0.0, tx], [0.0, scale, ty]], dtype=np.float64)
+    return cv2.warpAffine(
+        image, matrix, (out_w, out_h), dst=dst,
+        flags=getattr(cv2, KEN_BURNS_QUALITY[quality]), borderMode=cv2.BORDER_REPLICATE
+    )
+
+
+def create_subtitle_rgba(text: str, width: int = 1920, height: int = 200, font_path: str = None) -> np.ndarray:
+    """
+    字幕を透過付きの画像として生成する
+    
+    Args:
+        text: 字幕テキスト
+        width: 画像の幅
+        height: 画像の高さ
+        font_path: フォントファイルのパス
+        
+    Returns:
+        字幕画像のnumpy配列（RGBA形式、読み取り専用）
+    """
+    if font_path is None:
+        font_path = get_font_path()
+    
+    # 字幕の描画はsubtitlesモジュールに任せる（フォントの読み込みと結果はキャッシュされる）
+    return render_subtitle_rgba(text, width, height, font_path)
 
 
 def create_subtitle_image(text: str, width: int = 1920, height: int = 200, font_path: str = None) -> np.ndarray:
@@ -98,255 +242,1135 @@ def create_subtitle_image(text: str, width: int = 1920, height: int = 200, font_
     Returns:
         字幕画像のnumpy配列（BGR形式、OpenCV用）
     """
-    if font_path is None:
-        font_path = FONT_PATH
+    import cv2
     
-    # 透明な背景の画像を作成
-    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
+    # OpenCV用にBGRに変換（RGBA -> BGR）
+    return cv2.cvtColor(create_subtitle_rgba(text, width, height, font_path), cv2.COLOR_RGBA2BGR)
+
+
+@functools.lru_cache(maxsize=1)
+def fade_luts() -> np.ndarray:
+    """フェード用のルックアップテーブル（行: フェードの段階0〜255、列: 画素値0〜255。最初に使うときに作る）"""
+    import numpy as np
     
-    # フォントを読み込む
-    font_size = 50
-    font = None
+    return np.clip(np.outer(np.arange(256), np.arange(256)) / 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+
+class SubtitleOverlay:
+    """
+    字幕のRGBA画像から、合成に必要なデータをセクションごとに1回だけ前計算したもの
     
-    if font_path and os.path.exists(font_path):
-        try:
-            # TTCファイルの場合は、インデックス0を指定
-            if font_path.endswith('.ttc'):
-                font = ImageFont.truetype(font_path, font_size, index=0)
-            else:
-                font = ImageFont.truetype(font_path, font_size)
-        except Exception as e:
-            print(f"フォント読み込みエラー: {str(e)}")
-            font = ImageFont.load_default()
-    else:
-        font = ImageFont.load_default()
+    透明な部分は合成しないように、文字がある範囲（バウンディングボックス）だけを保持する。
+    """
     
-    # テキストのサイズを計算
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
+    def __init__(self, rgba: np.ndarray, x: int, y: int):
+        """
+        Args:
+            rgba: 字幕画像（RGBA形式）
+            x: 合成先フレーム上での左端
+            y: 合成先フレーム上での上端
+        """
+        import cv2
+        import numpy as np
+        
+        alpha = rgba[:, :, 3]
+        ys, xs = np.nonzero(alpha)
+        if len(ys) == 0:
+            # 空の字幕は何もしない
+            self.empty = True
+            return
+        
+        self.empty = False
+        y0, y1 = ys.min(), ys.max() + 1
+        x0, x1 = xs.min(), xs.max() + 1
+        self.top, self.bottom = y + y0, y + y1
+        self.left, self.right = x + x0, x + x1
+        
+        bgr = cv2.cvtColor(np.ascontiguousarray(rgba[y0:y1, x0:x1]), cv2.COLOR_RGBA2BGR)
+        alpha3 = cv2.merge([alpha[y0:y1, x0:x1]] * 3)
+        
+        # 前乗算した字幕色と、背景側の重み（255 - α）
+        self.premultiplied = cv2.multiply(bgr, alpha3, scale=1.0 / 255)
+        self.inverse_alpha = cv2.subtract(np.full_like(alpha3, 255), alpha3)
     
-    # 中央に配置
-    x = (width - text_width) // 2
-    y = (height - text_height) // 2
+    def blend_into(self, frame: np.ndarray, scratch: np.ndarray) -> None:
+        """
+        フレームに字幕をαブレンドする（フレームをその場で書き換える）
+        
+        Args:
+            frame: 合成先のフレーム
+            scratch: 字幕の範囲と同じサイズの作業用バッファ
+        """
+        import cv2
+        
+        if self.empty:
+            return
+        roi = frame[self.top:self.bottom, self.left:self.right]
+        cv2.multiply(roi, self.inverse_alpha, dst=scratch, scale=1.0 / 255)
+        cv2.add(scratch, self.premultiplied, dst=roi)
     
-    # 黒い縁取りを描画（ストローク効果）
-    stroke_width = 3
-    for adj in range(-stroke_width, stroke_width + 1):
-        for adj2 in range(-stroke_width, stroke_width + 1):
-            if adj != 0 or adj2 != 0:
-                draw.text((x + adj, y + adj2), text, font=font, fill=(0, 0, 0, 255))
+    def scratch_buffer(self) -> np.ndarray:
+        """blend_into用の作業バッファを確保する"""
+        import numpy as np
+        
+        if self.empty:
+            return None
+        return np.empty_like(self.premultiplied)
+
+
+def apply_fade(frame: np.ndarray, fade: float) -> None:
+    """
+    フェードをuint8のルックアップテーブルでその場で適用する
     
-    # 白いテキストを描画
-    draw.text((x, y), text, font=font, fill=(255, 255, 255, 255))
+    Args:
+        frame: 対象のフレーム（書き換えられる）
+        fade: 明るさの倍率（0.0〜1.0）
+    """
+    import cv2
     
-    # numpy配列に変換（RGBA -> BGR）
-    img_array = np.array(img)
-    # OpenCV用にBGRに変換（アルファチャンネルを考慮）
-    bgr_img = cv2.cvtColor(img_array, cv2.COLOR_RGBA2BGR)
+    level = int(round(min(max(fade, 0.0), 1.0) * 255))
+    if level == 255:
+        # 変化しないので何もしない
+        return
+    cv2.LUT(frame, fade_luts()[level], dst=frame)
+
+
+def fade_at(progress: float) -> float:
+    """
+    進行度からフェードの明るさを計算する（前半でフェードイン、後半でフェードアウト）
     
-    return bgr_img
+    Args:
+        progress: セクション内の進行度（0.0〜1.0）
+        
+    Returns:
+        明るさの倍率（0.0〜1.0）
+    """
+    fade_in = min(progress * 2, 1.0) if progress < 0.5 else 1.0
+    fade_out = min((1.0 - progress) * 2, 1.0) if progress > 0.5 else 1.0
+    return min(fade_in, fade_out)
 
 
-def create_video(script_data: list, output_file: str = "output.mp4") -> str:
+class StageTimer:
     """
-    台本データから動画を生成する
+    レンダリングの工程ごとの所要時間を集計する（ベンチマーク用）
+    
+    工程: decode（画像・音声の読み込み）、zoom、fade、subtitle、encode（エンコーダーへの書き込み）、
+    mux（エンコードの完了・セグメントの連結）。複数スレッドで合成した場合は各スレッドの合計になる。
+    """
+    
+    def __init__(self):
+        self.totals = {}
+        self._lock = threading.Lock()
+    
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+    
+    def as_dict(self) -> dict:
+        with self._lock:
+            return dict(self.totals)
+
+
+class _NullTimer:
+    """計測しない場合のタイマー（何もしない）"""
+    
+    def add(self, stage: str, seconds: float) -> None:
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class TimedWriter:
+    """ライターへの書き込み（encode）と完了待ち（mux）の時間を計測するラッパー"""
+    
+    def __init__(self, out, timer: StageTimer):
+        self.out = out
+        self.timer = timer
+    
+    def isOpened(self) -> bool:
+        return self.out.isOpened()
+    
+    def write(self, frame: np.ndarray) -> None:
+        start = time.perf_counter()
+        self.out.write(frame)
+        self.timer.add("encode", time.perf_counter() - start)
+    
+    def release(self) -> None:
+        start = time.perf_counter()
+        self.out.release()
+        self.timer.add("mux", time.perf_counter() - start)
+    
+    def abort(self) -> None:
+        self.out.abort()
+
+
+class CancellableWriter:
+    """
+    取り消し用のファイルが作られたら書き込みを中断するラッパー
+    
+    別プロセスで実行中のレンダリングは外から止められないため、数フレームごとにファイルの有無を確認する。
+    """
+    
+    # 取り消し用のファイルを確認する間隔（フレーム数）
+    CHECK_INTERVAL = 8
+    
+    def __init__(self, out, cancel_path: str):
+        self.out = out
+        self.cancel_path = cancel_path
+        self._frames = 0
+    
+    def isOpened(self) -> bool:
+        return self.out.isOpened()
+    
+    def write(self, frame: np.ndarray) -> None:
+        if self._frames % self.CHECK_INTERVAL == 0 and os.path.exists(self.cancel_path):
+            raise Exception("レンダリングが取り消されました")
+        self._frames += 1
+        self.out.write(frame)
+    
+    def release(self) -> None:
+        self.out.release()
+    
+    def abort(self) -> None:
+        self.out.abort()
+
+
+class SectionCompositor:
+    """
+    1セクション分のフレームを合成する
+    
+    Ken Burns効果・フェード・字幕合成を、あらかじめ確保したバッファに対して
+    その場で行うため、フレームごとのメモリ確保が発生しない。
+    """
+    
+    def __init__(self, image: np.ndarray, subtitle_text: str, num_frames: int,
+                 width: int = VIDEO_WIDTH, height: int = VIDEO_HEIGHT, ken_burns: dict = None,
+                 timer: StageTimer = None):
+        """
+        Args:
+            image: セクションの画像（BGR形式）
+            subtitle_text: 字幕テキスト
+            num_frames: セクションのフレーム数
+            width: 動画の幅
+            height: 動画の高さ
+            ken_burns: Ken Burns効果の設定（KEN_BURNS_DEFAULTSのキーを上書きする）
+            timer: 工程ごとの時間を集計するタイマー
+        """
+        self.timer = timer or NULL_TIMER
+        effect = {**KEN_BURNS_DEFAULTS, **(ken_burns or {})}
+        self.quality = effect.pop("quality")
+        self.effect = effect
+        self.num_frames = num_frames
+        self.width = width
+        self.height = height
+        
+        # 大きすぎる画像は最大ズームで必要なサイズまで先に縮小しておく
+        self.source = prepare_ken_burns_source(
+            image, width, height, max(effect["zoom_start"], effect["zoom_end"])
+        )
+        
+        # 字幕画像を生成し、合成用のデータを前計算する
+        start = time.perf_counter()
+        subtitle_rgba = create_subtitle_rgba(subtitle_text, width, SUBTITLE_HEIGHT, get_font_path())
+        self.subtitle = SubtitleOverlay(subtitle_rgba, 0, height - SUBTITLE_HEIGHT)
+        self.timer.add("subtitle", time.perf_counter() - start)
+        
+        # 複数スレッドから呼ばれた場合の、スレッドごとの字幕合成用バッファ
+        self._local = threading.local()
+    
+    def new_buffers(self) -> tuple[np.ndarray, np.ndarray]:
+        """render()に渡すフレーム用・字幕合成用のバッファを確保する"""
+        import numpy as np
+        
+        frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        return frame, self.subtitle.scratch_buffer()
+    
+    def render(self, frame_idx: int, frame: np.ndarray, scratch: np.ndarray = None) -> np.ndarray:
+        """
+        指定したフレームを合成してバッファに書き込む
+        
+        フレーム同士は独立しているため、別々のバッファを渡せば複数スレッドから同時に呼び出せる。
+        
+        Args:
+            frame_idx: セクション内のフレーム番号
+            frame: 書き込み先のフレームバッファ
+            scratch: 字幕合成用の作業バッファ（Noneの場合はスレッドごとに確保したものを使う）
+            
+        Returns:
+            書き込んだフレームバッファ
+        """
+        if scratch is None:
+            scratch = getattr(self._local, "scratch", None)
+            if scratch is None:
+                scratch = self._local.scratch = self.subtitle.scratch_buffer()
+        
+        progress = frame_idx / max(self.num_frames - 1, 1)
+        t0 = time.perf_counter()
+        
+        # Ken Burns効果（ズームとパン。画面サイズへのリサイズも同じ変換で行う）
+        zoom, pan = ken_burns_params(progress, **self.effect)
+        apply_ken_burns_effect(
+            self.source, zoom, pan=pan, quality=self.quality,
+            output_size=(self.width, self.height), dst=frame
+        )
+        t1 = time.perf_counter()
+        
+        # フェード効果
+        apply_fade(frame, fade_at(progress))
+        t2 = time.perf_counter()
+        
+        # 字幕を合成（文字のある範囲だけ）
+        self.subtitle.blend_into(frame, scratch)
+        t3 = time.perf_counter()
+        
+        self.timer.add("zoom", t1 - t0)
+        self.timer.add("fade", t2 - t1)
+        self.timer.add("subtitle", t3 - t2)
+        return frame
+
+
+def _resolve_section_assets(section: dict, index: int) -> tuple[str, str, str]:
+    """
+    セクションの画像・音声ファイルのパスと字幕テキストを取得する
     
     Args:
-        script_data: 台本データのリスト。各要素は {"text": "...", "visual_prompt": "...", "subtitle": "..."} の形式
-        output_file: 出力ファイル名
+        section: 台本のセクション
+        index: セクションの番号（0始まり）
         
     Returns:
-        生成された動画ファイルのパス
+        (画像の絶対パス, 音声の絶対パス, 字幕テキスト)のタプル
         
     Raises:
-        Exception: 動画生成に失敗した場合
+        FileNotFoundError: 画像または音声ファイルが存在しない場合
+    """
+    image_path = section.get("image_path", f"image_{index}.png")
+    audio_path = section.get("audio_path", f"audio_{index}.mp3")
+    subtitle_text = section.get("subtitle", section.get("text", ""))
+    
+    # 画像ファイルが存在するか確認（絶対パスに変換）
+    if not os.path.isabs(image_path):
+        # 相対パスの場合、現在の作業ディレクトリからのパスを確認
+        abs_image_path = os.path.abspath(image_path)
+    else:
+        abs_image_path = image_path
+    
+    if not os.path.exists(abs_image_path):
+        raise FileNotFoundError(f"画像ファイルが見つかりません: {abs_image_path} (元のパス: {image_path})")
+    
+    # 音声ファイルが存在するか確認（絶対パスに変換）
+    if not os.path.isabs(audio_path):
+        abs_audio_path = os.path.abspath(audio_path)
+    else:
+        abs_audio_path = audio_path
+    
+    if not os.path.exists(abs_audio_path):
+        raise FileNotFoundError(f"音声ファイルが見つかりません: {abs_audio_path} (元のパス: {audio_path})")
+    
+    return abs_image_path, abs_audio_path, subtitle_text
+
+
+# 生成直後にデコード済みの画像（パス -> (更新日時, サイズ, BGR配列)）。古い順に並ぶ。
+# APIから受け取った画像をファイルから読み直さずにレンダリングに渡すために使う
+_decoded_images = OrderedDict()
+_decoded_images_lock = threading.Lock()
+_decoded_images_bytes = 0
+
+# 保持するデコード済みの画像の合計サイズの上限（バイト）。超えた分は古い順に捨て、レンダリング時にファイルから読む
+DECODED_IMAGES_MAX_BYTES = int(os.getenv("TUBEAUTO_DECODED_IMAGES_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+def register_decoded_image(image_path: str, image: np.ndarray) -> None:
     """
+    デコード済みの画像を登録する（ファイルに保存した直後に呼ぶ）
+    
+    登録した画像は plan_section() で1回だけ取り出され、レンダリングではファイルを読まずにそれを使う。
+    合計サイズが DECODED_IMAGES_MAX_BYTES を超えた場合は、古い画像から捨てる。
+    
+    Args:
+        image_path: 保存した画像ファイルのパス
+        image: 画像（BGR形式）
+    """
+    global _decoded_images_bytes
+    path = os.path.abspath(image_path)
+    stat = os.stat(path)
+    with _decoded_images_lock:
+        old = _decoded_images.pop(path, None)
+        if old is not None:
+            _decoded_images_bytes -= old[2].nbytes
+        _decoded_images[path] = (stat.st_mtime_ns, stat.st_size, image)
+        _decoded_images_bytes += image.nbytes
+        while _decoded_images_bytes > DECODED_IMAGES_MAX_BYTES and _decoded_images:
+            _, (_, _, evicted) = _decoded_images.popitem(last=False)
+            _decoded_images_bytes -= evicted.nbytes
+
+
+def discard_decoded_images(directory: str) -> None:
+    """
+    ディレクトリ内の画像について、取り出されなかったデコード済みの画像を捨てる（ジョブの終了時に呼ぶ）
+    
+    Args:
+        directory: ジョブのディレクトリ
+    """
+    global _decoded_images_bytes
+    prefix = os.path.join(os.path.abspath(directory), "")
+    with _decoded_images_lock:
+        for path in [path for path in _decoded_images if path.startswith(prefix)]:
+            _decoded_images_bytes -= _decoded_images.pop(path)[2].nbytes
+
+
+def take_decoded_image(image_path: str) -> np.ndarray | None:
+    """
+    登録されたデコード済みの画像を取り出す
+    
+    Args:
+        image_path: 画像ファイルのパス
+        
+    Returns:
+        画像（BGR形式）。登録されていない場合や、登録後にファイルが変更された場合はNone
+    """
+    global _decoded_images_bytes
+    path = os.path.abspath(image_path)
+    with _decoded_images_lock:
+        entry = _decoded_images.pop(path, None)
+        if entry is not None:
+            _decoded_images_bytes -= entry[2].nbytes
+    if entry is None:
+        return None
+    mtime_ns, size, image = entry
     try:
-        fps = 24
-        video_clips = []
-        audio_segments = []
-        
-        for i, section in enumerate(script_data):
-            # 画像ファイルのパスを取得
-            image_path = section.get("image_path", f"image_{i}.png")
-            audio_path = section.get("audio_path", f"audio_{i}.mp3")
-            subtitle_text = section.get("subtitle", section.get("text", ""))
-            
-            # 画像ファイルが存在するか確認（絶対パスに変換）
-            if not os.path.isabs(image_path):
-                # 相対パスの場合、現在の作業ディレクトリからのパスを確認
-                abs_image_path = os.path.abspath(image_path)
-            else:
-                abs_image_path = image_path
-            
-            if not os.path.exists(abs_image_path):
-                raise FileNotFoundError(f"画像ファイルが見つかりません: {abs_image_path} (元のパス: {image_path})")
-            
-            # 音声ファイルが存在するか確認（絶対パスに変換）
-            if not os.path.isabs(audio_path):
-                abs_audio_path = os.path.abspath(audio_path)
-            else:
-                abs_audio_path = audio_path
-            
-            if not os.path.exists(abs_audio_path):
-                raise FileNotFoundError(f"音声ファイルが見つかりません: {abs_audio_path} (元のパス: {audio_path})")
-            
-            # 絶対パスを使用
-            image_path = abs_image_path
-            audio_path = abs_audio_path
-            
-            # 音声の長さを取得
-            audio_duration = get_audio_duration(audio_path)
-            num_frames = int(audio_duration * fps)
-            
-            # 画像を読み込む
-            img = cv2.imread(image_path)
-            if img is None:
-                raise Exception(f"画像を読み込めませんでした: {image_path}")
-            
-            h, w = img.shape[:2]
-            
-            # 動画の標準サイズにリサイズ（16:9のアスペクト比を維持）
-            target_width = 1920
-            target_height = 1080
-            
-            img_aspect = w / h
-            target_aspect = target_width / target_height
-            
-            # アスペクト比に応じてリサイズ
-            if img_aspect > target_aspect:
-                # 横長の場合、高さを基準にリサイズ
-                new_height = target_height
-                new_width = int(target_height * img_aspect)
-            else:
-                # 縦長の場合、幅を基準にリサイズ
-                new_width = target_width
-                new_height = int(target_width / img_aspect)
-            
-            img_resized = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
-            
-            # 中央に配置（余白を黒で埋める）
-            video_frame = np.zeros((target_height, target_width, 3), dtype=np.uint8)
-            start_y = (target_height - new_height) // 2
-            start_x = (target_width - new_width) // 2
-            video_frame[start_y:start_y + new_height, start_x:start_x + new_width] = img_resized
-            
-            # 字幕画像を生成
-            subtitle_img = create_subtitle_image(subtitle_text, target_width, 150, FONT_PATH)
-            
-            # フレームを生成（Ken Burns効果とフェード効果を含む）
-            frames = []
-            for frame_idx in range(num_frames):
-                progress = frame_idx / max(num_frames - 1, 1)
-                
-                # Ken Burns効果（ズーム）
-                zoom = 1.0 + 0.15 * progress  # 1.0から1.15へ
-                zoomed_img = apply_ken_burns_effect(video_frame, zoom)
-                
-                # フェード効果
-                fade_in = min(progress * 2, 1.0) if progress < 0.5 else 1.0
-                fade_out = min((1.0 - progress) * 2, 1.0) if progress > 0.5 else 1.0
-                fade = min(fade_in, fade_out)
-                
-                # フェードを適用
-                frame = (zoomed_img * fade).astype(np.uint8)
-                
-                # 字幕を合成
-                subtitle_y = target_height - 150
-                frame[subtitle_y:subtitle_y + 150, :] = cv2.addWeighted(
-                    frame[subtitle_y:subtitle_y + 150, :], 1.0 - 0.7,
-                    subtitle_img, 0.7, 0
-                )
-                
-                frames.append(frame)
-            
-            video_clips.append(frames)
-            
-            # 音声を読み込む
-            audio = AudioSegment.from_mp3(audio_path)
-            audio_segments.append(audio)
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+        return None
+    return image
+
+
+def load_section_compositor(image_path: str, subtitle_text: str, num_frames: int,
+                            width: int = VIDEO_WIDTH, height: int = VIDEO_HEIGHT,
+                            ken_burns: dict = None, timer: StageTimer = None,
+                            image: np.ndarray = None) -> SectionCompositor:
+    """
+    画像を読み込んでセクションのフレーム合成を準備する
+    
+    imageを指定した場合は、ファイルを読まずにそれを使う。
+    
+    Raises:
+        Exception: 画像を読み込めなかった場合
+    """
+    import cv2
+    
+    # 画像を読み込む
+    start = time.perf_counter()
+    img = image if image is not None else cv2.imread(image_path)
+    if img is None:
+        raise Exception(f"画像を読み込めませんでした: {image_path}")
+    if timer:
+        timer.add("decode", time.perf_counter() - start)
+    
+    return SectionCompositor(img, subtitle_text, num_frames, width, height, ken_burns, timer)
+
+
+def generate_section_frames(image_path: str, subtitle_text: str, num_frames: int,
+                            target_width: int = VIDEO_WIDTH, target_height: int = VIDEO_HEIGHT,
+                            ken_burns: dict = None, timer: StageTimer = None,
+                            image: np.ndarray = None) -> Iterator[np.ndarray]:
+    """
+    1セクション分のフレームを1枚ずつ生成するジェネレーター
+    
+    フレームをリストに溜めずに、生成したものから順にエンコーダーへ渡せるようにする。
+    同じバッファを使い回すため、次のフレームを取り出す前に書き出すこと（保持する場合はコピーする）。
+    
+    Args:
+        image_path: 画像ファイルのパス
+        subtitle_text: 字幕テキスト
+        num_frames: 生成するフレーム数
+        target_width: 動画の幅
+        target_height: 動画の高さ
+        ken_burns: Ken Burns効果の設定（KEN_BURNS_DEFAULTSのキーを上書きする）
+        timer: 工程ごとの時間を集計するタイマー
+        image: デコード済みの画像（指定した場合はファイルを読まない）
+        
+    Yields:
+        Ken Burns効果・フェード・字幕を適用したフレーム（BGR形式）
+        
+    Raises:
+        Exception: 画像を読み込めなかった場合
+    """
+    compositor = load_section_compositor(image_path, subtitle_text, num_frames, target_width, target_height,
+                                         ken_burns, timer, image)
+    frame, scratch = compositor.new_buffers()
+    
+    # フレームを生成（Ken Burns効果とフェード効果を含む）
+    for frame_idx in range(num_frames):
+        yield compositor.render(frame_idx, frame, scratch)
+
+
+def _subprocess_flags() -> int:
+    """Windowsでコンソールウィンドウを開かないためのフラグを返す"""
+    return subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0
+
+
+def is_ffmpeg_available() -> bool:
+    """
+    ffmpegが実行できるか確認する（結果はプロセス内でキャッシュする）
+    
+    Returns:
+        `ffmpeg -version` が成功した場合はTrue
+    """
+    return ffmpeg_capabilities(FFMPEG_CMD)["available"]
+
+
+class FFmpegPipeWriter:
+    """
+    raw BGRフレームを標準入力経由で1つのffmpegプロセスに渡し、
+    音声と一緒にH.264/AACのMP4を直接書き出すエンコーダー
+    
+    cv2.VideoWriterと同じく write() / release() で使用する。
+    """
+    
+    def __init__(self, output_file: str, fps: int, width: int, height: int, audio_path: str | list = None,
+                 duration: float = None, audio_durations: list = None):
+        """
+        Args:
+            output_file: 出力ファイルのパス
+            fps: フレームレート
+            width: フレームの幅
+            height: フレームの高さ
+            audio_path: 多重化する音声ファイルのパス（Noneの場合は音声なし）。
+                リストの場合はconcat demuxerでこの順番に結合して1つの音声として扱う
+            duration: 出力の長さ（秒）。指定した場合は音声をこの長さで切り詰める
+            audio_durations: audio_pathがリストの場合の、ファイルごとの長さ（秒）。
+                指定した場合は各音声をこの長さに切り詰める・無音で埋めてから結合する（セクションの映像の長さに合わせて音ズレを防ぐ）
+        """
+        self.output_file = output_file
+        self.frame_bytes = width * height * 3
         
-        # すべてのフレームを結合
-        all_frames = []
-        for frames in video_clips:
-            all_frames.extend(frames)
+        cmd = [
+            FFMPEG_CMD, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+            '-i', '-',
+        ]
+        # 複数の音声はデコードせず、リストファイルでffmpegに直接結合させる
+        self._audio_list_path = None
+        if isinstance(audio_path, (list, tuple)):
+            from workspace import make_scratch_file
+            self._audio_list_path = make_scratch_file('.txt')
+            write_concat_list(audio_path, self._audio_list_path, audio_durations)
+            cmd += ['-f', 'concat', '-safe', '0', '-i', self._audio_list_path]
+        elif audio_path:
+            cmd += ['-i', audio_path]
+        cmd += ['-map', '0:v:0']
+        if audio_path:
+            cmd += [
+                '-map', '1:a:0', '-c:a', 'aac', '-b:a', AUDIO_BITRATE,
+                '-ar', str(AUDIO_SAMPLE_RATE), '-ac', str(AUDIO_CHANNELS),
+            ]
+            if self._audio_list_path and audio_durations is not None:
+                # 短い音声の後ろに空いた時間と、最後のセクションの足りない分を無音で埋める（全体の長さは -t でそろえる）
+                cmd += ['-af', 'aresample=async=1,apad']
+                if duration is None:
+                    duration = sum(audio_durations)
+        if duration is not None:
+            cmd += ['-t', f'{duration:.6f}']
+        cmd += [
+            '-c:v', 'libx264', '-preset', X264_PRESET, '-crf', str(X264_CRF), '-pix_fmt', 'yuv420p',
+            output_file,
+        ]
         
-        # 動画を書き出し
+        # エラー出力はパイプが詰まらないように一時ファイルに逃がす
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr,
+            creationflags=_subprocess_flags()
+        )
+    
+    def isOpened(self) -> bool:
+        return self._proc.poll() is None
+    
+    def _remove_audio_list(self) -> None:
+        if self._audio_list_path and os.path.exists(self._audio_list_path):
+            os.remove(self._audio_list_path)
+    
+    def _error_output(self) -> str:
+        self._stderr.seek(0)
+        return self._stderr.read().decode('utf-8', errors='replace').strip()[-1000:]
+    
+    def write(self, frame: np.ndarray) -> None:
+        """フレームを1枚書き出す（連続したメモリならコピーせずに渡す）"""
+        import numpy as np
+        
+        if frame.nbytes != self.frame_bytes:
+            raise Exception(f"フレームサイズが一致しません: {frame.shape}")
+        try:
+            self._proc.stdin.write(memoryview(np.ascontiguousarray(frame)).cast('B'))
+        except (BrokenPipeError, OSError):
+            self._proc.wait()
+            raise Exception(f"ffmpegへの書き込みに失敗しました: {self._error_output()}")
+    
+    def release(self) -> None:
+        """入力を閉じてエンコードの完了を待つ"""
+        if self._proc.stdin and not self._proc.stdin.closed:
+            try:
+                self._proc.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+        returncode = self._proc.wait()
+        error_output = self._error_output()
+        self._stderr.close()
+        self._remove_audio_list()
+        if returncode != 0:
+            raise Exception(f"ffmpegでのエンコードに失敗しました（終了コード {returncode}）: {error_output}")
+    
+    def abort(self) -> None:
+        """エンコードを中断し、書きかけの出力ファイルを削除する"""
+        self._proc.kill()
+        self._proc.wait()
+        if self._proc.stdin and not self._proc.stdin.closed:
+            try:
+                self._proc.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+        self._stderr.close()
+        self._remove_audio_list()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+
+class OpenCVWriter:
+    """
+    ffmpegが使えない環境向けのフォールバック（OpenCVのmp4v、音声なし）
+    """
+    
+    def __init__(self, output_file: str, fps: int, width: int, height: int):
+        import cv2
+        
+        self.output_file = output_file
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_file, fourcc, fps, (target_width, target_height))
+        self._out = cv2.VideoWriter(output_file, fourcc, fps, (width, height))
+    
+    def isOpened(self) -> bool:
+        return self._out.isOpened()
+    
+    def write(self, frame: np.ndarray) -> None:
+        self._out.write(frame)
+    
+    def release(self) -> None:
+        self._out.release()
+    
+    def abort(self) -> None:
+        self._out.release()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+
+class FramePipeline:
+    """
+    フレームをスレッドプールで並列に合成し、1つの書き出しスレッドが順番どおりにエンコーダーへ渡す
+    
+    フレームバッファは固定数だけ確保して使い回し、空きがなくなると submit() が待つため
+    （バックプレッシャー）、動画の長さやスレッド数に関わらずメモリ使用量は一定に保たれる。
+    OpenCVの処理やパイプへの書き込みはGILを解放するため、スレッドでも複数コアを使える。
+    """
+    
+    def __init__(self, out, width: int, height: int, threads: int = None, max_pending: int = None):
+        """
+        Args:
+            out: write() を持つライター（書き出しスレッドだけが使用する）
+            width: フレームの幅
+            height: フレームの高さ
+            threads: 合成に使うスレッド数（Noneの場合はCPUコア数）
+            max_pending: 合成済みで書き出し待ちにできるフレーム数（Noneの場合はスレッド数と同じ）
+        """
+        import numpy as np
         
-        if not out.isOpened():
-            raise Exception(f"動画ファイルを開けませんでした: {output_file}")
+        self.out = out
+        self.threads = threads or os.cpu_count() or 1
+        max_pending = max_pending or self.threads
         
-        for frame in all_frames:
-            out.write(frame)
-        out.release()
+        # 使い回すフレームバッファ（合成中 + 書き出し待ちの最大数だけ確保する）
+        self._free_buffers = queue.Queue()
+        for _ in range(self.threads + max_pending):
+            self._free_buffers.put(np.empty((height, width, 3), dtype=np.uint8))
         
-        # 動画ファイルが正しく作成されたか確認
-        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
-            raise Exception(f"動画ファイルが正しく作成されませんでした: {output_file}")
+        # 提出順に並んだ合成中のフレーム（Future）。満杯ならsubmit()が待つ
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="frame")
+        self._writer_thread = threading.Thread(target=self._write_loop, name="frame-writer", daemon=True)
+        self._writer_thread.start()
+    
+    def _write_loop(self) -> None:
+        """提出順にフレームの完成を待って書き出す（エラー後はバッファを返すだけにする）"""
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            future, buffer = item
+            try:
+                frame = future.result()
+                if self._error is None:
+                    self.out.write(frame)
+            except BaseException as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._free_buffers.put(buffer)
+    
+    def submit(self, render, frame_idx: int) -> None:
+        """
+        フレームの合成を依頼する（空きバッファができるまで待つ）
         
-        # 音声を結合
-        combined_audio = sum(audio_segments)
+        Args:
+            render: render(frame_idx, buffer) でバッファにフレームを書き込む関数
+            frame_idx: フレーム番号
+            
+        Raises:
+            Exception: 合成または書き出しで既にエラーが発生していた場合
+        """
+        if self._error is not None:
+            raise self._error
+        buffer = self._free_buffers.get()
+        self._pending.put((self._executor.submit(render, frame_idx, buffer), buffer))
+    
+    def close(self) -> None:
+        """
+        残りのフレームをすべて書き出して終了する
         
-        # 一時ファイルに音声を保存
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_audio:
-            temp_audio_path = temp_audio.name
-            combined_audio.export(temp_audio_path, format='mp3')
+        Raises:
+            Exception: 合成または書き出しでエラーが発生していた場合
+        """
+        self._pending.put(None)
+        self._writer_thread.join()
+        self._executor.shutdown(wait=True)
+        if self._error is not None:
+            raise self._error
+    
+    def abort(self) -> None:
+        """未処理のフレームを破棄して終了する"""
+        if self._error is None:
+            self._error = Exception("フレームの書き出しを中断しました")
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._pending.put(None)
+        self._writer_thread.join()
+
+
+def write_sections(out, plans: list, width: int, height: int, frame_threads: int = 1,
+                   timer: StageTimer = None, time_writes: bool = True) -> None:
+    """
+    セクションのフレームを順番にライターへ書き出す
+    
+    Args:
+        out: write() を持つライター
+        plans: _plan_sections() が返すセクションの情報
+        width: 動画の幅
+        height: 動画の高さ
+        frame_threads: フレーム合成のスレッド数（1の場合は呼び出し元のスレッドで順番に合成する）
+        timer: 工程ごとの時間を集計するタイマー
+        time_writes: 書き込み時間も集計するかどうか（呼び出し元で計測済みの場合はFalse）
+    """
+    if timer and time_writes:
+        out = TimedWriter(out, timer)
+    
+    if frame_threads <= 1:
+        for plan in plans:
+            # 生成したフレームをそのまま書き出す
+            for frame in generate_section_frames(plan["image_path"], plan["subtitle"], plan["num_frames"],
+                                                 width, height, plan["ken_burns"], timer, plan.get("image")):
+                out.write(frame)
+        return
+    
+    pipeline = FramePipeline(out, width, height, frame_threads)
+    try:
+        for plan in plans:
+            compositor = load_section_compositor(plan["image_path"], plan["subtitle"], plan["num_frames"],
+                                                 width, height, plan["ken_burns"], timer, plan.get("image"))
+            for frame_idx in range(plan["num_frames"]):
+                pipeline.submit(compositor.render, frame_idx)
+    except BaseException:
+        pipeline.abort()
+        raise
+    pipeline.close()
+
+
+def open_video_writer(output_file: str, fps: int, width: int, height: int,
+                      audio_path: str | list = None, encoder: str = "auto", audio_durations: list = None):
+    """
+    エンコーダーを選択して動画の書き出し先を開く
+    
+    Args:
+        output_file: 出力ファイルのパス
+        fps: フレームレート
+        width: フレームの幅
+        height: フレームの高さ
+        audio_path: 多重化する音声ファイルのパス、またはそのリスト（ffmpeg使用時のみ有効）
+        encoder: "auto"（ffmpegがあれば使用）、"ffmpeg"、"opencv" のいずれか
+        audio_durations: audio_pathがリストの場合の、ファイルごとの長さ（秒）（FFmpegPipeWriterを参照）
         
-        # 音声ファイルが正しく作成されたか確認
-        if not os.path.exists(temp_audio_path) or os.path.getsize(temp_audio_path) == 0:
-            raise Exception(f"音声ファイルが正しく作成されませんでした: {temp_audio_path}")
+    Returns:
+        write() / release() / abort() を持つライター
         
-        # ffmpegで動画と音声を結合
-        temp_output = output_file.replace('.mp4', '_temp.mp4')
-        if os.path.exists(temp_output):
-            os.remove(temp_output)
-        os.rename(output_file, temp_output)
+    Raises:
+        Exception: エンコーダーが使えない、またはファイルを開けなかった場合
+    """
+    if encoder not in ("auto", "ffmpeg", "opencv"):
+        raise ValueError(f"不明なエンコーダーです: {encoder}")
+    
+    if encoder == "ffmpeg" and not is_ffmpeg_available():
+        raise Exception(
+            "ffmpegが見つかりません。\n"
+            "ffmpegのダウンロード: https://ffmpeg.org/download.html"
+        )
+    
+    if encoder != "opencv" and is_ffmpeg_available():
+        writer = FFmpegPipeWriter(output_file, fps, width, height, audio_path, audio_durations=audio_durations)
+    else:
+        if audio_path:
+            print("警告: ffmpegが見つからないか、実行に失敗しました。音声なしの動画を生成します。")
+        writer = OpenCVWriter(output_file, fps, width, height)
+    
+    if not writer.isOpened():
+        raise Exception(f"動画ファイルを開けませんでした: {output_file}")
+    
+    return writer
+
+
+def _run_ffmpeg(args: list, error_message: str) -> None:
+    """
+    ffmpegを実行し、失敗した場合はエラー出力付きの例外を送出する
+    
+    Args:
+        args: ffmpegに渡す引数（コマンド名は含めない）
+        error_message: 失敗時のメッセージ
         
-        # リネーム後のファイルの存在確認
-        if not os.path.exists(temp_output):
-            raise Exception(f"一時動画ファイルの作成に失敗しました: {temp_output}")
+    Raises:
+        Exception: ffmpegが失敗した場合
+    """
+    result = subprocess.run(
+        [FFMPEG_CMD, '-y', '-loglevel', 'error'] + args,
+        capture_output=True, text=True, creationflags=_subprocess_flags()
+    )
+    if result.returncode != 0:
+        raise Exception(f"{error_message}: {result.stderr.strip()[-1000:]}")
+
+
+def plan_section(section: dict, index: int, fps: int, ken_burns: dict = None, timer: StageTimer = None) -> dict:
+    """
+    1つのセクションの素材を確認し、レンダリングに必要な情報をまとめる
+    
+    Args:
+        section: 台本のセクション
+        index: セクションの番号（0始まり）
+        fps: フレームレート
+        ken_burns: 動画全体のKen Burns効果の設定
+        timer: 工程ごとの時間を集計するタイマー
         
-        # ffmpegで動画と音声を結合を試みる
-        ffmpeg_success = False
+    Returns:
+        {"image_path", "audio_path", "subtitle", "num_frames", "ken_burns"} の辞書。
+        デコード済みの画像が登録されていれば "image" も含む
         
-        try:
-            # ffmpegが存在するか確認（Windowsでは.exeが必要な場合がある）
-            ffmpeg_cmd = 'ffmpeg'
-            try:
-                result = subprocess.run([ffmpeg_cmd, '-version'], capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0)
-                ffmpeg_success = result.returncode == 0
-            except (FileNotFoundError, OSError):
-                ffmpeg_success = False
-            
-            if ffmpeg_success:
-                # ffmpegコマンドを実行
-                cmd = [
-                    ffmpeg_cmd, '-y', '-i', temp_output, '-i', temp_audio_path,
-                    '-c:v', 'copy', '-c:a', 'aac', '-strict', 'experimental',
-                    output_file
+    Raises:
+        FileNotFoundError: 画像または音声ファイルが存在しない場合
+    """
+    image_path, audio_path, subtitle_text = _resolve_section_assets(section, index)
+    
+    # 音声の長さをヘッダーから読み取り（デコードしない）、フレーム数を決める
+    start = time.perf_counter()
+    audio_duration = get_audio_duration(audio_path)
+    (timer or NULL_TIMER).add("decode", time.perf_counter() - start)
+    
+    plan = {
+        "image_path": image_path,
+        "audio_path": audio_path,
+        "subtitle": subtitle_text,
+        "num_frames": int(audio_duration * fps),
+        "ken_burns": {**(ken_burns or {}), **section.get("ken_burns", {})},
+    }
+    image = take_decoded_image(image_path)
+    if image is not None:
+        plan["image"] = image
+    return plan
+
+
+def _plan_sections(script_data: list, fps: int, ken_burns: dict = None, timer: StageTimer = None) -> list:
+    """
+    各セクションの素材を確認し、レンダリングに必要な情報をまとめる
+    
+    書き出し途中で失敗しないよう、すべてのセクションのファイルを先に確認する。
+    
+    Args:
+        script_data: 台本データのリスト
+        fps: フレームレート
+        ken_burns: 動画全体のKen Burns効果の設定
+        timer: 工程ごとの時間を集計するタイマー
+        
+    Returns:
+        セクションごとの plan_section() の結果のリスト
+    """
+    return [plan_section(section, i, fps, ken_burns, timer) for i, section in enumerate(script_data)]
+
+
+def _init_render_worker() -> None:
+    """レンダリング用ワーカープロセスの初期化（OpenCV内部のスレッドで過剰に並列化しない）"""
+    import cv2
+    
+    cv2.setNumThreads(1)
+
+
+def render_section_segment(plan: dict, output_file: str, fps: int = FPS,
+                           width: int = VIDEO_WIDTH, height: int = VIDEO_HEIGHT, frame_threads: int = 1,
+                           timer: StageTimer = None, cancel_path: str = None) -> str:
+    """
+    1セクションを、そのセクションの音声付きのMP4セグメントとして書き出す
+    
+    プロセスプールから呼び出せるよう、モジュールのトップレベルに定義している。
+    音声は映像の長さ（フレーム数 / fps）に切り詰め、連結後も音ズレしないようにする。
+    
+    Args:
+        plan: _plan_sections() が返すセクションの情報
+        output_file: 出力するセグメントのパス
+        fps: フレームレート
+        width: 動画の幅
+        height: 動画の高さ
+        frame_threads: フレーム合成のスレッド数
+        timer: 工程ごとの時間を集計するタイマー（別プロセスで実行する場合は集計されない）
+        cancel_path: このファイルが作られたら書き出しを中断する（Noneの場合は中断しない）
+        
+    Returns:
+        書き出したセグメントのパス
+        
+    Raises:
+        Exception: 書き出しに失敗した場合、または取り消された場合
+    """
+    if cancel_path and os.path.exists(cancel_path):
+        raise Exception("レンダリングが取り消されました")
+    out = FFmpegPipeWriter(output_file, fps, width, height, plan["audio_path"], plan["num_frames"] / fps)
+    if cancel_path:
+        out = CancellableWriter(out, cancel_path)
+    if timer:
+        out = TimedWriter(out, timer)
+    try:
+        write_sections(out, [plan], width, height, frame_threads, timer, time_writes=False)
+    except BaseException:
+        out.abort()
+        raise
+    out.release()
+    return output_file
+
+
+def concat_segments(segment_paths: list, output_file: str) -> str:
+    """
+    セグメントをffmpegのconcat demuxerで再エンコードせずに連結する
+    
+    Args:
+        segment_paths: 連結するセグメントのパス（この順番で連結する）
+        output_file: 出力ファイルのパス
+        
+    Returns:
+        出力ファイルのパス
+    """
+    from workspace import make_scratch_file
+    
+    list_path = make_scratch_file('.txt')
+    write_concat_list(segment_paths, list_path)
+    try:
+        _run_ffmpeg(
+            ['-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', output_file],
+            "セグメントの連結に失敗しました"
+        )
+    finally:
+        os.remove(list_path)
+    return output_file
+
+
+def section_cache_key(plan: dict, fps: int, width: int, height: int) -> str:
+    """
+    セクションのセグメントのキャッシュキーを計算する
+    
+    画像・音声の内容、字幕、フォント、解像度、fps、エフェクトとエンコードの設定が
+    すべて同じ場合に限り、同じキーになる。
+    
+    Args:
+        plan: _plan_sections() が返すセクションの情報
+        fps: フレームレート
+        width: 動画の幅
+        height: 動画の高さ
+        
+    Returns:
+        キャッシュキー
+    """
+    return make_key(
+        RENDER_CACHE_VERSION,
+        hash_file(plan["image_path"]),
+        hash_file(plan["audio_path"]),
+        plan["subtitle"],
+        get_font_path() or "",
+        [width, height, fps, plan["num_frames"], SUBTITLE_HEIGHT],
+        {**KEN_BURNS_DEFAULTS, **plan["ken_burns"]},
+        [X264_PRESET, X264_CRF, AUDIO_BITRATE, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS],
+    )
+
+
+def _render_segmented(plans: list, output_file: str, fps: int, width: int, height: int,
+                      workers: int = 1, frame_threads: int = 1, cache: DiskCache = None,
+                      timer: StageTimer = None, cancel_path: str = None) -> None:
+    """
+    セクションごとにセグメントを書き出し、順番どおりに再エンコードせずに連結する
+    
+    キャッシュを指定した場合は、キャッシュにあるセクションはレンダリングせずに再利用し、
+    新しくレンダリングしたセグメントはキャッシュに保存する。
+    
+    Args:
+        plans: _plan_sections() が返すセクションの情報
+        output_file: 出力ファイルのパス
+        fps: フレームレート
+        width: 動画の幅
+        height: 動画の高さ
+        workers: ワーカープロセス数（1の場合はこのプロセスで順番にレンダリングする）
+        frame_threads: 各セクションのフレーム合成のスレッド数
+        cache: セグメントのキャッシュ（Noneの場合は使わない）
+        timer: 工程ごとの時間を集計するタイマー
+        cancel_path: このファイルが作られたらレンダリングを中断する（render_section_segment() を参照）
+    """
+    from workspace import make_scratch_dir
+    
+    segment_dir = make_scratch_dir("segments_", os.path.dirname(os.path.abspath(output_file)))
+    try:
+        segment_paths = []
+        jobs = []  # (セクション番号, 情報, 書き出し先, キャッシュキー)
+        for i, plan in enumerate(plans):
+            key = section_cache_key(plan, fps, width, height) if cache else None
+            path = os.path.join(segment_dir, f"segment_{i:04d}.mp4")
+            segment_paths.append(path)
+            # キャッシュにあればリンクする（連結する前にほかのプロセスがキャッシュから削除しても消えない）
+            if not (cache and cache.fetch(key, path)):
+                jobs.append((i, plan, path, key))
+        
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=_init_render_worker) as executor:
+                futures = [
+                    executor.submit(render_section_segment, plan, path, fps, width, height, frame_threads,
+                                    None, cancel_path)
+                    for _, plan, path, _ in jobs
                 ]
-                result = subprocess.run(cmd, capture_output=True, text=True, creationflags=subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0)
-                if result.returncode == 0:
-                    os.remove(temp_output)
-                    os.remove(temp_audio_path)
-                else:
-                    ffmpeg_success = False
-        except Exception:
-            ffmpeg_success = False
-        
-        # ffmpegが使えない場合、音声なしの動画を返す
-        if not ffmpeg_success:
-            print("警告: ffmpegが見つからないか、実行に失敗しました。音声なしの動画を生成します。")
-            if os.path.exists(temp_output):
-                if os.path.exists(output_file):
-                    os.remove(output_file)
-                os.rename(temp_output, output_file)
-            if os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        else:
+            for _, plan, path, _ in jobs:
+                render_section_segment(plan, path, fps, width, height, frame_threads, timer, cancel_path)
+        
+        if cache:
+            # セグメントは残したままキャッシュにリンクする（容量の調整は最後にまとめて行う）
+            for _, _, path, key in jobs:
+                cache.put(key, path, evict=False, keep_src=True)
+        
+        start = time.perf_counter()
+        concat_segments(segment_paths, output_file)
+        (timer or NULL_TIMER).add("mux", time.perf_counter() - start)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        if cache:
+            cache.evict()
+
+
+def create_video(script_data: list, output_file: str = "output.mp4", encoder: str = "auto",
+                 ken_burns: dict = None, parallel: bool = False, workers: int = None,
+                 frame_threads: int = None, cache_dir: str = None,
+                 cache_max_bytes: int = DEFAULT_MAX_BYTES, resolution: tuple = None,
+                 fps: int = FPS, timings: StageTimer = None, cancel_path: str = None) -> str:
+    """
+    台本データから動画を生成する
+    
+    フレームはセクションごとにジェネレーターで生成し、その場でエンコーダーへ書き出すため、
+    動画の長さに関わらずメモリ上には数フレームしか保持しない。
+    ffmpegが使える場合は、フレームとナレーションの音声を1つのffmpegプロセスに渡して
+    H.264/AACのMP4を一度で書き出す。使えない場合はOpenCVで音声なしの動画を書き出す。
+    
+    parallel=Trueの場合は、セクションごとに別プロセスで音声付きセグメントを書き出し、
+    最後に再エンコードせずに連結する（ffmpegが必要）。
+    順番にレンダリングする場合も、1セクション内のフレームはスレッドプールで並列に合成する。
+    
+    cache_dirを指定した場合は、セクションのセグメントを内容のハッシュをキーにしてキャッシュし、
+    変更のあったセクションだけをレンダリングし直す（ffmpegが必要）。
+    
+    Args:
+        script_data: 台本データのリスト。各要素は {"text": "...", "visual_prompt": "...", "subtitle": "..."} の形式
+        output_file: 出力ファイル名
+        encoder: "auto"（ffmpegがあれば使用）、"ffmpeg"、"opencv" のいずれか
+        ken_burns: Ken Burns効果の設定（KEN_BURNS_DEFAULTSのキーを上書きする）。
+            セクションごとに "ken_burns" キーで上書きすることもできる
+        parallel: セクションごとに並列でレンダリングするかどうか
+        workers: 並列レンダリングのワーカープロセス数（Noneの場合はCPUコア数）
+        frame_threads: フレーム合成のスレッド数（Noneの場合、順番にレンダリングするときはCPUコア数、
+            並列レンダリングのときは各ワーカーで1）
+        cache_dir: セグメントのキャッシュを保存するディレクトリ（Noneの場合はキャッシュしない）
+        cache_max_bytes: キャッシュ全体の容量の上限（バイト）
+        resolution: 動画の解像度 (幅, 高さ)（Noneの場合は1920x1080）
+        fps: フレームレート
+        timings: 工程ごとの時間を集計するタイマー（ベンチマーク用）
+        cancel_path: このファイルが作られたらレンダリングを中断する（別のスレッドから取り消すため。acreate_video() を参照）
+        
+    Returns:
+        生成された動画ファイルのパス
+        
+    Raises:
+        Exception: 動画生成に失敗した場合、または取り消された場合
+    """
+    try:
+        target_width, target_height = resolution or (VIDEO_WIDTH, VIDEO_HEIGHT)
+        use_ffmpeg = encoder != "opencv" and is_ffmpeg_available()
+        
+        if parallel and not use_ffmpeg:
+            print("警告: 並列レンダリングにはffmpegが必要です。セクションを順番にレンダリングします。")
+            parallel = False
+        if cache_dir and not use_ffmpeg:
+            print("警告: レンダリングキャッシュにはffmpegが必要です。キャッシュを使わずにレンダリングします。")
+            cache_dir = None
+        
+        if parallel or cache_dir:
+            plans = _plan_sections(script_data, fps, ken_burns, timings)
+            cache = DiskCache(cache_dir, cache_max_bytes, suffix=".mp4") if cache_dir else None
+            if parallel:
+                segment_workers = workers or os.cpu_count() or 1
+                segment_threads = frame_threads or 1
+            else:
+                segment_workers = 1
+                segment_threads = frame_threads or os.cpu_count() or 1
+            _render_segmented(plans, output_file, fps, target_width, target_height,
+                              segment_workers, segment_threads, cache, timings, cancel_path)
+        else:
+            plans = _plan_sections(script_data, fps, ken_burns, timings)
+            
+            # ナレーションはそのままffmpegに渡して結合させる（ffmpegがない場合は音声なし）。
+            # 各セクションの音声は映像の長さ（フレーム数 / fps）にそろえ、セクションが続いても音ズレしないようにする
+            audio_paths = [plan["audio_path"] for plan in plans] if use_ffmpeg else None
+            audio_durations = [plan["num_frames"] / fps for plan in plans]
+            
+            # 動画の書き出し先を開く
+            out = open_video_writer(output_file, fps, target_width, target_height, audio_paths, encoder,
+                                    audio_durations)
+            if cancel_path:
+                out = CancellableWriter(out, cancel_path)
+            if timings:
+                out = TimedWriter(out, timings)
+            
+            try:
+                write_sections(out, plans, target_width, target_height, frame_threads or os.cpu_count() or 1,
+                               timings, time_writes=False)
+            except BaseException:
+                out.abort()
+                raise
+            out.release()
+        
+        # 動画ファイルが正しく作成されたか確認
+        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            raise Exception(f"動画ファイルが正しく作成されませんでした: {output_file}")
         
         return output_file
         
@@ -372,3 +1396,39 @@ def create_video(script_data: list, output_file: str = "output.mp4") -> str:
             )
         else:
             raise Exception(f"動画生成に失敗しました: {error_msg}")
+
+
+async def acreate_video(script_data: list, output_file: str = "output.mp4", **kwargs) -> str:
+    """
+    台本データから動画を生成する（非同期版。create_video() を別のスレッドで実行する）
+    
+    取り消された場合は、レンダリング（ワーカープロセスとffmpeg）を中断させ、
+    止まって一時ファイルが消えるのを待ってから CancelledError を送出する。
+    
+    Args:
+        script_data: 台本データのリスト
+        output_file: 出力ファイル名
+        kwargs: create_video() のその他の引数
+        
+    Returns:
+        生成された動画ファイルのパス
+        
+    Raises:
+        Exception: 動画生成に失敗した場合
+    """
+    cancel_path = os.path.abspath(output_file) + ".cancel"
+    if os.path.exists(cancel_path):
+        os.remove(cancel_path)
+    render = asyncio.ensure_future(
+        asyncio.to_thread(create_video, script_data, output_file, cancel_path=cancel_path, **kwargs)
+    )
+    try:
+        return await asyncio.shield(render)
+    except asyncio.CancelledError:
+        with open(cancel_path, "w"):
+            pass
+        await asyncio.gather(render, return_exceptions=True)
+        raise
+    finally:
+        if os.path.exists(cancel_path):
+            os.remove(cancel_path)
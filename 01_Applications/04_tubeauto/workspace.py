@@ -0,0 +1,305 @@
+"""
+ワークスペース管理モジュール
+ジョブのディレクトリ（台本、素材、動画）のディスク使用量を管理する
+
+    - 容量の上限: ジョブ1つあたりと全体の上限。全体の上限を超えたら、最も長く使われていないジョブから削除する
+    - 保存期間: 最後に使われてから一定の日数が過ぎたジョブを削除する
+    - 一時ファイルの掃除: 異常終了で残ったレンダリングの途中のファイル（segments_*、*.part、*.tmp）を起動時に削除する
+    - 作業用ディレクトリ: レンダリングの途中のファイルを、tmpfsなどの速いディレクトリに置ける
+
+削除はディレクトリの名前を変えてから行うため、途中で止まっても中途半端なジョブは残らない
+（名前を変えたものは次の掃除で削除する）。
+
+環境変数:
+    TUBEAUTO_WORKSPACE_MAX_BYTES: 全体の容量の上限（デフォルト: 20GB）
+    TUBEAUTO_JOB_MAX_BYTES: ジョブ1つあたりの容量の上限（デフォルト: 2GB）
+    TUBEAUTO_JOB_RETENTION_DAYS: ジョブを残す日数（デフォルト: 14日。0の場合は期限なし）
+    TUBEAUTO_SCRATCH_DIR: レンダリングの途中のファイルを置くディレクトリ（例: /dev/shm/tubeauto。デフォルト: 出力先と同じ）
+"""
+
+import os
+import time
+import shutil
+import tempfile
+
+from disk_cache import FileLock
+from job import JOBS_DIR, MANIFEST_FILE
+from runtime import load_env
+
+# 容量の上限と保存期間のデフォルト
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+DEFAULT_MAX_JOB_BYTES = 2 * 1024 ** 3
+DEFAULT_RETENTION_DAYS = 14
+
+# この時間内に更新されたファイルは、別のプロセスが使っている可能性があるので削除しない（秒）
+ORPHAN_GRACE_SECONDS = 3600
+
+# 作業用の一時ファイル・ディレクトリの名前の先頭（起動時の掃除で見分ける）
+SCRATCH_PREFIX = "tubeauto_"
+# 削除中のジョブのディレクトリの名前の先頭
+TRASH_PREFIX = ".trash-"
+LOCK_FILE = ".workspace.lock"
+
+# ジョブのディレクトリ内の一時ファイル（以前の名前の segments_* を含む）
+_ORPHAN_DIR_PREFIXES = (SCRATCH_PREFIX, "segments_")
+_ORPHAN_FILE_SUFFIXES = (".part", ".tmp")
+
+
+def scratch_dir() -> str | None:
+    """
+    レンダリングの途中のファイルを置くディレクトリ（環境変数 TUBEAUTO_SCRATCH_DIR）
+
+    Returns:
+        ディレクトリのパス。設定されていない場合はNone（出力先と同じディレクトリを使う）
+    """
+    load_env()
+    path = os.getenv("TUBEAUTO_SCRATCH_DIR")
+    if not path:
+        return None
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def make_scratch_dir(name: str, default_dir: str = None) -> str:
+    """
+    作業用のディレクトリを作る（作業用ディレクトリが設定されていればそこに、なければ default_dir に作る）
+
+    Args:
+        name: ディレクトリ名の先頭（例: "segments_"）
+        default_dir: 作業用ディレクトリが設定されていない場合に作る場所（Noneの場合はOSの一時ディレクトリ）
+
+    Returns:
+        作ったディレクトリのパス
+    """
+    return tempfile.mkdtemp(prefix=SCRATCH_PREFIX + name, dir=scratch_dir() or default_dir)
+
+
+def make_scratch_file(suffix: str) -> str:
+    """
+    作業用の空のファイルを作る（ffmpegの結合リストなど）
+
+    Args:
+        suffix: ファイルの拡張子（例: ".txt"）
+
+    Returns:
+        作ったファイルのパス（使い終わったら呼び出し元で削除する）
+    """
+    fd, path = tempfile.mkstemp(prefix=SCRATCH_PREFIX, suffix=suffix, dir=scratch_dir())
+    os.close(fd)
+    return path
+
+
+def tree_size(path: str) -> int:
+    """ディレクトリ内のファイルの合計サイズ（バイト）"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def format_bytes(size: float) -> str:
+    """バイト数を表示用の文字列にする"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def _remove(path: str) -> None:
+    """ファイルまたはディレクトリを削除する（既にない場合は何もしない）"""
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class Workspace:
+    """
+    ジョブのディレクトリをまとめて管理する（容量の上限、保存期間、一時ファイルの掃除）
+
+    容量の調整はロックファイルで排他するため、アプリとバッチなど複数のプロセスで同じディレクトリを共有できる。
+    """
+
+    def __init__(self, root: str = None, max_bytes: int = None, max_job_bytes: int = None,
+                 retention_days: float = None):
+        """
+        Args:
+            root: ジョブを保存するディレクトリ（Noneの場合は job.JOBS_DIR）
+            max_bytes: 全体の容量の上限（Noneの場合は環境変数またはデフォルト）
+            max_job_bytes: ジョブ1つあたりの容量の上限（Noneの場合は環境変数またはデフォルト）
+            retention_days: ジョブを残す日数（Noneの場合は環境変数またはデフォルト。0の場合は期限なし）
+        """
+        load_env()
+        self.root = os.path.abspath(root or JOBS_DIR)
+        self.max_bytes = max_bytes or int(os.getenv("TUBEAUTO_WORKSPACE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        self.max_job_bytes = max_job_bytes or int(os.getenv("TUBEAUTO_JOB_MAX_BYTES", DEFAULT_MAX_JOB_BYTES))
+        if retention_days is None:
+            retention_days = float(os.getenv("TUBEAUTO_JOB_RETENTION_DAYS", DEFAULT_RETENTION_DAYS))
+        self.retention_seconds = retention_days * 24 * 3600 if retention_days > 0 else None
+        os.makedirs(self.root, exist_ok=True)
+
+    def lock(self) -> FileLock:
+        """ワークスペース全体の排他ロックを返す（with文で使う）"""
+        return FileLock(os.path.join(self.root, LOCK_FILE))
+
+    def jobs(self) -> list:
+        """
+        ジョブのディレクトリの一覧（最も長く使われていない順）
+
+        Returns:
+            {"job_dir", "bytes", "last_used"} のリスト。last_usedはマニフェスト（なければディレクトリ）の更新日時
+        """
+        jobs = []
+        for name in os.listdir(self.root):
+            job_dir = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(job_dir):
+                continue
+            try:
+                manifest = os.path.join(job_dir, MANIFEST_FILE)
+                last_used = os.path.getmtime(manifest if os.path.exists(manifest) else job_dir)
+            except FileNotFoundError:
+                continue
+            jobs.append({"job_dir": job_dir, "bytes": tree_size(job_dir), "last_used": last_used})
+        return sorted(jobs, key=lambda job: job["last_used"])
+
+    def usage(self) -> dict:
+        """ディスク使用量の概要（表示用）"""
+        jobs = self.jobs()
+        return {
+            "jobs": len(jobs),
+            "bytes": sum(job["bytes"] for job in jobs),
+            "max_bytes": self.max_bytes,
+            "max_job_bytes": self.max_job_bytes,
+        }
+
+    def remove_job(self, job_dir: str) -> None:
+        """
+        ジョブのディレクトリを削除する（名前を変えてから削除するので、途中で止まっても中途半端に残らない）
+        """
+        trash = os.path.join(self.root, f"{TRASH_PREFIX}{os.path.basename(job_dir)}-{os.getpid()}")
+        try:
+            os.replace(job_dir, trash)
+        except FileNotFoundError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def check_job(self, job_dir: str) -> None:
+        """
+        ジョブのディスク使用量が上限以内かどうかを確かめる
+
+        Args:
+            job_dir: ジョブのディレクトリ
+
+        Raises:
+            Exception: 上限を超えている場合
+        """
+        size = tree_size(job_dir)
+        if size > self.max_job_bytes:
+            raise Exception(f"ジョブのディスク使用量が上限を超えました"
+                            f"（{format_bytes(size)} / {format_bytes(self.max_job_bytes)}）")
+
+    def enforce(self, protect=(), reserve_bytes: int = 0) -> list:
+        """
+        保存期間を過ぎたジョブを削除し、全体の容量が上限を超えていれば最も長く使われていないジョブから削除する
+
+        Args:
+            protect: 削除しないジョブのディレクトリ（実行中のものなど）
+            reserve_bytes: これから使う分として空けておく容量
+
+        Returns:
+            削除したジョブのディレクトリのリスト
+        """
+        protect = {os.path.abspath(path) for path in protect}
+        now = time.time()
+        removed = []
+        with self.lock():
+            jobs = self.jobs()
+            total = sum(job["bytes"] for job in jobs) + reserve_bytes
+            for job in jobs:
+                expired = self.retention_seconds is not None and now - job["last_used"] > self.retention_seconds
+                if total <= self.max_bytes and not expired:
+                    continue
+                # 実行中のジョブと、別のプロセスが使っているかもしれない最近のジョブは残す
+                if job["job_dir"] in protect or now - job["last_used"] < ORPHAN_GRACE_SECONDS:
+                    continue
+                self.remove_job(job["job_dir"])
+                total -= job["bytes"]
+                removed.append(job["job_dir"])
+        return removed
+
+    def reserve(self, protect=(), reserve_bytes: int = None) -> list:
+        """
+        ジョブを始める前に、必要な空き容量を確保する
+
+        Args:
+            protect: 削除しないジョブのディレクトリ
+            reserve_bytes: 空けておく容量（Noneの場合はジョブ1つあたりの上限）
+
+        Returns:
+            削除したジョブのディレクトリのリスト
+
+        Raises:
+            Exception: 古いジョブを削除しても容量が足りない場合
+        """
+        reserve_bytes = self.max_job_bytes if reserve_bytes is None else reserve_bytes
+        removed = self.enforce(protect, reserve_bytes)
+        used = self.usage()["bytes"]
+        if used + reserve_bytes > self.max_bytes:
+            raise Exception(f"ワークスペースの容量が足りません（使用中 {format_bytes(used)} / "
+                            f"上限 {format_bytes(self.max_bytes)}）。実行中のジョブが終わってから再試行してください。")
+        return removed
+
+    def clean_orphans(self, protect=(), grace: float = ORPHAN_GRACE_SECONDS) -> int:
+        """
+        異常終了で残った一時ファイルを削除する（起動時に呼ぶ）
+
+        ジョブのディレクトリ内のレンダリングの途中のファイル（segments_*、*.part、*.tmp）、
+        作業用ディレクトリの一時ファイル、削除の途中で止まったジョブを対象にする。
+
+        Args:
+            protect: 対象にしないジョブのディレクトリ（実行中のものなど）
+            grace: この時間内に更新されたものは、別のプロセスが使っている可能性があるので残す（秒）
+
+        Returns:
+            削除したバイト数
+        """
+        protect = {os.path.abspath(path) for path in protect}
+        now = time.time()
+        candidates = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(TRASH_PREFIX):
+                candidates.append(path)
+            elif os.path.isdir(path) and not name.startswith(".") and path not in protect:
+                try:
+                    children = os.listdir(path)
+                except FileNotFoundError:
+                    continue
+                candidates += [
+                    os.path.join(path, child) for child in children
+                    if child.startswith(_ORPHAN_DIR_PREFIXES) or child.endswith(_ORPHAN_FILE_SUFFIXES)
+                ]
+        scratch = scratch_dir()
+        if scratch:
+            candidates += [os.path.join(scratch, name) for name in os.listdir(scratch)
+                           if name.startswith(SCRATCH_PREFIX)]
+
+        removed = 0
+        for path in candidates:
+            try:
+                if now - os.path.getmtime(path) < grace and not os.path.basename(path).startswith(TRASH_PREFIX):
+                    continue
+            except FileNotFoundError:
+                continue
+            size = tree_size(path) if os.path.isdir(path) else os.path.getsize(path)
+            _remove(path)
+            removed += size
+        return removed